@@ -0,0 +1,91 @@
+# Import packages
+import os
+import sys
+import argparse
+
+from jupyterworkflow import pipeline
+
+####################################################################################
+####################################################################################
+################ Command line of the workflow: python -m jupyterworkflow ###########
+####################################################################################
+####################################################################################
+
+
+def parse_args(argv=None):
+
+    """
+    Parse the arguments of the command line
+
+    Parameters
+    ----------
+    argv : list of str (optional)
+        Arguments, sys.argv[1:] if None
+
+    Returns
+    ----------
+    args : argparse.Namespace
+
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='python -m jupyterworkflow',
+        description='Download the flights files and build all_data.db, skipping the stages '
+                    'whose inputs did not change since their last run')
+
+    parser.add_argument('--start-year', type=int, default=1987, help='first year (default: 1987)')
+    parser.add_argument('--last-year', type=int, default=2008, help='last year (default: 2008)')
+    parser.add_argument('--workdir', default='.',
+                        help='folder of the source folder, the current folder by default')
+    parser.add_argument('--base-url', default=None, help='url of the folder of the files')
+    parser.add_argument('--chunksize', type=int, default=3000000, help='chunksize of raw_data_entry')
+    parser.add_argument('--memory-budget', default=None, help="memory of raw_data_entry, for example '4GB'")
+    parser.add_argument('--encoded', action='store_true', help='store integer ids in raw_data table')
+    parser.add_argument('--no-profile', action='store_true',
+                        help='do not profile the yearly files before raw_data_entry')
+    parser.add_argument('--workers', type=int, default=2, help='stages running at once (default: 2)')
+    parser.add_argument('--force', nargs='*', default=None, metavar='STAGE',
+                        help='run these stages even if up to date, every stage without a name')
+    parser.add_argument('--dry-run', action='store_true', help='list the stages that would run')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+
+    """
+    Run the workflow pipeline and print the timing of each stage
+
+    Parameters
+    ----------
+    argv : list of str (optional)
+        Arguments, sys.argv[1:] if None
+
+    Returns
+    ----------
+    code : int
+        0 if no stage failed, 1 otherwise
+
+    """
+
+    args = parse_args(argv)
+    os.chdir(args.workdir)
+
+    stages = pipeline.build_stages(args.start_year, args.last_year, base_url=args.base_url,
+                                   chunksize=args.chunksize, encoded=args.encoded,
+                                   memory_budget=args.memory_budget, profile=not args.no_profile)
+
+    if args.force is None:
+        force = ()
+    else:
+        force = args.force or True
+
+    summary = pipeline.run_pipeline(stages, workers=args.workers, force=force, dry_run=args.dry_run)
+
+    print(pipeline.format_summary(summary))
+
+    return int(any(record['status'] == 'failed' for record in summary))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
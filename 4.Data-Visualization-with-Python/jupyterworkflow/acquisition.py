@@ -0,0 +1,271 @@
+# Import packages
+import os
+import shutil
+import time
+import bz2
+
+from jupyterworkflow import cache as download_cache
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+########################### Packages to get flights data ###########################
+####################################################################################
+####################################################################################
+
+# Source of the flights and supplemental files
+BASE_URL = 'http://stat-computing.org/dataexpo/2009/'
+
+
+def get_url(start_year=1987, last_year=2008, base_url=BASE_URL):
+
+    """
+    Create url list and filepath list
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        the first year to start the download range
+    last_year : int (optional)
+        the last year to end the download range
+    base_url : str (optional)
+        url of the folder of the files, for example a local HTTP stand-in
+
+    Returns
+    ----------
+    url : list of str
+        List with complete url from the start_year to last_year
+    filepath : list of str
+        List with the complete filepath where files will be downloaded
+    """
+    
+    # Create lists
+    url, filepath = [], []
+    
+    for year in range(start_year,last_year+1):
+    
+        # Create full url string
+        url_str = base_url+str(year)+'.csv.bz2'
+
+        # Append url string to the list
+        url.append(url_str)
+
+        # Create full filepath string
+        filepath_str = 'source/'+str(year)+'.csv.bz2'
+
+        # Append filepath string to the list
+        filepath.append(filepath_str)
+
+    return url, filepath
+
+
+
+def unzip_file(filepath, remove=True):
+
+    """
+    Unzip a bz2 format file to csv format, streaming it in blocks so the
+    decompressed file never has to fit in memory
+
+    Parameters
+    ----------
+    filepath : str
+        Complete filepath of the bz2 file
+    remove : bool (optional)
+        if True, delete the bz2 file after unzip
+
+    Returns
+    ----------
+    newfilepath : str
+        Complete filepath of the csv file
+
+    """
+
+    # Remove the suffix (.bz2) at end of the file path
+    newfilepath = filepath[:-4]
+
+    with bz2.BZ2File(filepath) as zipfile, open(newfilepath, 'wb') as file:
+        shutil.copyfileobj(zipfile, file, 16*1024**2)
+
+    if remove:
+        os.remove(filepath)
+
+    return newfilepath
+
+
+def get_download_and_unzip(filepath, url, force_download=False, cache=None):
+
+    """
+    1. Download all the files from url list (bz2 format), with a conditional
+       request when the csv file is the one recorded in the download cache
+    2. Unzip bz2 format files to csv format
+    3. Delete bz2 format files
+
+    Parameters
+    ----------
+    url : list of str
+        List with complete url from the start_year to last_year
+    filepath : list of str
+        List with the complete filepath where files will be downloaded
+    force_download : bool (opitional)
+        if True, force redownload of data
+    cache : cache.DownloadCache (optional)
+        Download cache, the one of source/download_cache.json if None
+
+    Returns
+    ----------
+    d_start_l : list of time float
+        List with download start time of each bz2 file
+    d_end_l : list of time float
+        List with download end time of each bz2 file
+    u_start_l : list of time float
+        List with unzip start time of each bz2 file
+    u_end_l : list of time float
+        List with unzip end time of each bz2 file
+    """
+    
+    # Dictionary
+    # download_start_time_list = d_start_l
+    # download_end_time_list = d_end_l
+    # unzip_start_time_list = u_start_l
+    # unzip_end_time_list = u_end_l
+    
+    d_start_l, d_end_l = [], []
+    u_start_l, u_end_l = [], []
+
+    if cache is None:
+        cache = download_cache.DownloadCache()
+
+    csv_filepath = filepath[:-4]
+
+    # csv files downloaded before the cache existed get their validators
+    # from a HEAD request instead of a new download
+    if not force_download and os.path.exists(csv_filepath) and url not in cache.entries:
+        cache.adopt(url, csv_filepath)
+        
+    # -------- Calculate download time: start
+    start_1 = time.time()
+    
+    with instrument.span('download'):
+        status = cache.fetch(url, filepath, target=csv_filepath, force=force_download)
+        
+    # -------- Calculate download time: end
+    end_1 = time.time()
+
+    if status == 'downloaded':
+        
+        # -------- Calculate unzip time: start
+        start_2 = time.time()
+        
+        # Unzip to source folder and delete zip file
+        with instrument.span('unzip') as span:
+            span.add(bytes=os.path.getsize(unzip_file(filepath)))
+
+        # Record the csv file, so the next run sends a conditional request
+        cache.record(url, filepath, csv_filepath)
+        
+        # -------- Calculate unzip time: end
+        end_2 = time.time()
+        
+        # Add execution time to list
+        d_start_l.append(start_1)
+        d_end_l.append(end_1)
+        u_start_l.append(start_2)
+        u_end_l.append(end_2)
+    else:
+        print(csv_filepath,'is up to date')
+    return d_start_l, d_end_l, u_start_l, u_end_l
+
+
+def get_flights_data(url, filepath, cache=None):
+
+    """
+    1. Create source directory
+    2. Execute get_download_and_unzip function to all urls
+    3. Calculate and shows execution time of each step (download & unzip)
+    4. Calculate and shows total execution time (download & unzip) and the use of storage of the downloaded files
+
+    Parameters
+    ----------
+    url : list of str
+        List with complete url from the start_year to last_year
+    filepath : list of str
+        List with the complete filepath where files will be downloaded
+    cache : cache.DownloadCache (optional)
+        Download cache, the one of source/download_cache.json if None
+
+    Returns
+    ----------
+    status : dict
+        'downloaded' or 'not_modified' for each csv file
+
+    """
+
+    if not os.path.exists('source/'):
+        os.mkdir('source/')
+    else:
+        pass
+
+    if cache is None:
+        cache = download_cache.DownloadCache()
+
+    status = {}
+
+    with instrument.span('get_flights_data', files=len(url)) as stage:
+
+        for file in range(0,len(url)):
+
+            with instrument.span('download_and_unzip', year=filepath[file][7:-8],
+                                 file='{} of {}'.format(file+1, len(url))):
+                d_start_l = get_download_and_unzip(filepath[file], url[file], cache=cache)[0]
+            status[filepath[file][:-4]] = 'downloaded' if d_start_l else 'not_modified'
+
+        statinfo = []
+
+        for file in range(0,len(filepath)):
+
+            file_bytes = os.stat(filepath[file][:-4]).st_size
+
+            statinfo.append(file_bytes)
+
+        # Size of the downloaded files, the children counted bytes transferred
+        stage.fields['size_gb'] = round(sum(statinfo)/1024**3, 2)
+
+    return status
+
+
+def get_supplemental_data(base_url=BASE_URL, cache=None, force_download=False):
+
+    """
+    Download supplemental files from http://stat-computing.org, with a
+    conditional request for the files already in the download cache
+
+    Parameters
+    ----------
+    base_url : str (optional)
+        url of the folder of the files, for example a local HTTP stand-in
+    cache : cache.DownloadCache (optional)
+        Download cache, the one of source/download_cache.json if None
+    force_download : bool (optional)
+        if True, force redownload of data
+
+    Returns
+    ----------
+    status : dict
+        'downloaded' or 'not_modified' for each file
+
+    """
+    sup_files = ['airports','carriers','plane-data']
+
+    if cache is None:
+        cache = download_cache.DownloadCache()
+
+    status = {}
+
+    for file in sup_files:
+        filepath = 'source/'+file+'.csv'
+        url = base_url+file+'.csv'
+
+        with instrument.span('supplemental', file=file):
+            status[file] = cache.fetch(url, filepath, force=force_download)
+
+    return status
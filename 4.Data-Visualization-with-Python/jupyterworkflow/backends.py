@@ -0,0 +1,391 @@
+# Import packages
+import os
+import sqlite3
+import pandas as pd
+
+from jupyterworkflow import chunking
+from jupyterworkflow import dictionary
+from jupyterworkflow import ingest
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+################### Packages to run the queries on several engines #################
+####################################################################################
+####################################################################################
+
+# Supplemental tables and their csv files
+SUPPLEMENTAL_FILES = {'airports': 'airports.csv',
+                      'carriers': 'carriers.csv',
+                      'plane_data': 'plane-data.csv'}
+
+
+def _sql_string(value):
+
+    """
+    Quote a string or a list of strings as a SQL literal, for statements such
+    as CREATE VIEW and COPY that take no parameters
+    """
+
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(_sql_string(item) for item in value) + ']'
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class SQLiteBackend:
+
+    """
+    Backend on the SQLite database of the workflow, the tables are built
+    with the functions of ingest module.
+
+    Every backend has the same methods: build_tables, query, iter_query,
+    explain, is_encoded, load_codes and close, so query_to_df(query, backend=backend)
+    and the notebook queries run on any of them, see DuckDBBackend for the
+    Date column.
+
+    Parameters
+    ----------
+    database : str (optional)
+        Complete filepath of the database
+    conn : sqlite3.Connection (optional)
+        Open connection, used instead of database
+
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, database='source/all_data.db', conn=None):
+        self.database = database
+        self._conn = conn
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database)
+        return self._conn
+
+    def build_tables(self, start_year=1987, last_year=2008, chunksize=3000000, encoded=False):
+
+        """
+        Create raw_data, supplemental and data tables from the csv files
+
+        Parameters
+        ----------
+        start_year : int (optional)
+            First year
+        last_year : int (optional)
+            Last year
+        chunksize : int (optional)
+            Chunksize of raw_data_entry function
+        encoded : bool (optional)
+            if True, use the dictionary-encoded layout
+
+        Returns
+        ----------
+
+        """
+
+        self.close()
+
+        with instrument.span('build_tables', backend=self.name):
+            # The stage functions close their connection
+            ingest.create_raw_table(sqlite3.connect(self.database), encoded=encoded)
+            ingest.raw_data_entry(sqlite3.connect(self.database), start_year, last_year, chunksize=chunksize)
+            ingest.create_supl_tables(sqlite3.connect(self.database))
+            ingest.supl_tables_data_entry(sqlite3.connect(self.database))
+            ingest.create_data_table(sqlite3.connect(self.database))
+
+    def query(self, query):
+        return pd.read_sql_query(query, self.conn)
+
+    def iter_query(self, query, chunksize=500000, memory_budget=None):
+
+        """
+        Run a SQL query and fetch its result in chunks
+
+        Parameters
+        ----------
+        query : str
+            SQL query
+        chunksize : int (optional)
+            Rows of each chunk, ignored if memory_budget is given
+        memory_budget : int or str (optional)
+            Memory allowed for each chunk, see chunking.ChunkSizer
+
+        Returns
+        ----------
+        chunks : generator of pandas.DataFrame
+
+        """
+
+        if memory_budget is not None:
+            return chunking.iter_query(query, self.conn, chunking.ChunkSizer(memory_budget))
+        return pd.read_sql_query(sql=query, con=self.conn, chunksize=chunksize)
+
+    def explain(self, query):
+        # Last column of EXPLAIN QUERY PLAN rows is the step, e.g. SCAN data
+        return [row[-1] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + query)]
+
+    def is_encoded(self):
+        return dictionary.is_encoded(self.conn)
+
+    def load_codes(self):
+        return dictionary.load_codes(self.conn)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class DuckDBBackend:
+
+    """
+    Backend on DuckDB, an embedded vectorized engine that scans and
+    aggregates on every core. data and the supplemental tables are views
+    over one of the sources:
+    - 'csv': the yearly csv files, read in place. Their rows are counted
+      once by build_tables
+    - 'parquet': Parquet files written once from the csv files
+    - 'sqlite': the tables of the SQLite database, with the sqlite extension of DuckDB
+    Over the files, the Id of data is the position of the row, the Id
+    SQLiteBackend gives it.
+
+    Date is a DATE column instead of the Year-Month-DayofMonth text of
+    SQLite: comparisons with date('...') and with date strings run on both
+    engines, but SQLite functions on the text, such as strftime, julianday,
+    substr or LIKE on Date, fail or give other results on DuckDB.
+
+    Parameters
+    ----------
+    source : str (optional)
+        'csv', 'parquet' or 'sqlite'
+    directory : str (optional)
+        Folder of the csv files
+    database : str (optional)
+        DuckDB database file, in memory if ':memory:'
+    sqlite_database : str (optional)
+        Complete filepath of the SQLite database for the 'sqlite' source
+    threads : int (optional)
+        Threads of DuckDB, every core if None
+
+    """
+
+    name = 'duckdb'
+
+    def __init__(self, source='csv', directory='source', database=':memory:',
+                 sqlite_database='source/all_data.db', threads=None):
+
+        if source not in ('csv', 'parquet', 'sqlite'):
+            raise ValueError('unknown source: {!r}'.format(source))
+
+        self.source = source
+        self.directory = directory
+        self.database = database
+        self.sqlite_database = sqlite_database
+        self.threads = threads
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            # Optional dependency, only needed by this backend
+            import duckdb
+
+            self._conn = duckdb.connect(self.database)
+            if self.threads is not None:
+                self._conn.execute('SET threads = {:d}'.format(self.threads))
+        return self._conn
+
+    def _csv_files(self, start_year, last_year):
+        files = [os.path.join(self.directory, '{}.csv'.format(year)) for year in range(start_year, last_year+1)]
+        return [file for file in files if os.path.exists(file)]
+
+    def _parquet_files(self, start_year, last_year):
+
+        """
+        Write a Parquet file of each yearly csv file that has none yet
+        """
+
+        folder = os.path.join(self.directory, 'parquet')
+        os.makedirs(folder, exist_ok=True)
+        files = []
+
+        for year in range(start_year, last_year+1):
+            filepath = os.path.join(folder, '{}.parquet'.format(year))
+            csv_file = os.path.join(self.directory, '{}.csv'.format(year))
+
+            if not os.path.exists(filepath) and os.path.exists(csv_file):
+                with instrument.span('write_parquet', year=year):
+                    self.conn.execute("""COPY (SELECT * FROM read_csv({}, header=true, nullstr='NA'))
+                                           TO {} (FORMAT parquet)""".format(_sql_string(csv_file),
+                                                                            _sql_string(filepath)))
+            if os.path.exists(filepath):
+                files.append(filepath)
+
+        return files
+
+    def build_tables(self, start_year=1987, last_year=2008, chunksize=None, encoded=False):
+
+        """
+        Create raw_data, supplemental and data views over the source files
+
+        Parameters
+        ----------
+        start_year : int (optional)
+            First year
+        last_year : int (optional)
+            Last year
+        chunksize : int (optional)
+            Not used, the files are read in place
+        encoded : bool (optional)
+            Not supported, the views keep the text codes
+
+        Returns
+        ----------
+
+        """
+
+        if encoded:
+            raise ValueError('the dictionary-encoded layout is only built by SQLiteBackend')
+
+        c = self.conn
+
+        with instrument.span('build_tables', backend=self.name, source=self.source):
+
+            if self.source == 'sqlite':
+                c.execute('ATTACH {} AS sqlite_db (TYPE sqlite, READ_ONLY)'.format(_sql_string(self.sqlite_database)))
+                for table in ['raw_data', 'data'] + list(SUPPLEMENTAL_FILES):
+                    c.execute('CREATE OR REPLACE VIEW {0} AS SELECT * FROM sqlite_db.{0}'.format(table))
+                return
+
+            if self.source == 'parquet':
+                files = self._parquet_files(start_year, last_year)
+            else:
+                files = self._csv_files(start_year, last_year)
+
+            if not files:
+                raise FileNotFoundError('no flights file between {} and {} in {}'.format(
+                    start_year, last_year, self.directory))
+
+            if self.source == 'parquet':
+                scans = ['read_parquet({}, file_row_number=true)'.format(_sql_string(file)) for file in files]
+                c.execute('CREATE OR REPLACE VIEW raw_data AS SELECT * FROM read_parquet({}, union_by_name=true)'
+                          .format(_sql_string(files)))
+                rows = dict(c.execute('SELECT file_name, num_rows FROM parquet_file_metadata({})'.format(
+                    _sql_string(files))).fetchall())
+                rows = [rows[file] for file in files]
+                positions = ['file_row_number'] * len(files)
+            else:
+                scans = ["read_csv({}, header=true, nullstr='NA')".format(_sql_string(file)) for file in files]
+                c.execute("CREATE OR REPLACE VIEW raw_data AS SELECT * FROM read_csv({}, header=true, nullstr='NA', "
+                          "union_by_name=true)".format(_sql_string(files)))
+                with instrument.span('count_rows', files=len(files)):
+                    rows = [c.execute('SELECT COUNT(*) FROM ' + scan).fetchone()[0] for scan in scans]
+                # The csv reader gives no row position: a window without
+                # partition or order streams the rows in the order of the
+                # file, DuckDB keeps the insertion order by default
+                positions = ['row_number() OVER () - 1'] * len(files)
+
+            # Id is the position of the row in its file plus the rows of the
+            # files before it, the Id SQLiteBackend gives to the same years
+            selects, offset = [], 0
+            for scan, position, count in zip(scans, positions, rows):
+                selects.append("""SELECT {:d} + {} + 1 AS Id,
+                                         Year,
+                                         Month,
+                                         DayofMonth,
+                                         FlightNum,
+                                         Distance,
+                                         UniqueCarrier,
+                                         TailNum,
+                                         Origin,
+                                         Dest,
+                                         make_date(Year, Month, DayofMonth) AS Date
+                                    FROM {}""".format(offset, position, scan))
+                offset += count
+
+            c.execute('CREATE OR REPLACE VIEW data AS ' + '\n UNION ALL '.join(selects))
+
+            for table, file in SUPPLEMENTAL_FILES.items():
+                filepath = os.path.join(self.directory, file)
+                if os.path.exists(filepath):
+                    c.execute('CREATE OR REPLACE VIEW {} AS SELECT * FROM read_csv({}, header=true)'.format(
+                        table, _sql_string(filepath)))
+
+    def query(self, query):
+        return self.conn.execute(query).df()
+
+    def iter_query(self, query, chunksize=500000, memory_budget=None):
+
+        """
+        Run a SQL query and fetch its result in chunks
+
+        Parameters
+        ----------
+        query : str
+            SQL query
+        chunksize : int (optional)
+            Rows of each chunk, rounded to DuckDB vectors of 2048 rows
+        memory_budget : int or str (optional)
+            Memory allowed for each chunk, see chunking.ChunkSizer
+
+        Returns
+        ----------
+        chunks : generator of pandas.DataFrame
+
+        """
+
+        sizer = chunking.ChunkSizer(memory_budget) if memory_budget is not None else None
+        result = self.conn.execute(query)
+
+        while True:
+            rows = sizer.next_size() if sizer is not None else chunksize
+            chunk = result.fetch_df_chunk(max(1, rows//2048))
+            if not len(chunk):
+                return
+            if sizer is not None:
+                sizer.observe(len(chunk), chunk.memory_usage(index=False, deep=True).sum())
+            yield chunk
+
+    def explain(self, query):
+        # Rows of EXPLAIN are (type, plan), the plan drawn as a tree
+        return [line for _, plan in self.conn.execute('EXPLAIN ' + query).fetchall()
+                for line in plan.splitlines() if line.strip()]
+
+    def is_encoded(self):
+        return False
+
+    def load_codes(self):
+        return None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def get_backend(name='sqlite', **kwargs):
+
+    """
+    Create a backend by name
+
+    Parameters
+    ----------
+    name : str (optional)
+        'sqlite' or 'duckdb'
+    kwargs : dict (optional)
+        Arguments of the backend class
+
+    Returns
+    ----------
+    backend : SQLiteBackend or DuckDBBackend
+
+    """
+
+    backends = {'sqlite': SQLiteBackend, 'duckdb': DuckDBBackend}
+
+    if name not in backends:
+        raise ValueError('unknown backend: {!r}'.format(name))
+
+    return backends[name](**kwargs)
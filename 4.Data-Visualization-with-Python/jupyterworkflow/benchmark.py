@@ -0,0 +1,1575 @@
+# Import packages
+import pandas as pd
+import numpy as np
+import os
+import time
+import sys
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from jupyterworkflow import data
+from jupyterworkflow import backends
+from jupyterworkflow import cache
+from jupyterworkflow import instrument
+from jupyterworkflow import sampling
+from jupyterworkflow import synthetic
+
+####################################################################################
+####################################################################################
+##################### Packages to benchmark the workflow stages ####################
+####################################################################################
+####################################################################################
+
+# Queries of the report, pulled with query_to_df
+REPORT_QUERIES = {
+    'dest': """SELECT Dest
+                 FROM data""",
+    'hubs': """SELECT Date, UniqueCarrier, Description, Origin
+                 FROM data
+            LEFT JOIN carriers ON carriers.Code = data.UniqueCarrier
+                WHERE Origin = 'ORD' OR
+                      Origin = 'ATL' OR
+                      Origin = 'DFW' OR
+                      Origin = 'LAX' OR
+                      Origin = 'PHX'""",
+    'routes': """SELECT Date, Origin, Dest,
+                        airport1.airport AS airport1,
+                        airport2.airport AS airport2,
+                        airport1.lat AS start_lat,
+                        airport1.long AS start_long,
+                        airport2.lat AS end_lat,
+                        airport2.long AS end_long,
+                        Distance
+                   FROM data
+              LEFT JOIN airports AS airport1 ON airport1.iata = data.Origin
+              LEFT JOIN airports AS airport2 ON airport2.iata = data.Dest
+                  WHERE Date >= date('2008-01-01')""",
+}
+
+
+def measure(stage, func, *args, trace_memory=True, rows=None, **kwargs):
+
+    """
+    Time one stage and measure its memory
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage
+    func : callable
+        Function that runs the stage
+    trace_memory : bool (optional)
+        if True, measure the peak of Python allocations with tracemalloc.
+        Tracing slows the stage down, so timings are lower without it
+    rows : int or callable (optional)
+        Number of rows of the stage, or a function of the result returning it
+
+    Returns
+    ----------
+    result : object
+        Result of func
+    record : dict
+        Stage, seconds, rows, rows per second, traced peak and peak RSS in MB
+
+    """
+
+    if trace_memory:
+        tracemalloc.start()
+
+    with instrument.span('benchmark', stage=stage) as span:
+        result = func(*args, **kwargs)
+
+        if callable(rows):
+            rows = rows(result)
+        if rows:
+            # Rows of the stage, not the sum rolled up from its chunks
+            span.counters['rows'] = rows
+
+    traced_peak = np.nan
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]/1024**2
+        tracemalloc.stop()
+
+    record = {'stage': stage,
+              'seconds': span.seconds,
+              'rows': rows,
+              'rows_per_sec': rows/span.seconds if rows and span.seconds else np.nan,
+              'traced_peak_mb': traced_peak,
+              'peak_rss_mb': span.peak_rss}
+
+    return result, record
+
+
+@contextmanager
+def working_directory(workdir=None, keep=False):
+
+    """
+    Run a benchmark inside a folder, as the workflow functions use paths
+    relative to the source folder
+
+    Parameters
+    ----------
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    """
+
+    temporary = workdir is None
+    workdir = tempfile.mkdtemp(prefix='jupyterworkflow-') if temporary else workdir
+    cwd = os.getcwd()
+
+    try:
+        os.makedirs(workdir, exist_ok=True)
+        os.chdir(workdir)
+        yield workdir
+    finally:
+        os.chdir(cwd)
+        if temporary and not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report_aggregations(df_hubs, df_dest):
+
+    """
+    Run the aggregations of the report charts. Results of query_to_df in
+    sample mode are scaled with their weight column
+
+    Parameters
+    ----------
+    df_hubs : pandas.DataFrame
+        Result of the hubs query
+    df_dest : pandas.DataFrame
+        Result of the dest query
+
+    Returns
+    ----------
+    results : dict
+        Result of each aggregation
+
+    """
+
+    top_3 = ['American Airlines Inc.', 'Delta Air Lines Inc.', 'United Air Lines Inc.']
+    df_hubs['Description_2'] = np.where(df_hubs['Description'].isin(top_3), df_hubs['Description'], 'other')
+    df_hubs['Description_2'] = df_hubs['Description_2'].astype('category')
+
+    def counts(df, by):
+        if 'weight' in df.columns:
+            return sampling.weighted_counts(df, by)['count'].sort_index()
+        return df.groupby(by=by, observed=True).size()
+
+    hubs_weight = df_hubs.get('weight')
+
+    return {'dest_ranking': sampling.weighted_value_counts(df_dest.Dest, df_dest.get('weight'))[:10],
+            'carrier_ranking': sampling.weighted_value_counts(df_hubs.Description, hubs_weight)[:10],
+            'carrier_share': sampling.weighted_value_counts(df_hubs.Description_2, hubs_weight),
+            'daily_hubs': counts(df_hubs, ['Origin', 'Date']),
+            'daily_carriers': counts(df_hubs, ['Description_2', 'Date']),
+            'hub_carriers': counts(df_hubs, ['Origin', 'Description_2'])}
+
+
+def benchmark_pipeline(rows=100000, start_year=2007, last_year=2008, workdir=None,
+                       chunksize=500000, trace_memory=True, seed=0, keep=False):
+
+    """
+    Run every stage of the workflow on synthetic data and measure time and memory:
+    decompress, create_raw_table, raw_data_entry, supplemental tables,
+    create_data_table, query_to_df of the report queries and the report aggregations
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and query_to_df
+    trace_memory : bool (optional)
+        if True, measure the peak of Python allocations of each stage
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        One record per stage, see measure. The size of all_data.db is
+        stored in report.attrs['database_size_mb']
+
+    """
+
+    records = []
+
+    def stage(name, func, *args, **kwargs):
+        result, record = measure(name, func, *args, trace_memory=trace_memory, **kwargs)
+        records.append(record)
+        return result
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+        total_rows = rows*(last_year - start_year + 1)
+
+        filepath = synthetic.generate_flights_data(start_year, last_year, rows, 'source',
+                                                   compress=True, seed=seed)
+
+        stage('decompress', lambda: [data.unzip_file(file) for file in filepath], rows=total_rows)
+        stage('create_raw_table', data.create_raw_table, sqlite3.connect(database))
+        stage('raw_data_entry', data.raw_data_entry, sqlite3.connect(database),
+              start_year, last_year, chunksize=chunksize, rows=total_rows)
+        stage('create_supl_tables', data.create_supl_tables, sqlite3.connect(database))
+        stage('supl_tables_data_entry', data.supl_tables_data_entry, sqlite3.connect(database))
+        stage('create_data_table', data.create_data_table, sqlite3.connect(database), rows=total_rows)
+
+        df = {}
+        for name, query in REPORT_QUERIES.items():
+            conn = sqlite3.connect(database)
+            df[name] = stage('query_to_df:' + name, data.query_to_df, query, conn,
+                             chunksize=chunksize, rows=len)
+            conn.close()
+
+        stage('report_aggregations', report_aggregations, df['hubs'], df['dest'],
+              rows=len(df['hubs']) + len(df['dest']))
+
+        database_size = os.path.getsize(database)/1024**2
+        print('database size:','{:0.1f}'.format(database_size),'MB')
+
+    report = pd.DataFrame(records)
+    report.attrs['database_size_mb'] = database_size
+
+    return report
+
+
+def benchmark_encoded_layout(rows=200000, start_year=2007, last_year=2008, workdir=None,
+                             chunksize=500000, repeat=3, seed=0, keep=False):
+
+    """
+    Compare the file size and scan time of the TEXT layout of the fact tables
+    with the dictionary-encoded layout (create_raw_table(conn, encoded=True))
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and query_to_df
+    repeat : int (optional)
+        Number of runs of each query, the best time is kept
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        File size and query times of each layout
+
+    """
+
+    queries = {'scan': 'SELECT Origin, Dest, UniqueCarrier, TailNum FROM data',
+               'group_count': 'SELECT Origin, COUNT(*) FROM data GROUP BY Origin'}
+
+    def best_time(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    records = []
+
+    with working_directory(workdir, keep):
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+
+        for layout, encoded in [('text', False), ('encoded', True)]:
+            database = 'source/{}.db'.format(layout)
+
+            data.create_raw_table(sqlite3.connect(database), encoded=encoded)
+            data.raw_data_entry(sqlite3.connect(database), start_year, last_year, chunksize=chunksize)
+            data.create_data_table(sqlite3.connect(database))
+
+            conn = sqlite3.connect(database)
+            conn.execute('VACUUM')
+            record = {'layout': layout, 'size_mb': os.path.getsize(database)/1024**2}
+
+            for name, query in queries.items():
+                record[name + '_seconds'] = best_time(lambda: conn.execute(query).fetchall())
+
+            record['query_to_df_seconds'] = best_time(
+                lambda: data.query_to_df(queries['scan'], conn, chunksize=chunksize))
+
+            conn.close()
+            records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def benchmark_samples(rows=500000, start_year=2007, last_year=2008, workdir=None,
+                      chunksize=500000, rates=sampling.SAMPLE_RATES, seed=0, keep=False):
+
+    """
+    Compare query_to_df and the report aggregations on data table with the
+    same cells in sample mode: time, and error of the estimated destination
+    counts against the exact ones
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and query_to_df
+    rates : tuple of float (optional)
+        Sampling rates
+    seed : int (optional)
+        Seed of the synthetic generator and of the samples
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Effective sampling rate, seconds of the query and of the
+        aggregations, mean relative error of the top 10 destinations and
+        share of them inside their 95% interval
+
+    """
+
+    records = []
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        data.create_raw_table(sqlite3.connect(database))
+        data.raw_data_entry(sqlite3.connect(database), start_year, last_year, chunksize=chunksize)
+        data.create_data_table(sqlite3.connect(database))
+
+        conn = sqlite3.connect(database)
+        samples = sampling.create_samples(conn, rates, seed=seed).set_index('table')
+
+        exact = None
+
+        for sample in (None,) + tuple(rates):
+            start = time.perf_counter()
+            df = data.query_to_df(REPORT_QUERIES['dest'], conn, chunksize=chunksize, sample=sample)
+            query_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            counts = sampling.weighted_counts(df, 'Dest')
+            aggregation_seconds = time.perf_counter() - start
+
+            if exact is None:
+                exact = counts['count'][:10]
+
+            estimate = counts.reindex(exact.index)
+            inside = (estimate['lower'] <= exact) & (exact <= estimate['upper'])
+
+            name = 'data' if sample is None else sampling.sample_table(sample)
+            records.append({'sample': name,
+                            'effective_rate': 1.0 if sample is None else samples.loc[name, 'effective_rate'],
+                            'rows': len(df),
+                            'query_seconds': query_seconds,
+                            'aggregation_seconds': aggregation_seconds,
+                            'top_10_relative_error': (np.abs(estimate['count'] - exact)/exact).mean(),
+                            'top_10_coverage': inside.mean()})
+
+        conn.close()
+
+    return pd.DataFrame(records)
+
+
+def benchmark_backends(rows=500000, start_year=2007, last_year=2008, workdir=None,
+                       chunksize=500000, repeat=3, sources=('csv', 'parquet'), seed=0, keep=False):
+
+    """
+    Run the report queries with query_to_df and a scan-and-aggregate query on
+    SQLiteBackend and on DuckDBBackend over each source
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and query_to_df
+    repeat : int (optional)
+        Number of runs of each query, the best time is kept
+    sources : tuple of str (optional)
+        Sources of DuckDBBackend, see backends.DuckDBBackend
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Build time, and best time and rows of each query on each backend
+
+    """
+
+    queries = dict(REPORT_QUERIES)
+    aggregate = """SELECT Origin, COUNT(*) AS flights, AVG(Distance) AS distance
+                     FROM data
+                 GROUP BY Origin"""
+
+    def best_time(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return min(times), len(result)
+
+    records = []
+
+    with working_directory(workdir, keep):
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+
+        engines = [('sqlite', backends.SQLiteBackend('source/all_data.db'))]
+        engines += [('duckdb:' + source, backends.DuckDBBackend(source)) for source in sources]
+
+        for name, backend in engines:
+            start = time.perf_counter()
+            backend.build_tables(start_year, last_year, chunksize=chunksize)
+            build_seconds = time.perf_counter() - start
+
+            for query_name, query in queries.items():
+                seconds, result_rows = best_time(
+                    lambda: data.query_to_df(query, chunksize=chunksize, backend=backend))
+                records.append({'backend': name, 'query': 'query_to_df:' + query_name,
+                                'seconds': seconds, 'rows': result_rows, 'build_seconds': build_seconds})
+
+            seconds, result_rows = best_time(lambda: backend.query(aggregate))
+            records.append({'backend': name, 'query': 'aggregate', 'seconds': seconds,
+                            'rows': result_rows, 'build_seconds': build_seconds})
+
+            backend.close()
+
+    return pd.DataFrame(records)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+
+    """
+    Static file handler without a log line per request. It answers
+    If-Modified-Since with 304 Not Modified, as the real server does
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_directory(directory):
+
+    """
+    Serve a folder over HTTP on localhost, a stand-in for stat-computing.org
+
+    Parameters
+    ----------
+    directory : str
+        Folder with the files to be served
+
+    Returns
+    ----------
+    base_url : str
+        url of the folder, ending with /
+
+    """
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def benchmark_acquisition(rows=100000, start_year=2007, last_year=2008, workdir=None, seed=0, keep=False):
+
+    """
+    Run the acquisition step three times against a local HTTP stand-in:
+    a cold run, a rerun with nothing changed upstream and a rerun after one
+    upstream file changed, and count the requests and bytes of each run
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Seconds, requests, not modified answers, downloads and bytes of each run
+
+    """
+
+    records = []
+
+    with working_directory(workdir, keep):
+        synthetic.generate_flights_data(start_year, last_year, rows, 'upstream', compress=True, seed=seed)
+
+        with serve_directory('upstream') as base_url:
+            url, filepath = data.get_url(start_year, last_year, base_url)
+
+            for run in ['cold', 'unchanged', 'one_file_changed']:
+
+                if run == 'one_file_changed':
+                    # A new upstream version of the last year, one second newer
+                    upstream = os.path.join('upstream', '{}.csv.bz2'.format(last_year))
+                    synthetic.generate_year(last_year, rows, 'upstream', compress=True, seed=seed+1)
+                    os.utime(upstream, (time.time() + 1, time.time() + 1))
+
+                download_cache = cache.DownloadCache()
+                start = time.perf_counter()
+                data.get_flights_data(url, filepath, cache=download_cache)
+                data.get_supplemental_data(base_url, cache=download_cache)
+
+                records.append(dict(run=run, seconds=time.perf_counter() - start, **download_cache.stats))
+
+    return pd.DataFrame(records)
+
+
+# Import statements of scripts that need one stage of the workflow
+IMPORT_STATEMENTS = {
+    'data': 'import jupyterworkflow.data',
+    'data.get_url': 'from jupyterworkflow.data import get_url',
+    'acquisition': 'import jupyterworkflow.acquisition',
+    'ingest': 'import jupyterworkflow.ingest',
+    'query': 'import jupyterworkflow.query',
+}
+
+
+def benchmark_import(statements=None, repeat=3):
+
+    """
+    Measure the startup cost of importing the workflow, with
+    python -X importtime in a new interpreter for every run
+
+    Parameters
+    ----------
+    statements : dict (optional)
+        Name -> import statement, IMPORT_STATEMENTS if None
+    repeat : int (optional)
+        Number of runs of each statement, the best time is kept
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Import time in ms, modules imported, whether pandas, numpy and
+        requests were loaded, and whether a database file was created
+
+    """
+
+    if statements is None:
+        statements = IMPORT_STATEMENTS
+
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package, os.environ.get('PYTHONPATH', '')]))
+    records = []
+
+    for name, statement in statements.items():
+        best = None
+
+        for _ in range(repeat):
+            # An empty folder shows any file created at import
+            with working_directory() as workdir:
+                result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                                        capture_output=True, text=True, env=env, check=True)
+                created = sorted(os.listdir(workdir))
+
+            # Lines: import time: self [us] | cumulative | imported package
+            # Nested imports are indented by two spaces per level
+            modules, total = {}, 0
+            for line in result.stderr.splitlines():
+                parts = line.split('|')
+                if len(parts) == 3 and parts[1].strip().isdigit():
+                    module = parts[2][1:]
+                    modules[module.strip()] = int(parts[1])
+                    if not module.startswith(' '):
+                        total += int(parts[1])
+
+            if best is None or total < best['import_ms']*1000:
+                best = {'statement': name,
+                        'import_ms': total/1000,
+                        'modules': len(modules),
+                        'pandas': 'pandas' in modules,
+                        'numpy': 'numpy' in modules,
+                        'requests': 'requests' in modules,
+                        'files_created': ', '.join(created)}
+
+        records.append(best)
+
+    return pd.DataFrame(records)
+
+
+def benchmark_incremental(rows=200000, start_year=2005, last_year=2008, workdir=None,
+                          chunksize=500000, seed=0, keep=False):
+
+    """
+    Load the years one by one and time create_data_table after each one,
+    against a full rebuild of data table and its aggregates
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Rows added, rows of data table and seconds of each update, and of the
+        full rebuild in the last record
+
+    """
+
+    records = []
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        data.create_raw_table(sqlite3.connect(database))
+
+        for year in range(start_year, last_year+1):
+            data.raw_data_entry(sqlite3.connect(database), year, year, chunksize=chunksize)
+
+            start = time.perf_counter()
+            added = data.create_data_table(sqlite3.connect(database))
+            seconds = time.perf_counter() - start
+
+            conn = sqlite3.connect(database)
+            total = conn.execute('SELECT COUNT(*) FROM data').fetchone()[0]
+            conn.close()
+
+            records.append({'update': str(year), 'rows_added': added, 'data_rows': total, 'seconds': seconds})
+
+        conn = sqlite3.connect(database)
+        data.reset_derived_tables(conn)
+        conn.close()
+
+        start = time.perf_counter()
+        added = data.create_data_table(sqlite3.connect(database))
+        records.append({'update': 'full_rebuild', 'rows_added': added, 'data_rows': added,
+                        'seconds': time.perf_counter() - start})
+
+    return pd.DataFrame(records)
+
+
+def benchmark_counting(rows=10000000, repeat=3, threads=(1, 4), seed=0):
+
+    """
+    Compare the counting kernels of counting module with the pandas calls of
+    the report charts, on synthetic columns of rows flights
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of rows, 10M to 120M for the sizes of the report
+    repeat : int (optional)
+        Number of runs of each count, the best time is kept
+    threads : tuple of int (optional)
+        Thread counts of the kernels
+    seed : int (optional)
+        Seed of the synthetic columns
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Best time of each count with pandas and with the kernels
+
+    """
+
+    from jupyterworkflow import counting
+
+    rng = np.random.default_rng(seed)
+    airports = synthetic.airport_codes()
+    carriers = ['American Airlines Inc.', 'Delta Air Lines Inc.', 'United Air Lines Inc.', 'other']
+
+    df = pd.DataFrame({'Id': np.arange(rows),
+                       'Origin': pd.Categorical.from_codes(rng.zipf(1.3, rows) % len(airports), airports),
+                       'Description_2': pd.Categorical.from_codes(rng.integers(0, len(carriers), rows), carriers),
+                       'Date': pd.Timestamp('2008-01-01') + pd.to_timedelta(rng.integers(0, 366, rows), unit='D')})
+    hubs = ['ORD', 'ATL', 'DFW', 'LAX', 'PHX']
+
+    def best_time(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def twenty_lookups():
+        # One groupby per number, as the stacked bar charts do
+        return [df.groupby(by=['Origin', 'Description_2'], observed=True).count()['Id'][hub][carrier]
+                for hub in hubs for carrier in carriers]
+
+    cases = {'value_counts': (lambda: df.Origin.value_counts(),
+                              lambda n: counting.counts(df.Origin, threads=n)),
+             'groupby_count_2d': (lambda: df.groupby(by=['Origin', 'Description_2'], observed=True).count()['Id'],
+                                  lambda n: counting.crosstab(df.Origin, df.Description_2, threads=n)),
+             'twenty_lookups': (twenty_lookups,
+                                lambda n: counting.crosstab(df.Origin, df.Description_2, threads=n).loc[hubs]),
+             'date_entity': (lambda: df.groupby(by=['Date', 'Origin'], observed=True).count()['Id'],
+                             lambda n: counting.date_matrix(df.Date, df.Origin, threads=n))}
+
+    records = []
+
+    for name, (pandas_func, kernel) in cases.items():
+        record = {'count': name, 'rows': rows, 'pandas_seconds': best_time(pandas_func)}
+        for n in threads:
+            record['kernel_seconds_{}_threads'.format(n)] = best_time(lambda: kernel(n))
+        record['speedup'] = record['pandas_seconds']/record['kernel_seconds_{}_threads'.format(threads[0])]
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def benchmark_export(rows=200000, start_year=2007, last_year=2008, workdir=None,
+                     chunksize=500000, seed=0, keep=False):
+
+    """
+    Measure the export of the report aggregates and the render of the charts
+    from the bundle, against rendering them from all_data.db
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Seconds of each step, and sizes of the bundle, the charts and the database in MB
+
+    """
+
+    from jupyterworkflow import export
+
+    records = []
+
+    def step(name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        records.append({'step': name, 'seconds': time.perf_counter() - start})
+        return result
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        backends.SQLiteBackend(database).build_tables(start_year, last_year, chunksize=chunksize)
+
+        conn = sqlite3.connect(database)
+        aggregates = step('build_aggregates', export.build_aggregates, conn)
+        size = step('export_bundle', export.export_bundle, conn, aggregates=aggregates)
+        conn.close()
+
+        step('render_from_database', lambda: export.render_report(
+            export.build_aggregates(sqlite3.connect(database)), 'source/report_database'))
+        charts = step('render_from_bundle', lambda: export.render_report(
+            export.load_bundle(), 'source/report_bundle'))
+
+        report = pd.DataFrame(records)
+        report.attrs['bundle_mb'] = size/1024**2
+        report.attrs['charts_mb'] = sum(os.path.getsize(chart) for chart in charts)/1024**2
+        report.attrs['database_mb'] = os.path.getsize(database)/1024**2
+
+    return report
+
+
+def benchmark_profile(rows=200000, start_year=2001, last_year=2004, workdir=None,
+                      chunksize=500000, processes=None, seed=0, keep=False):
+
+    """
+    Measure the profiling pre-scan of the yearly files, with one and with
+    several processes, and raw_data_entry with and without its profile.
+    The synthetic years before 2003 have no delay causes, as the real files
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and profile_year
+    processes : int (optional)
+        Number of worker processes of the parallel profile
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        One record per stage, see measure. The attrs hold the empty columns
+        of each year and whether both ingests stored the same rows
+
+    """
+
+    from jupyterworkflow import profiling
+
+    records = []
+    total = (last_year - start_year + 1)*rows
+
+    with working_directory(workdir, keep):
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+
+        for name, n in [('profile_1_process', 1), ('profile_parallel', processes)]:
+            profile, record = measure(name, profiling.profile_years, start_year, last_year, processes=n,
+                                      chunksize=chunksize, trace_memory=False, rows=total)
+            records.append(record)
+
+        tables = {}
+        for name, year_profile in [('raw_data_entry', None), ('raw_data_entry_profiled', profiling.PROFILE_FILE)]:
+            database = 'source/{}.db'.format(name)
+            data.create_raw_table(sqlite3.connect(database))
+            _, record = measure(name, data.raw_data_entry, sqlite3.connect(database), start_year, last_year,
+                                chunksize=chunksize, profile=year_profile, rows=total)
+            records.append(record)
+
+            conn = sqlite3.connect(database)
+            tables[name] = pd.read_sql_query('SELECT * FROM raw_data ORDER BY Id', conn)
+            conn.close()
+
+        report = pd.DataFrame(records)
+        report.attrs['empty_columns'] = {year: profiling.empty_columns(year_profile)
+                                         for year, year_profile in profile['years'].items()}
+        # Values compared as numbers where possible, 0 and 0.0 are the same value
+        plain, profiled = (tables[name].apply(pd.to_numeric, errors='coerce').fillna(tables[name])
+                           for name in ['raw_data_entry', 'raw_data_entry_profiled'])
+        report.attrs['same_rows'] = plain.astype(str).equals(profiled.astype(str))
+
+    return report
+
+
+def _ingest_process(database, start_year, last_year, chunksize, wal):
+    instrument.set_sink(instrument.QuietSink())
+    data.raw_data_entry(sqlite3.connect(database), start_year, last_year, chunksize=chunksize, wal=wal)
+
+
+def benchmark_concurrent_reads(rows=200000, start_year=2005, last_year=2008, workdir=None,
+                               chunksize=50000, interval=0.05, timeout=5, seed=0, keep=False):
+
+    """
+    Query raw_data table while raw_data_entry loads it in another process,
+    in the rollback journal mode with a commit per chunk and in the WAL mode
+    with a commit per year. Each query counts the rows of every year
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry
+    interval : float (optional)
+        Seconds between two queries of the reader
+    timeout : float (optional)
+        Seconds a query waits for a lock before it fails
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Per mode, seconds of the ingest, queries, failed queries, queries
+        that saw a partial year and the median, p95 and max latency in ms
+
+    """
+
+    from multiprocessing import Process
+
+    records = []
+
+    with working_directory(workdir, keep):
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+
+        for mode, wal in [('rollback_journal', False), ('wal', True)]:
+            database = 'source/{}.db'.format(mode)
+            data.create_raw_table(sqlite3.connect(database))
+
+            writer = Process(target=_ingest_process, args=(database, start_year, last_year, chunksize, wal))
+            start = time.perf_counter()
+            writer.start()
+
+            latencies, failed, partial = [], 0, 0
+            reader = sqlite3.connect(database, timeout=timeout)
+
+            while writer.is_alive():
+                with instrument.span('reader_query', mode=mode) as span:
+                    try:
+                        counts = reader.execute('SELECT Year, COUNT(*) FROM raw_data GROUP BY Year').fetchall()
+                    except sqlite3.OperationalError:
+                        failed += 1
+                        counts = None
+                if counts is not None:
+                    latencies.append(span.seconds*1000)
+                    partial += any(count != rows for _, count in counts)
+                time.sleep(interval)
+
+            writer.join()
+            seconds = time.perf_counter() - start
+            reader.close()
+
+            records.append({'mode': mode,
+                            'ingest_seconds': seconds,
+                            'queries': len(latencies) + failed,
+                            'failed': failed,
+                            'partial_year_snapshots': partial,
+                            'median_ms': np.median(latencies) if latencies else np.nan,
+                            'p95_ms': np.percentile(latencies, 95) if latencies else np.nan,
+                            'max_ms': max(latencies) if latencies else np.nan})
+
+    return pd.DataFrame(records)
+
+
+def benchmark_network(rows=20000, start_year=1987, last_year=2008, workdir=None,
+                      chunksize=500000, freq='Y', seed=0, keep=False):
+
+    """
+    Time the steps of the airport network analysis of network module on
+    synthetic years
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry
+    freq : str (optional)
+        'Y' for one graph per year, 'M' for one graph per month
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Seconds of each step. The attrs hold the number of graphs and airports
+
+    """
+
+    from jupyterworkflow import network
+
+    records = []
+
+    def step(name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        records.append({'step': name, 'seconds': time.perf_counter() - start})
+        return result
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        backends.SQLiteBackend(database).build_tables(start_year, last_year, chunksize=chunksize)
+
+        conn = sqlite3.connect(database)
+        routes = step('route_counts', network.route_counts, conn, freq)
+        graphs, index = step('build_graphs', network.build_graphs, routes)
+        step('airport_metrics', network.airport_metrics, graphs, index, conn)
+        step('connectivity', network.connectivity, graphs, index)
+        step('shortest_paths_all_pairs', network.shortest_paths, graphs[max(graphs)], index)
+        conn.close()
+
+    report = pd.DataFrame(records)
+    report.attrs['graphs'] = len(graphs)
+    report.attrs['airports'] = len(index)
+
+    return report
+
+
+def benchmark_lazy(rows=500000, start_year=2007, last_year=2008, workdir=None,
+                   chunksize=500000, repeat=3, seed=0, keep=False):
+
+    """
+    Compare the report hubs query of REPORT_QUERIES, pulled with query_to_df
+    and counted with pandas, with the same counts from a lazy query of lazy
+    module, compiled with its filter, join and grouping in SQL
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry
+    repeat : int (optional)
+        Number of runs of each way, the best time is kept
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Best seconds and rows pulled of each way. The attrs hold whether
+        both ways counted the same flights
+
+    """
+
+    from jupyterworkflow import lazy
+
+    hubs = ['ORD', 'ATL', 'DFW', 'LAX', 'PHX']
+    query = (lazy.scan()
+             .filter(lazy.col('Origin').isin(hubs))
+             .join('carriers', on='UniqueCarrier', columns=['Description'], prefix='')
+             .group_by('Origin', 'Description')
+             .agg(flights=lazy.count()))
+
+    def best_time(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        backends.SQLiteBackend(database).build_tables(start_year, last_year, chunksize=chunksize)
+
+        conn = sqlite3.connect(database)
+
+        def pandas_counts():
+            df = data.query_to_df(REPORT_QUERIES['hubs'], conn)
+            return len(df), df.groupby(['Origin', 'Description'], observed=True).size()
+
+        seconds_pandas, (pulled, expected) = best_time(pandas_counts)
+        seconds_lazy, result = best_time(lambda: query.collect(conn, cache=False))
+        lazy.clear_cache()
+        query.collect(conn)
+        seconds_cached, _ = best_time(lambda: query.collect(conn))
+        conn.close()
+
+    counts = result.set_index(['Origin', 'Description'])['flights']
+    expected.index = expected.index.set_levels([level.astype(str) for level in expected.index.levels])
+    counts.index = counts.index.set_levels([level.astype(str) for level in counts.index.levels])
+
+    report = pd.DataFrame([{'way': 'query_to_df_and_pandas', 'seconds': seconds_pandas, 'rows_pulled': pulled},
+                           {'way': 'lazy_collect', 'seconds': seconds_lazy, 'rows_pulled': len(result)},
+                           {'way': 'lazy_collect_cached', 'seconds': seconds_cached, 'rows_pulled': 0}])
+    report.attrs['same_counts'] = bool((counts.sort_index() == expected.sort_index()).all()) and \
+        len(counts) == len(expected)
+
+    return report
+
+
+def benchmark_downsample(days=7670, series=(5, 50), points=1600, repeat=3, seed=0):
+
+    """
+    Time the downsampling methods of downsample module on daily series with
+    spikes, and measure how much of the lines they keep against taking
+    every n-th day
+
+    Parameters
+    ----------
+    days : int (optional)
+        Points of each series, 7670 days from 1987 to 2008
+    series : tuple of int (optional)
+        Numbers of series downsampled at once
+    points : int (optional)
+        Points kept per series
+    repeat : int (optional)
+        Number of runs of each method, the best time is kept
+    seed : int (optional)
+        Seed of the generator
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Per method and number of series: best seconds, mean points kept
+        per series, share of the series whose highest and lowest days are
+        kept, and the mean error of the line through the kept points,
+        relative to the range
+
+    """
+
+    from jupyterworkflow import downsample
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('1987-10-01', periods=days, freq='D')
+    records = []
+
+    def stride(values, n):
+        step = int(np.ceil(len(values)/n))
+        return [np.arange(0, len(values), step) for _ in range(values.shape[1])]
+
+    for k in series:
+        weekly = np.sin(2*np.pi*np.arange(days)/7)[:, None]
+        values = 1000 + np.cumsum(rng.normal(0, 5, (days, k)), axis=0) + 50*weekly
+        spikes = rng.random((days, k)) < 0.002
+        values[spikes] += rng.normal(0, 400, spikes.sum())
+
+        x = dates.values.astype(np.int64).astype(np.float64)
+        methods = {'stride': lambda: stride(values, points),
+                   'lttb': lambda: list(downsample.lttb_indices(dates.values, values, points).T),
+                   'minmax': lambda: downsample.minmax_indices(values, points)}
+
+        for name, func in methods.items():
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                indices = func()
+                times.append(time.perf_counter() - start)
+
+            columns = np.arange(k)
+            kept_extremes = np.mean([(values[:, j].argmax() in indices[j]) and
+                                     (values[:, j].argmin() in indices[j]) for j in columns])
+            errors = [np.mean(np.abs(np.interp(x, x[indices[j]], values[indices[j], j]) - values[:, j])) /
+                      np.ptp(values[:, j]) for j in columns]
+
+            records.append({'method': name, 'series': k, 'seconds': min(times),
+                            'points': float(np.mean([len(index) for index in indices])),
+                            'extremes_kept': kept_extremes, 'mean_relative_error': float(np.mean(errors))})
+
+    return pd.DataFrame(records)
+
+
+def benchmark_query_profile(rows=500000, start_year=2007, last_year=2008, workdir=None,
+                            chunksize=500000, repeat=3, seed=0, keep=False):
+
+    """
+    Profile the hubs query of ANALYTIC_INDEXES with query_to_df, before and
+    after its index is created, through the slow-query log, and measure the
+    cost of profiling on a full pull of data table
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and query_to_df
+    repeat : int (optional)
+        Number of runs with and without profile, the best time is kept
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        The slow-query log: plan, seconds in SQLite and in each Python step,
+        rows per second and peak RSS of every profiled query. The attrs hold
+        the comparison of the runs and the seconds of the full pull with and
+        without profile
+
+    """
+
+    from jupyterworkflow import ingest
+    from jupyterworkflow import query as query_module
+
+    index = 'idx_data_origin_date'
+    hubs_query = ingest.ANALYTIC_INDEXES[index][2]
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+        log = 'source/slow_queries.jsonl'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        backends.SQLiteBackend(database).build_tables(start_year, last_year, chunksize=chunksize)
+
+        conn = sqlite3.connect(database)
+
+        # Every query is logged with a threshold of 0 seconds
+        query_module.query_to_df(hubs_query, conn, chunksize=chunksize, slow_seconds=0, slow_log=log)
+        ingest.create_indexes(conn, [index])
+        query_module.query_to_df(hubs_query, conn, chunksize=chunksize, slow_seconds=0, slow_log=log)
+        ingest.drop_indexes(conn, [index])
+
+        full_query = 'SELECT * FROM data'
+        times = {}
+        for profile in (False, True):
+            times[profile] = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                df = query_module.query_to_df(full_query, conn, chunksize=chunksize,
+                                              profile=profile, slow_seconds=None)
+                times[profile].append(time.perf_counter() - start)
+        full_profile = df.attrs['query_profile']
+        del df
+        conn.close()
+
+        columns = ['query_id', 'plan', 'seconds', 'engine_seconds', 'fetch_seconds', 'decode_seconds',
+                   'dtypes_seconds', 'concat_seconds', 'rows', 'rows_per_sec', 'peak_rss_mb']
+        report = query_module.load_slow_queries(log)[columns]
+        report.attrs['comparison'] = query_module.compare_slow_queries(log)
+        report.attrs['full_pull'] = {key: full_profile[key] for key in columns[1:]}
+        report.attrs['seconds_without_profile'] = min(times[False])
+        report.attrs['seconds_with_profile'] = min(times[True])
+
+    return report
+
+
+def benchmark_collect_all(rows=500000, start_year=2007, last_year=2008, workdir=None,
+                          chunksize=500000, repeat=3, sources=('csv',), seed=0, keep=False):
+
+    """
+    Compare three ways to get the aggregates of the report: pulling the
+    rows of each query and counting them with pandas, one collect per lazy
+    aggregation, each scanning data table, and all of them in one shared
+    scan with lazy.collect_all, a UNION ALL of GROUP BYs over one scan on
+    SQLite and GROUPING SETS on DuckDBBackend over each source
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry and of the queries
+    repeat : int (optional)
+        Number of runs of each way, the best time is kept
+    sources : tuple of str (optional)
+        Sources of DuckDBBackend, none to run SQLite only
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Best seconds and scans of data table of each way and backend, and
+        the speedup over collect_each on the same backend. The attrs hold
+        whether the shared scan got the same aggregates as the collects
+
+    """
+
+    from jupyterworkflow import lazy
+
+    hubs = ['ORD', 'ATL', 'DFW', 'LAX', 'PHX']
+    frames = {'dest': lazy.scan().group_by('Dest').agg(flights=lazy.count()),
+              'top_origins': (lazy.scan().group_by('Origin').agg(flights=lazy.count())
+                              .sort('flights', ascending=False).limit(5)),
+              'hub_days': (lazy.scan().filter(lazy.col('Origin').isin(hubs))
+                           .group_by('Origin', 'Date', 'UniqueCarrier').agg(flights=lazy.count())),
+              'routes': (lazy.scan().filter(lazy.date_range('{}-01-01'.format(last_year), '{}-12-31'.format(last_year)))
+                         .group_by('Origin', 'Dest').agg(flights=lazy.count(), Distance=lazy.col('Distance').max()))}
+
+    def pull(conn):
+        dest = data.query_to_df('SELECT Dest FROM data', conn, chunksize=chunksize)
+        origin = data.query_to_df('SELECT Origin FROM data', conn, chunksize=chunksize)
+        days = data.query_to_df("""SELECT Origin, Date, UniqueCarrier
+                                     FROM data
+                                    WHERE Origin IN ({})""".format(', '.join("'{}'".format(hub) for hub in hubs)),
+                                conn, chunksize=chunksize)
+        routes = data.query_to_df("""SELECT Origin, Dest, Distance
+                                       FROM data
+                                      WHERE Year = {}""".format(last_year), conn, chunksize=chunksize)
+        return {'dest': dest['Dest'].value_counts(),
+                'top_origins': origin['Origin'].value_counts().head(5),
+                'hub_days': days.groupby(['Origin', 'Date', 'UniqueCarrier'], observed=True).size(),
+                'routes': routes.groupby(['Origin', 'Dest'], observed=True)['Distance'].agg(['size', 'max'])}
+
+    def best_time(func, conn):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(conn)
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    def each_on(backend):
+        return lambda conn: {name: backend.query(frame.to_sql()) for name, frame in frames.items()}
+
+    def all_on(backend):
+        return lambda conn: lazy.collect_all(frames, backend=backend)
+
+    def same(left, right, keys):
+        left = left.astype({key: str for key in keys}).sort_values(keys).reset_index(drop=True)
+        right = right.astype({key: str for key in keys}).sort_values(keys).reset_index(drop=True)
+        return left.astype(str).equals(right.astype(str))
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        backends.SQLiteBackend(database).build_tables(start_year, last_year, chunksize=chunksize)
+
+        conn = sqlite3.connect(database)
+        ways = [('sqlite', 'pull_and_count', pull, 4),
+                ('sqlite', 'collect_each', lambda conn: {name: frame.collect(conn, cache=False, chunksize=chunksize)
+                                                         for name, frame in frames.items()}, len(frames)),
+                ('sqlite', 'shared_scan', lambda conn: lazy.collect_all(frames, conn, cache=False), 1)]
+        for source in sources:
+            backend = backends.DuckDBBackend(source)
+            backend.build_tables(start_year, last_year)
+            ways += [('duckdb:' + source, 'collect_each', each_on(backend), len(frames)),
+                     ('duckdb:' + source, 'shared_scan', all_on(backend), 1)]
+
+        records = []
+        results = {}
+        for engine, name, func, scans in ways:
+            seconds, results[engine, name] = best_time(func, conn)
+            records.append({'backend': engine, 'way': name, 'scans': scans, 'seconds': seconds})
+        conn.close()
+
+    report = pd.DataFrame(records)
+    each = report[report['way'] == 'collect_each'].set_index('backend')['seconds']
+    report['speedup'] = report['backend'].map(each)/report['seconds']
+
+    engines = report['backend'].unique()
+    report.attrs['same_results'] = all(same(results[engine, 'collect_each'][name], results[engine, 'shared_scan'][name],
+                                            frames[name]._group) for engine in engines for name in frames)
+
+    return report
+
+
+def benchmark_features(rows=500000, start_year=2007, last_year=2008, workdir=None,
+                       chunksizes=(50000, 200000), encodings=('hash', 'onehot'), seed=0, keep=False):
+
+    """
+    Train the delay model of features module chunk by chunk on synthetic
+    flights, with each encoding and chunksize, and measure the training
+    throughput and the memory held
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of each synthetic year
+    start_year : int (optional)
+        First synthetic year
+    last_year : int (optional)
+        Last synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksizes : tuple of int (optional)
+        Rows of the chunks of the training
+    encodings : tuple of str (optional)
+        Encodings of features.FlightFeatures
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Per encoding and chunksize: features, rows, seconds of the features
+        and of partial_fit, rows per second, accuracy on the last chunk
+        before training on it and peak of Python allocations traced in a
+        second run. The attrs hold the accuracy of always predicting the
+        most common class
+
+    """
+
+    from jupyterworkflow import features
+
+    records = []
+
+    with working_directory(workdir, keep):
+        database = 'source/all_data.db'
+
+        synthetic.generate_flights_data(start_year, last_year, rows, 'source', seed=seed)
+        backends.SQLiteBackend(database).build_tables(start_year, last_year)
+
+        conn = sqlite3.connect(database)
+
+        for encoding in encodings:
+            for chunksize in chunksizes:
+                flight_features = features.FlightFeatures(encoding, conn=conn)
+                model, history = features.train_incremental(conn, features=flight_features, chunksize=chunksize)
+
+                _, record = measure('train_incremental', features.train_incremental, conn,
+                                    features=flight_features, chunksize=chunksize)
+
+                seconds = history['feature_seconds'].sum() + history['fit_seconds'].sum()
+                records.append({'encoding': encoding,
+                                'chunksize': chunksize,
+                                'features': flight_features.n_features,
+                                'rows': history['rows'].sum(),
+                                'feature_seconds': history['feature_seconds'].sum(),
+                                'fit_seconds': history['fit_seconds'].sum(),
+                                'rows_per_sec': history['rows'].sum()/seconds,
+                                'last_chunk_accuracy': history['score'].iloc[-1],
+                                'traced_peak_mb': record['traced_peak_mb']})
+
+        delayed = conn.execute('SELECT AVG(ArrDelay >= {}) FROM ({})'.format(
+            features.DELAY_MINUTES, features.feature_query())).fetchone()[0]
+        conn.close()
+
+    report = pd.DataFrame(records)
+    report.attrs['majority_accuracy'] = max(delayed, 1 - delayed)
+
+    return report
+
+
+def benchmark_sketches(rows=500000, year=2008, workdir=None, chunksize=100000, compression=100,
+                       columns=('ArrDelay', 'DepDelay'), min_count=100, trace_memory=True, seed=0, keep=False):
+
+    """
+    Build the delay sketches of sketches module in one pass over a synthetic
+    year and check their error bounds against the exact quantiles of the
+    same flights, with sketches.check_error
+
+    Parameters
+    ----------
+    rows : int (optional)
+        Number of flights of the synthetic year
+    year : int (optional)
+        Synthetic year
+    workdir : str (optional)
+        Folder of the run, a temporary folder if None
+    chunksize : int (optional)
+        Chunksize of sketch_csv
+    compression : int (optional)
+        Accuracy of each TDigest
+    columns : tuple of str (optional)
+        Delay columns whose error is checked
+    min_count : int (optional)
+        Smallest group compared
+    trace_memory : bool (optional)
+        if True, measure the peak of Python allocations of the pass
+    seed : int (optional)
+        Seed of the synthetic generator
+    keep : bool (optional)
+        if True, keep the temporary folder after the run
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Per column and quantile: groups compared, mean and max rank error
+        and mean absolute error in minutes. The attrs hold the record of
+        the sketch pass (see measure), the seconds of the exact quantiles,
+        and the number of digests and centroids
+
+    """
+
+    from jupyterworkflow import sketches
+
+    with working_directory(workdir, keep):
+        synthetic.generate_flights_data(year, year, rows, 'source', seed=seed)
+
+        sketch, record = measure('sketch_csv', sketches.sketch_csv, year, year, compression=compression,
+                                 chunksize=chunksize, trace_memory=trace_memory, rows=rows)
+
+        df = pd.read_csv('source/{}.csv'.format(year), usecols=sketch.group_by + list(columns),
+                         encoding='latin-1')
+
+    start = time.perf_counter()
+    df.groupby(sketch.group_by, observed=True)[list(columns)].quantile(list(sketches.QUANTILES))
+    exact_seconds = time.perf_counter() - start
+
+    report = pd.concat({column: sketches.check_error(sketch, df, column, min_count=min_count)
+                        for column in columns}, names=['column'])
+
+    digests = sketch.digests
+    report.attrs['sketch'] = record
+    report.attrs['exact_seconds'] = exact_seconds
+    report.attrs['digests'] = len(digests)
+    report.attrs['centroids'] = int(sum(len(digest.means) for digest in digests.values()))
+
+    return report
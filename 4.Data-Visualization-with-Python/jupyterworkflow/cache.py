@@ -0,0 +1,298 @@
+# Import packages
+import os
+import json
+import time
+import hashlib
+import threading
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+############### Packages to cache downloads with HTTP validators ###################
+####################################################################################
+####################################################################################
+
+# Metadata of every cached download: url -> validators and checksum
+METADATA_FILE = 'source/download_cache.json'
+
+# Bytes read from the response at once
+BLOCK_SIZE = 1024**2
+
+
+def file_checksum(filepath, block_size=BLOCK_SIZE):
+
+    """
+    Get the sha256 checksum of a file, read in blocks
+
+    Parameters
+    ----------
+    filepath : str
+        Complete filepath of the file
+
+    Returns
+    ----------
+    checksum : str
+        Hexadecimal sha256 digest
+
+    """
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadCache:
+
+    """
+    Cache of downloaded files with their HTTP validators.
+
+    Each url has an entry with the ETag, Last-Modified, size and sha256 of
+    the download, and the size and modification time of the local file it
+    produced (the csv file of a bz2 download that was unzipped). When the
+    local file is unchanged, fetch sends a conditional request and a
+    304 Not Modified answer costs one round trip without a body.
+
+    Parameters
+    ----------
+    metadata_file : str (optional)
+        Complete filepath of the JSON metadata file
+    session : requests.Session (optional)
+        Session used for the requests, for example one pointed at a local
+        HTTP stand-in. A new requests.Session if None
+    timeout : float (optional)
+        Seconds to wait for the server
+
+    Attributes
+    ----------
+    stats : dict
+        Requests, not_modified, downloaded and bytes since the cache was created
+
+    """
+
+    def __init__(self, metadata_file=METADATA_FILE, session=None, timeout=60):
+        self.metadata_file = metadata_file
+        if session is None:
+            # Imported here, so importing the package does not load requests
+            import requests
+            session = requests.Session()
+
+        self.session = session
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'not_modified': 0, 'downloaded': 0, 'bytes': 0}
+        # One cache can be shared by downloads running in several threads
+        self._lock = threading.RLock()
+
+        try:
+            with open(metadata_file) as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+
+        """
+        Write the metadata file, replacing it atomically
+        """
+
+        folder = os.path.dirname(self.metadata_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with self._lock:
+            temporary = self.metadata_file + '.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(self.entries, file, indent=1, sort_keys=True)
+            os.replace(temporary, self.metadata_file)
+
+    def is_fresh(self, url, target):
+
+        """
+        Check that the local file of url is the one recorded in the cache,
+        from its size and modification time
+
+        Parameters
+        ----------
+        url : str
+            Complete url of the source
+        target : str
+            Complete filepath of the local file
+
+        Returns
+        ----------
+        fresh : bool
+
+        """
+
+        entry = self.entries.get(url)
+        if entry is None or entry.get('target') != target or not os.path.exists(target):
+            return False
+
+        stat = os.stat(target)
+        return stat.st_size == entry.get('target_size') and stat.st_mtime == entry.get('target_mtime')
+
+    def _headers(self, url):
+        entry = self.entries.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record(self, url, filepath, target=None, response=None, checksum=None, size=None):
+
+        """
+        Record the validators of a download and the state of its local file
+
+        Parameters
+        ----------
+        url : str
+            Complete url of the source
+        filepath : str
+            Complete filepath of the download
+        target : str (optional)
+            Complete filepath of the local file, filepath if None
+        response : requests.Response (optional)
+            Response with the ETag and Last-Modified headers
+        checksum : str (optional)
+            sha256 of the download
+        size : int (optional)
+            Bytes of the download
+
+        """
+
+        target = target or filepath
+        headers = response.headers if response is not None else {}
+
+        with self._lock:
+            entry = self.entries.setdefault(url, {})
+            entry.update({'filepath': filepath,
+                          'target': target,
+                          'etag': headers.get('ETag', entry.get('etag')),
+                          'last_modified': headers.get('Last-Modified', entry.get('last_modified')),
+                          'size': size if size is not None else entry.get('size'),
+                          'sha256': checksum if checksum is not None else entry.get('sha256'),
+                          'checked': time.time()})
+
+            if os.path.exists(target):
+                stat = os.stat(target)
+                entry['target_size'] = stat.st_size
+                entry['target_mtime'] = stat.st_mtime
+
+            self.save()
+
+    def adopt(self, url, target):
+
+        """
+        Record a local file downloaded before the cache existed, with the
+        validators of a HEAD request, so later fetches are conditional
+
+        Parameters
+        ----------
+        url : str
+            Complete url of the source
+        target : str
+            Complete filepath of the local file
+
+        """
+
+        self.stats['requests'] += 1
+        response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        response.raise_for_status()
+
+        self.record(url, target, target, response,
+                    size=int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None)
+
+    def fetch(self, url, filepath, target=None, force=False):
+
+        """
+        Download url to filepath unless the cached copy is still valid
+
+        Parameters
+        ----------
+        url : str
+            Complete url of the source
+        filepath : str
+            Complete filepath of the download
+        target : str (optional)
+            Local file produced from the download, for example the csv file
+            of a bz2 file that is unzipped and removed. filepath if None
+        force : bool (optional)
+            if True, download without validators
+
+        Returns
+        ----------
+        status : str
+            'downloaded' or 'not_modified'
+
+        """
+
+        target = target or filepath
+        fresh = not force and self.is_fresh(url, target)
+        headers = self._headers(url) if fresh else {}
+
+        self.stats['requests'] += 1
+
+        with instrument.span('fetch', url=url) as span:
+
+            response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+
+            if fresh and response.status_code == 304:
+                response.close()
+                self.stats['not_modified'] += 1
+                self.record(url, filepath, target, response)
+                return 'not_modified'
+
+            response.raise_for_status()
+
+            # Stream to a temporary file, so an interrupted download never
+            # replaces a good file
+            digest = hashlib.sha256()
+            size = 0
+            temporary = filepath + '.part'
+
+            with open(temporary, 'wb') as file:
+                for block in response.iter_content(BLOCK_SIZE):
+                    digest.update(block)
+                    file.write(block)
+                    size += len(block)
+            response.close()
+            os.replace(temporary, filepath)
+
+            span.add(bytes=size)
+
+        self.stats['downloaded'] += 1
+        self.stats['bytes'] += size
+        # A target produced from the download, for example by unzip_file,
+        # is recorded again with record(url, filepath, target) once it exists
+        self.record(url, filepath, target, response, digest.hexdigest(), size)
+
+        return 'downloaded'
+
+    def verify(self, url):
+
+        """
+        Check the sha256 of a download that was kept on disk
+
+        Parameters
+        ----------
+        url : str
+            Complete url of the source
+
+        Returns
+        ----------
+        valid : bool or None
+            None if the download is not on disk or has no checksum
+
+        """
+
+        entry = self.entries.get(url, {})
+        filepath = entry.get('filepath')
+
+        if not entry.get('sha256') or not filepath or not os.path.exists(filepath):
+            return None
+
+        return file_checksum(filepath) == entry['sha256']
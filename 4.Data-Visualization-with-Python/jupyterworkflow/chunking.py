@@ -0,0 +1,246 @@
+# Import packages
+import pandas as pd
+import os
+import re
+import time
+
+####################################################################################
+####################################################################################
+###################### Packages to size chunks from a memory budget ################
+####################################################################################
+####################################################################################
+
+# Rows of the first chunk, used to measure the bytes per row
+PROBE_ROWS = 100000
+
+# Share of the budget given to one chunk, the rest covers the copies made while
+# the chunk is converted (fillna, astype, to_sql, concat)
+CHUNK_SHARE = 0.25
+
+_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
+
+
+def parse_memory(memory):
+
+    """
+    Convert a memory size to bytes
+
+    Parameters
+    ----------
+    memory : int, float or str
+        Bytes, or a string as '512MB', '2 GB' or '1.5GB'
+
+    Returns
+    ----------
+    memory : int
+        Memory size in bytes
+
+    """
+
+    if isinstance(memory, (int, float)):
+        return int(memory)
+
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', memory.upper())
+    if match is None:
+        raise ValueError('invalid memory size: {!r}'.format(memory))
+
+    return int(float(match.group(1))*_UNITS[match.group(2)])
+
+
+def available_memory():
+
+    """
+    Get the memory available to new allocations in bytes, from /proc/meminfo
+    on Linux and from the free physical pages elsewhere
+
+    Returns
+    ----------
+    memory : int or None
+        Available memory in bytes, None if it cannot be measured
+
+    """
+
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class ChunkSizer:
+
+    """
+    Choose the number of rows of each chunk from a memory budget.
+
+    The first chunk has probe_rows rows. After each chunk, observe() records
+    its bytes per row and the next chunk is sized so that it uses
+    CHUNK_SHARE of the budget. When the available memory of the machine
+    drops below the budget, the budget is reduced to what is available.
+
+    Parameters
+    ----------
+    memory_budget : int or str
+        Memory the caller allows for the operation, for example '2GB'
+    probe_rows : int (optional)
+        Rows of the first chunk
+    min_rows : int (optional)
+        Smallest chunk
+    max_rows : int (optional)
+        Largest chunk, unlimited if None
+
+    Attributes
+    ----------
+    history : list of dict
+        Rows, bytes per row and effective budget of every chunk
+
+    """
+
+    def __init__(self, memory_budget, probe_rows=PROBE_ROWS, min_rows=1000, max_rows=None):
+        self.memory_budget = parse_memory(memory_budget)
+        self.probe_rows = probe_rows
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.bytes_per_row = None
+        self.history = []
+
+    def budget(self):
+
+        """
+        Get the budget, reduced to the available memory under memory pressure
+        """
+
+        available = available_memory()
+        if available is None:
+            return self.memory_budget
+        return min(self.memory_budget, available)
+
+    def next_size(self):
+
+        """
+        Get the number of rows of the next chunk
+        """
+
+        if self.bytes_per_row is None:
+            rows = self.probe_rows
+        else:
+            rows = int(self.budget()*CHUNK_SHARE/self.bytes_per_row)
+
+        rows = max(rows, self.min_rows)
+        if self.max_rows is not None:
+            rows = min(rows, self.max_rows)
+
+        return rows
+
+    def observe(self, rows, nbytes):
+
+        """
+        Record the size of a chunk
+
+        Parameters
+        ----------
+        rows : int
+            Rows of the chunk
+        nbytes : int
+            Memory of the chunk in bytes, for example df.memory_usage(deep=True).sum()
+
+        """
+
+        if rows:
+            bytes_per_row = nbytes/rows
+            # Keep the widest rows seen, text columns can grow in later years
+            if self.bytes_per_row is None or bytes_per_row > self.bytes_per_row:
+                self.bytes_per_row = bytes_per_row
+
+        self.history.append({'rows': rows,
+                             'bytes_per_row': self.bytes_per_row,
+                             'budget': self.budget()})
+
+
+def iter_csv(filepath, sizer, **kwargs):
+
+    """
+    Read a csv file in chunks sized by a ChunkSizer
+
+    Parameters
+    ----------
+    filepath : str
+        Complete filepath of the csv file
+    sizer : ChunkSizer
+        Sizer of the chunks, observe() is called with every chunk read
+    kwargs : dict (optional)
+        Arguments of pandas.read_csv
+
+    Returns
+    ----------
+    chunks : generator of pandas.DataFrame
+
+    """
+
+    with pd.read_csv(filepath, iterator=True, **kwargs) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(sizer.next_size())
+            except StopIteration:
+                return
+            sizer.observe(len(chunk), chunk.memory_usage(index=False, deep=True).sum())
+            yield chunk
+
+
+def iter_query(query, conn, sizer, timings=None):
+
+    """
+    Run a SQL query and fetch its result in chunks sized by a ChunkSizer
+
+    Parameters
+    ----------
+    query : str
+        SQL query
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    sizer : ChunkSizer or int
+        Sizer of the chunks, observe() is called with every chunk fetched,
+        or a fixed number of rows
+    timings : dict (optional)
+        Seconds are added to its 'engine' key for running the query and
+        fetching the rows, and to its 'frames' key for building the chunks
+
+    Returns
+    ----------
+    chunks : generator of pandas.DataFrame
+
+    """
+
+    fixed = isinstance(sizer, int)
+    timings = {} if timings is None else timings
+    timings.setdefault('engine', 0.0)
+    timings.setdefault('frames', 0.0)
+
+    start = time.perf_counter()
+    c = conn.cursor()
+    c.execute(query)
+    columns = [column[0] for column in c.description]
+    timings['engine'] += time.perf_counter() - start
+
+    try:
+        while True:
+            start = time.perf_counter()
+            records = c.fetchmany(sizer if fixed else sizer.next_size())
+            timings['engine'] += time.perf_counter() - start
+            if not records:
+                return
+            start = time.perf_counter()
+            chunk = pd.DataFrame.from_records(records, columns=columns)
+            timings['frames'] += time.perf_counter() - start
+            del records
+            if not fixed:
+                sizer.observe(len(chunk), chunk.memory_usage(index=False, deep=True).sum())
+            yield chunk
+    finally:
+        c.close()
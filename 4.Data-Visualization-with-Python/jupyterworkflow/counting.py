@@ -0,0 +1,201 @@
+# Import packages
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+####################################################################################
+####################################################################################
+################ Packages to count categorical codes in one pass ###################
+####################################################################################
+####################################################################################
+
+# Rows below which the counts are not split across threads
+MIN_ROWS_PER_THREAD = 1000000
+
+
+def to_codes(values, sort=True):
+
+    """
+    Get integer codes and categories of a column, without a copy for
+    categorical columns
+
+    Parameters
+    ----------
+    values : pandas.Series, pandas.Categorical or array-like
+        Column to be counted, missing values get the code -1
+    sort : bool (optional)
+        if True, the categories of non categorical columns are sorted
+
+    Returns
+    ----------
+    codes : numpy.ndarray of int
+        Code of each row
+    categories : pandas.Index
+        Category of each code
+
+    """
+
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.array
+
+    if isinstance(values, pd.Categorical):
+        return values.codes, values.categories
+
+    codes, categories = pd.factorize(np.asarray(values) if not isinstance(values, pd.Series) else values,
+                                     sort=sort)
+    return codes, pd.Index(categories)
+
+
+def bincount(codes, size, weights=None, threads=1):
+
+    """
+    Count the codes from 0 to size - 1, skipping negative codes, in one
+    np.bincount pass per thread
+
+    Parameters
+    ----------
+    codes : numpy.ndarray of int
+        Codes to be counted
+    size : int
+        Number of codes
+    weights : numpy.ndarray of float (optional)
+        Weight of each row, for example the weight column of a sample
+    threads : int (optional)
+        Number of threads, each counts a slice of the rows. The speedup
+        depends on numpy releasing the GIL, see benchmark.benchmark_counting
+
+    Returns
+    ----------
+    counts : numpy.ndarray
+        Count of each code, int64 or float64 with weights
+
+    """
+
+    def count(part):
+        part_codes = codes[part]
+        valid = part_codes >= 0
+        part_weights = None if weights is None else weights[part][valid]
+        return np.bincount(part_codes[valid], weights=part_weights, minlength=size)
+
+    threads = max(1, min(threads, len(codes)//MIN_ROWS_PER_THREAD))
+
+    if threads == 1:
+        return count(slice(None))
+
+    bounds = np.linspace(0, len(codes), threads + 1).astype(np.int64)
+    with ThreadPoolExecutor(threads) as executor:
+        parts = executor.map(count, [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])])
+        return sum(parts)
+
+
+def counts(values, weights=None, threads=1):
+
+    """
+    Count the rows of each category, the result of value_counts in one pass
+
+    Parameters
+    ----------
+    values : pandas.Series, pandas.Categorical or array-like
+        Column to be counted
+    weights : array-like of float (optional)
+        Weight of each row
+    threads : int (optional)
+        Number of threads
+
+    Returns
+    ----------
+    counts : pandas.Series
+        Count of every category, in descending order
+
+    """
+
+    codes, categories = to_codes(values)
+    weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+
+    result = pd.Series(bincount(codes, len(categories), weights, threads), index=categories)
+
+    return result.sort_values(ascending=False, kind='stable')
+
+
+def crosstab(rows, columns, weights=None, threads=1):
+
+    """
+    Count the rows of every pair of categories of two columns, the full
+    matrix of groupby([rows, columns]).count() in one pass
+
+    Parameters
+    ----------
+    rows : pandas.Series, pandas.Categorical or array-like
+        Column of the matrix rows, for example Origin
+    columns : pandas.Series, pandas.Categorical or array-like
+        Column of the matrix columns, for example Description_2
+    weights : array-like of float (optional)
+        Weight of each row
+    threads : int (optional)
+        Number of threads
+
+    Returns
+    ----------
+    matrix : pandas.DataFrame
+        Count of each pair, zero for pairs without rows
+
+    """
+
+    row_codes, row_categories = to_codes(rows)
+    column_codes, column_categories = to_codes(columns)
+
+    # One code per pair, -1 when either value is missing
+    pair_codes = row_codes.astype(np.int64)*len(column_categories) + column_codes
+    pair_codes[(row_codes < 0) | (column_codes < 0)] = -1
+
+    weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+    flat = bincount(pair_codes, len(row_categories)*len(column_categories), weights, threads)
+
+    return pd.DataFrame(flat.reshape(len(row_categories), len(column_categories)),
+                        index=row_categories, columns=column_categories)
+
+
+def date_matrix(dates, entity, weights=None, threads=1, freq=None):
+
+    """
+    Count the rows of every (date, entity) pair, for example the daily
+    flights of each hub. With days, every day of the range is a row
+
+    Parameters
+    ----------
+    dates : pandas.Series or array-like of datetime
+        Date of each row
+    entity : pandas.Series, pandas.Categorical or array-like
+        Entity of each row, for example Origin
+    weights : array-like of float (optional)
+        Weight of each row
+    threads : int (optional)
+        Number of threads
+    freq : str (optional)
+        Period of the rows, for example 'M' for months, days if None
+
+    Returns
+    ----------
+    matrix : pandas.DataFrame
+        One row per day or period, one column per entity
+
+    """
+
+    dates = pd.DatetimeIndex(dates)
+    if freq is not None:
+        dates = dates.to_period(freq).to_timestamp()
+
+    # Days since the first date, so the dates need no factorize
+    first = dates.min().normalize()
+    if freq is None:
+        date_codes = ((dates.normalize() - first)//pd.Timedelta(days=1)).to_numpy(na_value=-1).astype(np.int64)
+        date_index = pd.date_range(first, dates.max().normalize(), freq='D')
+    else:
+        date_codes, date_index = pd.factorize(dates, sort=True)
+        date_index = pd.DatetimeIndex(date_index)
+
+    matrix = crosstab(pd.Categorical.from_codes(np.asarray(date_codes), np.arange(len(date_index))),
+                      entity, weights, threads)
+    matrix.index = date_index
+
+    return matrix
@@ -0,0 +1,292 @@
+# Import packages
+import pandas as pd
+import numpy as np
+import os
+import re
+
+####################################################################################
+####################################################################################
+################ Packages to store fact table codes as integer ids #################
+####################################################################################
+####################################################################################
+
+# Dimension table -> fact columns encoded with it
+DIMENSIONS = {'dim_carrier': ['UniqueCarrier'],
+              'dim_airport': ['Origin', 'Dest'],
+              'dim_tailnum': ['TailNum']}
+
+# Dimension table -> supplemental table, code column and csv file used as seed
+SEEDS = {'dim_carrier': ('carriers', 'Code', 'source/carriers.csv'),
+         'dim_airport': ('airports', 'iata', 'source/airports.csv'),
+         'dim_tailnum': ('plane_data', 'tailnum', 'source/plane-data.csv')}
+
+# Fact column -> dimension table
+COLUMN_DIMENSION = {column: table for table, columns in DIMENSIONS.items() for column in columns}
+
+# Forms of SQL of the TEXT layout rewritten by translate_query. The encoded
+# columns are matched bare or quoted, "Origin", `Origin` or [Origin]
+_NAMES = '|'.join(COLUMN_DIMENSION)
+_ENCODED = r"((?:\b\w+\.|\"\w+\"\.)?(?:\b(?:{0})\b|\"(?:{0})\"|`(?:{0})`|\[(?:{0})\]))".format(_NAMES)
+_STRING = r"'(?:[^']|'')*'"
+_EQUALITY = r"\s*(?:==|=|<>|!=)\s*"
+_COMPARISON = re.compile(_ENCODED + '(' + _EQUALITY + ')(' + _STRING + ')', re.IGNORECASE)
+_REVERSED = re.compile('(' + _STRING + ')(' + _EQUALITY + ')' + _ENCODED, re.IGNORECASE)
+_IN_LIST = re.compile(_ENCODED + r"(\s+(?:NOT\s+)?IN\s*\()(\s*" + _STRING + r"(?:\s*,\s*" + _STRING + r")*\s*)\)",
+                      re.IGNORECASE)
+
+# Supplemental table -> its code column, joined on an encoded column
+JOIN_KEYS = {table: key for table, key, _ in SEEDS.values()}
+
+_JOIN_KEY = r"((?:\b\w+\.)?\b(?:{})\b)".format('|'.join(JOIN_KEYS.values()))
+_JOIN_ON = re.compile(r"\b((?:(?:LEFT|INNER|CROSS)\s+(?:OUTER\s+)?)?JOIN)\s+({})\b(?:\s+(?:AS\s+)?(?!ON\b)(\w+))?"
+                      r"\s+ON\s+(?:".format('|'.join(JOIN_KEYS)) + _JOIN_KEY + r"\s*==?\s*" + _ENCODED + '|' +
+                      _ENCODED + r"\s*==?\s*" + _JOIN_KEY + ')', re.IGNORECASE)
+_JOIN = re.compile(_JOIN_KEY + r"\s*(?:==|=|<>|!=)\s*" + _ENCODED + '|' + _ENCODED + r"\s*(?:==|=|<>|!=)\s*" + _JOIN_KEY,
+                   re.IGNORECASE)
+
+# Any other use of a text code with an encoded column, rejected by translate_query
+_TEXT_USE = re.compile(_ENCODED + r"\s*(?:NOT\s+)?(?:==|=|<>|!=|<=|>=|<|>|LIKE|GLOB|IN|BETWEEN)\s*\(?\s*'|"
+                       r"'\s*(?:==|=|<>|!=|<=|>=|<|>)\s*" + _ENCODED, re.IGNORECASE)
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone() is not None
+
+
+def is_encoded(conn):
+
+    """
+    Check if the database stores the fact codes as integer ids
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+
+    Returns
+    ----------
+    encoded : bool
+
+    """
+
+    return all(_table_exists(conn, table) for table in DIMENSIONS)
+
+
+def create_dimension_tables(conn, encoding='latin-1'):
+
+    """
+    Create the dimension tables of the encoded layout. Ids are dense, from 0,
+    and are seeded with the codes of airports, carriers and plane_data,
+    read from the tables when they exist or from the csv files in source folder.
+    Codes not found there are appended during the ingest.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    encoding : str (optional)
+        Encoding of the supplemental csv files
+
+    Returns
+    ----------
+
+    """
+
+    c = conn.cursor()
+
+    for table, (supplemental, column, filepath) in SEEDS.items():
+
+        c.execute('DROP TABLE IF EXISTS {}'.format(table))
+        c.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, code TEXT UNIQUE)'.format(table))
+
+        if _table_exists(conn, supplemental):
+            codes = pd.read_sql_query('SELECT {} FROM {}'.format(column, supplemental), conn)[column]
+        elif os.path.exists(filepath):
+            codes = pd.read_csv(filepath, usecols=[column], encoding=encoding)[column]
+        else:
+            codes = pd.Series([], dtype=object)
+
+        codes = codes.dropna().astype(str).drop_duplicates()
+        c.executemany('INSERT INTO {} (id, code) VALUES (?, ?)'.format(table), enumerate(codes))
+
+    conn.commit()
+    c.close()
+
+
+def load_codes(conn):
+
+    """
+    Read the dimension tables
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+
+    Returns
+    ----------
+    codes : dict of pandas.Index
+        Codes of each dimension table, the position of a code is its id
+
+    """
+
+    codes = {}
+
+    for table in DIMENSIONS:
+        df = pd.read_sql_query('SELECT id, code FROM {} ORDER BY id'.format(table), conn)
+        codes[table] = pd.Index(df.code.values, dtype=object)
+
+    return codes
+
+
+def encode_chunk(chunk, conn, codes):
+
+    """
+    Replace the codes of a fact chunk by their integer ids. Unseen codes are
+    appended to the dimension tables and to codes.
+
+    Parameters
+    ----------
+    chunk : pandas.DataFrame
+        Chunk of the raw csv files
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    codes : dict of pandas.Index
+        Codes returned by load_codes, updated in place
+
+    Returns
+    ----------
+    chunk : pandas.DataFrame
+        Chunk with nullable integer ids instead of codes
+
+    """
+
+    for column, table in COLUMN_DIMENSION.items():
+
+        if column not in chunk.columns:
+            continue
+
+        values = chunk[column]
+        present = values.notna()
+        values = values[present].astype(str)
+
+        unseen = pd.Index(values.unique()).difference(codes[table])
+        if len(unseen):
+            start = len(codes[table])
+            conn.executemany('INSERT INTO {} (id, code) VALUES (?, ?)'.format(table),
+                             zip(range(start, start+len(unseen)), unseen))
+            codes[table] = codes[table].append(pd.Index(unseen, dtype=object))
+
+        ids = np.full(len(chunk), -1, dtype=np.int32)
+        ids[present.values] = codes[table].get_indexer(values)
+        chunk[column] = pd.arrays.IntegerArray(np.maximum(ids, 0), mask=ids < 0)
+
+    return chunk
+
+
+def decode_chunk(chunk, codes):
+
+    """
+    Replace the integer ids of a fact chunk by categorical codes. Every chunk
+    gets the full dimension as categories, so chunks concatenate without
+    re-encoding.
+
+    Parameters
+    ----------
+    chunk : pandas.DataFrame
+        Chunk of a query over the encoded tables
+    codes : dict of pandas.Index
+        Codes returned by load_codes
+
+    Returns
+    ----------
+    chunk : pandas.DataFrame
+        Chunk with categorical columns instead of ids
+
+    """
+
+    for column, table in COLUMN_DIMENSION.items():
+
+        if column not in chunk.columns:
+            continue
+
+        ids = pd.to_numeric(chunk[column]).fillna(-1).values.astype(np.int32)
+        chunk[column] = pd.Categorical.from_codes(ids, categories=codes[table])
+
+    return chunk
+
+
+def _column_table(column):
+    name = column.split('.')[-1].strip('"`[]').lower()
+    return next(table for fact, table in COLUMN_DIMENSION.items() if fact.lower() == name)
+
+
+def translate_query(query, codes):
+
+    """
+    Rewrite a query written for the TEXT layout to run on the encoded layout:
+    - codes compared with =, <> or IN become their ids, looked up in codes,
+      a code missing from the dimension becomes -1 and matches no row, as on
+      the TEXT layout
+    - a join of a supplemental table on a code (JOIN airports ON
+      airports.iata = data.Origin) goes through the dimension table: the id
+      joins the dimension, and its code joins the supplemental table
+    Any other comparison of an encoded column with text (LIKE, <, BETWEEN)
+    or with a code column outside a JOIN ... ON raises a ValueError instead
+    of silently matching nothing.
+
+    Parameters
+    ----------
+    query : str
+        SQL query written against the TEXT layout
+    codes : dict of pandas.Index
+        Codes returned by load_codes
+
+    Returns
+    ----------
+    query : str
+        SQL query for the encoded layout
+
+    """
+
+    def code_id(column, literal):
+        positions = codes[_column_table(column)].get_indexer([literal[1:-1].replace("''", "'")])
+        return str(positions[0])
+
+    def comparison(match):
+        return match.group(1) + match.group(2) + code_id(match.group(1), match.group(3))
+
+    def reversed_comparison(match):
+        return code_id(match.group(3), match.group(1)) + match.group(2) + match.group(3)
+
+    def in_list(match):
+        literals = re.findall(_STRING, match.group(3))
+        return match.group(1) + match.group(2) + ', '.join(code_id(match.group(1), literal)
+                                                           for literal in literals) + ')'
+
+    def join(match):
+        kind, table, alias = match.group(1), match.group(2), match.group(3) or match.group(2)
+        column = match.group(5) or match.group(6)
+        dimension = _column_table(column)
+        return '{0} {1} AS {2}_dim ON {2}_dim.id = {3} {0} {4} AS {2} ON {2}.{5} = {2}_dim.code'.format(
+            kind, dimension, alias, column, table, JOIN_KEYS[table.lower()])
+
+    query = _COMPARISON.sub(comparison, query)
+    query = _REVERSED.sub(reversed_comparison, query)
+    query = _IN_LIST.sub(in_list, query)
+    query = _JOIN_ON.sub(join, query)
+
+    match = _TEXT_USE.search(query)
+    if match:
+        raise ValueError('{} is stored as integer ids in the encoded layout and is compared with text '
+                         'in the query near {!r}, compare codes with =, <> or IN, or use the lazy module'
+                         .format(match.group(1) or match.group(2), match.group()))
+
+    match = _JOIN.search(query)
+    if match:
+        raise ValueError('{} is stored as integer ids in the encoded layout and is compared with a code '
+                         'column in the query near {!r}, join the supplemental table with JOIN ... ON'
+                         .format(match.group(2) or match.group(3), match.group()))
+
+    return query
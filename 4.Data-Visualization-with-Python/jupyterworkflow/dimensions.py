@@ -0,0 +1,310 @@
+# Import packages
+import pandas as pd
+import numpy as np
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+################### Packages to look up dimension tables in memory #################
+####################################################################################
+####################################################################################
+
+# Dimension tables loaded once per process, keyed by database file
+_DIMENSION_CACHE = {}
+
+
+class DimensionIndex:
+
+    """
+    Array-backed lookup structure of one dimension table
+
+    Every code (iata, carrier Code or tailnum) gets a dense integer id from 0 to n-1.
+    The attributes are stored as parallel numpy arrays of length n+1, the last
+    position holds the missing value, so the id -1 of an unknown code is resolved
+    by plain array indexing.
+
+    Parameters
+    ----------
+    codes : array-like of str
+        Unique codes of the dimension table
+    columns : dict of array-like
+        Attributes of the dimension table, aligned with codes
+
+    """
+
+    def __init__(self, codes, columns):
+
+        self.codes = pd.Index(codes)
+        self.columns = {}
+        self._categories = {}
+
+        for name, values in columns.items():
+            values = pd.Series(values).reset_index(drop=True)
+
+            if pd.api.types.is_numeric_dtype(values):
+                # Numeric attribute: float array with NaN sentinel
+                self.columns[name] = np.append(values.values.astype(np.float64), np.nan)
+            else:
+                # Text attribute: category codes with -1 sentinel
+                cat = pd.Categorical(values)
+                self.columns[name] = np.append(cat.codes, -1).astype(np.int32)
+                self._categories[name] = cat.categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    def encode(self, values):
+
+        """
+        Map codes to dense integer ids
+
+        Parameters
+        ----------
+        values : array-like of str
+            Codes to be mapped
+
+        Returns
+        ----------
+        ids : numpy.ndarray of int32
+            Dense ids, -1 for codes missing in the dimension table
+
+        """
+
+        if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+            # Map the categories once and broadcast through the codes
+            cat_ids = self.codes.get_indexer(values.cat.categories)
+            cat_ids = np.append(cat_ids, -1).astype(np.int32)
+            return cat_ids[values.cat.codes.values]
+
+        return self.codes.get_indexer(pd.Index(values)).astype(np.int32)
+
+    def take(self, column, ids):
+
+        """
+        Get the values of one attribute for an array of ids
+
+        Parameters
+        ----------
+        column : str
+            Name of the attribute
+        ids : numpy.ndarray of int
+            Dense ids returned by encode
+
+        Returns
+        ----------
+        values : numpy.ndarray or pandas.Categorical
+            Float array for numeric attributes, Categorical for text attributes
+
+        """
+
+        values = self.columns[column][ids]
+
+        if column in self._categories:
+            return pd.Categorical.from_codes(values, categories=self._categories[column])
+        return values
+
+
+def _database_key(conn):
+
+    """
+    Get the file of the main database to use as cache key
+    """
+
+    for _, name, filename in conn.execute('PRAGMA database_list').fetchall():
+        if name == 'main':
+            return filename or id(conn)
+    return id(conn)
+
+
+def load_dimensions(conn, refresh=False):
+
+    """
+    Load airports, carriers and plane_data tables into DimensionIndex structures.
+    The tables are read once per process and database file.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    refresh : bool (optional)
+        if True, read the tables again from the database
+
+    Returns
+    ----------
+    dims : dict of DimensionIndex
+        Keys 'airports', 'carriers' and 'plane_data'
+
+    """
+
+    key = _database_key(conn)
+
+    if not refresh and key in _DIMENSION_CACHE:
+        return _DIMENSION_CACHE[key]
+
+    airports = pd.read_sql_query("""SELECT iata, airport, city, state, country, lat, long
+                                      FROM airports""", conn)
+    airports = airports.dropna(subset=['iata']).drop_duplicates(subset='iata')
+
+    carriers = pd.read_sql_query("""SELECT Code, Description
+                                      FROM carriers""", conn)
+    carriers = carriers.dropna(subset=['Code']).drop_duplicates(subset='Code')
+
+    plane_data = pd.read_sql_query("""SELECT tailnum, manufacturer, model, aircraft_type,
+                                             engine_type, year
+                                        FROM plane_data""", conn)
+    plane_data = plane_data.dropna(subset=['tailnum']).drop_duplicates(subset='tailnum')
+    # supl_tables_data_entry stores unknown years as 1900
+    year = pd.to_numeric(plane_data['year'], errors='coerce').astype(np.float64)
+    plane_data['year'] = year.where(year != 1900)
+
+    dims = {
+        'airports': DimensionIndex(airports.iata,
+                                   {column: airports[column] for column in
+                                    ['airport', 'city', 'state', 'country', 'lat', 'long']}),
+        'carriers': DimensionIndex(carriers.Code, {'Description': carriers.Description}),
+        'plane_data': DimensionIndex(plane_data.tailnum,
+                                     {column: plane_data[column] for column in
+                                      ['manufacturer', 'model', 'aircraft_type',
+                                       'engine_type', 'year']}),
+    }
+
+    _DIMENSION_CACHE[key] = dims
+
+    return dims
+
+
+def enrich(df, index, key, columns):
+
+    """
+    Add dimension attributes to a fact DataFrame by array indexing
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Fact DataFrame
+    index : DimensionIndex
+        Dimension to look up
+    key : str
+        Column of df with the dimension codes
+    columns : dict of str
+        Mapping of dimension attribute to the new column name of df
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with the new columns
+
+    """
+
+    ids = index.encode(df[key])
+
+    for column, new_column in columns.items():
+        df[new_column] = index.take(column, ids)
+
+    return df
+
+
+def enrich_routes(df, dims):
+
+    """
+    Add the columns of the airports joins used in the route analysis:
+    airport1, airport2, start_lat, start_long, end_lat and end_long
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame with Origin and Dest columns
+    dims : dict of DimensionIndex
+        Dimensions returned by load_dimensions
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with the new columns
+
+    """
+
+    df = enrich(df, dims['airports'], 'Origin',
+                {'airport': 'airport1', 'lat': 'start_lat', 'long': 'start_long'})
+    df = enrich(df, dims['airports'], 'Dest',
+                {'airport': 'airport2', 'lat': 'end_lat', 'long': 'end_long'})
+    return df
+
+
+def enrich_carriers(df, dims):
+
+    """
+    Add the carrier Description, the same as LEFT JOIN carriers
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame with UniqueCarrier column
+    dims : dict of DimensionIndex
+        Dimensions returned by load_dimensions
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with the new column
+
+    """
+
+    return enrich(df, dims['carriers'], 'UniqueCarrier', {'Description': 'Description'})
+
+
+def benchmark_dimension_join(conn, where="WHERE Date >= date('2008-01-01')", chunksize=3000000):
+
+    """
+    Compare the airports join query of the route analysis with a plain fact
+    query enriched by enrich_routes
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    where : str (optional)
+        WHERE clause applied to both queries
+    chunksize : int (optional)
+        Chunksize of read_sql_query function
+
+    Returns
+    ----------
+    result : dict
+        Execution time in seconds of each approach and number of rows
+
+    """
+
+    # Imported here, only the benchmark needs the query stage
+    from jupyterworkflow.query import query_to_df
+
+    join_query = """SELECT Date, Origin, Dest,
+                           airport1.airport AS airport1,
+                           airport2.airport AS airport2,
+                           airport1.lat AS start_lat,
+                           airport1.long AS start_long,
+                           airport2.lat AS end_lat,
+                           airport2.long AS end_long,
+                           Distance
+                      FROM data
+                 LEFT JOIN airports AS airport1 ON airport1.iata = data.Origin
+                 LEFT JOIN airports AS airport2 ON airport2.iata = data.Dest
+                 {}""".format(where)
+
+    fact_query = """SELECT Date, Origin, Dest, Distance
+                      FROM data
+                      {}""".format(where)
+
+    with instrument.span('benchmark_dimension_join'):
+        with instrument.span('join_query') as join_span:
+            df_join = query_to_df(join_query, conn, chunksize=chunksize)
+
+        with instrument.span('dimension_index') as index_span:
+            dims = load_dimensions(conn)
+            df_index = enrich_routes(query_to_df(fact_query, conn, chunksize=chunksize), dims)
+
+    return {'rows': df_index.shape[0],
+            'join_seconds': join_span.seconds,
+            'index_seconds': index_span.seconds,
+            'same_rows': df_join.shape[0] == df_index.shape[0]}
@@ -0,0 +1,222 @@
+# Import packages
+import pandas as pd
+import numpy as np
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+############### Packages to downsample time series for the charts ##################
+####################################################################################
+####################################################################################
+
+# Points kept per series when the width of the chart is unknown
+DEFAULT_POINTS = 1000
+
+
+def _as_float(x):
+
+    """
+    Convert dates or numbers to float64, dates as nanoseconds
+    """
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb_indices(x, y, points):
+
+    """
+    Largest-Triangle-Three-Buckets downsampling of several series sharing
+    the same x. The first and last points are kept, and each bucket keeps
+    the point making the largest triangle with the point kept before it and
+    the mean of the next bucket, so peaks and troughs survive. The buckets
+    are walked once, each step computed for every series at once
+
+    Parameters
+    ----------
+    x : array-like of float or datetime64, shape (n,)
+        Increasing positions of the points
+    y : array-like of float, shape (n,) or (n, k)
+        Values of the k series, without missing values
+    points : int
+        Points kept per series, at least 3
+
+    Returns
+    ----------
+    indices : numpy.ndarray of int, shape (points, k)
+        Increasing positions of the kept points of each series
+
+    """
+
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    y = y[:, None] if y.ndim == 1 else y
+    n, k = y.shape
+
+    if points >= n or points < 3:
+        return np.repeat(np.arange(n)[:, None], k, axis=1)
+
+    # Bucket b covers edges[b]:edges[b+1], without the first and last points
+    edges = np.floor(np.linspace(1, n - 1, points - 1)).astype(np.int64)
+
+    # Mean of every bucket from cumulative sums, the last bucket is followed
+    # by the last point
+    x_sum = np.concatenate([[0.0], np.cumsum(x)])
+    y_sum = np.vstack([np.zeros(k), np.cumsum(y, axis=0)])
+    sizes = np.diff(edges).astype(np.float64)
+    x_mean = np.append((x_sum[edges[1:]] - x_sum[edges[:-1]])/sizes, x[-1])
+    y_mean = np.vstack([(y_sum[edges[1:]] - y_sum[edges[:-1]])/sizes[:, None], y[-1]])
+
+    indices = np.empty((points, k), dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    columns = np.arange(k)
+    selected = np.zeros(k, dtype=np.int64)
+
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        x_a, y_a = x[selected], y[selected, columns]
+        x_c, y_c = x_mean[bucket + 1], y_mean[bucket + 1]
+
+        # Twice the area of the triangle (a, b, c) for every b of the bucket
+        area = np.abs((x_a - x_c)*(y[start:end] - y_a) - (x_a - x[start:end, None])*(y_c - y_a))
+        selected = start + area.argmax(axis=0)
+        indices[bucket + 1] = selected
+
+    return indices
+
+
+def minmax_indices(y, points):
+
+    """
+    Min-max bucketing of several series: each bucket keeps its lowest and
+    its highest point, in the order they happen, once if they are the same
+    point. Vectorized over the buckets, faster than lttb_indices and exact
+    on peaks and troughs, with less even lines
+
+    Parameters
+    ----------
+    y : array-like of float, shape (n,) or (n, k)
+        Values of the k series, without missing values
+    points : int
+        Points kept per series at most, rounded down to an even number
+
+    Returns
+    ----------
+    indices : list of numpy.ndarray of int
+        Increasing positions of the kept points of each series, fewer
+        where a bucket is flat
+
+    """
+
+    y = np.asarray(y, dtype=np.float64)
+    y = y[:, None] if y.ndim == 1 else y
+    n, k = y.shape
+
+    buckets = max(1, points//2)
+    if 2*buckets >= n:
+        return [np.arange(n) for _ in range(k)]
+
+    size = int(np.ceil(n/buckets))
+    buckets = int(np.ceil(n/size))
+
+    # Equal buckets, the last one padded with NaN
+    padded = np.full((buckets*size, k), np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size, k)
+
+    offsets = (np.arange(buckets)*size)[:, None]
+    low = offsets + np.nanargmin(padded, axis=1)
+    high = offsets + np.nanargmax(padded, axis=1)
+
+    # The lowest and highest points of a flat bucket are the same point
+    return [np.unique(np.concatenate([low[:, j], high[:, j]])) for j in range(k)]
+
+
+def downsample(df, points=DEFAULT_POINTS, method='lttb'):
+
+    """
+    Downsample every column of a DataFrame to a number of points, for
+    example the daily flights of each hub. The missing values of a series,
+    such as the edges of a centered rolling mean, are dropped from that
+    series only
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        One series per column, the index gives the positions
+    points : int (optional)
+        Points kept per series, about the width of the chart in pixels
+    method : str (optional)
+        'lttb' or 'minmax'
+
+    Returns
+    ----------
+    long : pandas.DataFrame
+        Columns with the name of the index (Date by default), series and
+        value, the kept points of each series in order
+
+    """
+
+    if method not in ('lttb', 'minmax'):
+        raise ValueError("method must be 'lttb' or 'minmax', not {!r}".format(method))
+
+    index_name = df.index.name or 'Date'
+    positions = df.index.values
+
+    with instrument.span('downsample', method=method, series=df.shape[1]) as span:
+        values = df.to_numpy(dtype=np.float64)
+        kept = [None]*df.shape[1]
+
+        # Series missing the same rows are downsampled together
+        masks, groups = np.unique(~np.isnan(values), axis=1, return_inverse=True)
+        groups = groups.ravel()
+
+        for group in range(masks.shape[1]):
+            rows = np.flatnonzero(masks[:, group])
+            columns = np.flatnonzero(groups == group)
+            y = values[np.ix_(rows, columns)]
+
+            if method == 'lttb':
+                indices = list(lttb_indices(positions[rows], y, points).T)
+            else:
+                indices = minmax_indices(y, points)
+
+            for column, index in zip(columns, indices):
+                kept[column] = rows[index]
+
+        long = pd.DataFrame({index_name: positions[np.concatenate(kept)],
+                             'series': np.repeat(np.asarray(df.columns), [len(index) for index in kept]),
+                             'value': np.concatenate([values[index, j] for j, index in enumerate(kept)])})
+        span.add(rows=len(long))
+
+    return long
+
+
+def trend(daily, window=365, points=DEFAULT_POINTS, method='lttb'):
+
+    """
+    Centered rolling mean of daily series, downsampled for a trend chart
+
+    Parameters
+    ----------
+    daily : pandas.DataFrame
+        Daily values, one series per column, for example counting.date_matrix
+    window : int (optional)
+        Days of the rolling mean
+    points : int (optional)
+        Points kept per series
+    method : str (optional)
+        'lttb' or 'minmax'
+
+    Returns
+    ----------
+    long : pandas.DataFrame
+        Date, series and value of the kept points, see downsample
+
+    """
+
+    return downsample(daily.rolling(window, center=True).mean(), points, method)
@@ -0,0 +1,313 @@
+# Import packages
+import os
+import gzip
+import json
+import time
+import pandas as pd
+import numpy as np
+
+from jupyterworkflow import counting
+from jupyterworkflow import downsample
+from jupyterworkflow import instrument
+from jupyterworkflow.query import query_to_df
+
+####################################################################################
+####################################################################################
+############### Packages to export and render the report aggregates ################
+####################################################################################
+####################################################################################
+
+# Version of the bundle layout, load_bundle refuses other major versions
+BUNDLE_VERSION = '1.2'
+
+BUNDLE_FILE = 'source/report_bundle.json.gz'
+
+# Hubs and carriers of the report charts
+HUBS = ['ORD', 'ATL', 'DFW', 'LAX', 'PHX']
+TOP_3 = ['American Airlines Inc.', 'Delta Air Lines Inc.', 'United Air Lines Inc.']
+
+# Aggregate queries of the report: name -> query. Every chart is drawn from
+# these results, so the flights are counted by SQLite instead of pulled
+AGGREGATE_QUERIES = {
+    'dest_counts': """SELECT Dest, COUNT(*) AS flights
+                        FROM data
+                    GROUP BY Dest""",
+    'origin_counts': """SELECT Origin, COUNT(*) AS flights
+                          FROM data
+                      GROUP BY Origin""",
+    'hub_carrier_days': """SELECT Origin, Date, Description, COUNT(*) AS flights
+                             FROM data
+                        LEFT JOIN carriers ON carriers.Code = data.UniqueCarrier
+                            WHERE Origin IN ({})
+                         GROUP BY Origin, Date, Description""".format(', '.join("'{}'".format(hub) for hub in HUBS)),
+    'routes': """SELECT Origin, Dest,
+                        airport1.airport AS airport1,
+                        airport2.airport AS airport2,
+                        airport1.lat AS start_lat,
+                        airport1.long AS start_long,
+                        airport2.lat AS end_lat,
+                        airport2.long AS end_long,
+                        MAX(Distance) AS Distance,
+                        COUNT(*) AS flights
+                   FROM data
+              LEFT JOIN airports AS airport1 ON airport1.iata = data.Origin
+              LEFT JOIN airports AS airport2 ON airport2.iata = data.Dest
+                  WHERE Date >= date('2008-01-01')
+               GROUP BY Origin, Dest""",
+    'airports': """SELECT iata, airport, lat, long
+                     FROM airports""",
+}
+
+
+# Days of the rolling mean of the trend charts
+TREND_WINDOW = 365
+
+# Points of each line of the trend charts, the width of the chart in pixels
+TREND_POINTS = 1600
+
+
+def build_aggregates(conn, trend_points=TREND_POINTS, full=False):
+
+    """
+    Compute the aggregate behind every chart of the report
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    trend_points : int (optional)
+        Points kept for each line of the trend charts, see downsample.trend
+    full : bool (optional)
+        if True, also keep the daily matrices daily_hubs and daily_carriers
+        behind the trend lines, one row per day of the period
+
+    Returns
+    ----------
+    aggregates : dict of pandas.DataFrame or pandas.Series
+        dest_counts, origin_counts, carrier_counts, carrier_share,
+        hub_carriers, routes and airports, the downsampled trend lines
+        daily_hubs_trend and daily_carriers_trend, and daily_hubs and
+        daily_carriers if full is True
+
+    """
+
+    with instrument.span('build_aggregates'):
+        df = {name: query_to_df(query, conn) for name, query in AGGREGATE_QUERIES.items()}
+
+        days = df['hub_carrier_days']
+        days['Description_2'] = np.where(days['Description'].isin(TOP_3), days['Description'], 'other')
+        weights = days['flights'].values
+
+        def integer(counts):
+            return counts.round().astype(np.int64)
+
+        aggregates = {
+            'dest_counts': df['dest_counts'].set_index('Dest')['flights'].sort_values(ascending=False),
+            'origin_counts': df['origin_counts'].set_index('Origin')['flights'].sort_values(ascending=False),
+            'carrier_counts': integer(counting.counts(days['Description'], weights)),
+            'carrier_share': integer(counting.counts(days['Description_2'], weights)),
+            'daily_hubs': integer(counting.date_matrix(days['Date'], days['Origin'], weights)[HUBS]),
+            'daily_carriers': integer(counting.date_matrix(days['Date'], days['Description_2'], weights)),
+            'hub_carriers': integer(counting.crosstab(days['Origin'], days['Description_2'], weights).loc[HUBS]),
+            'routes': df['routes'],
+            'airports': df['airports'],
+        }
+
+        for name in ['daily_hubs', 'daily_carriers']:
+            aggregates[name + '_trend'] = downsample.trend(aggregates[name], TREND_WINDOW, trend_points)
+            if not full:
+                del aggregates[name]
+
+    return aggregates
+
+
+def _encode(value):
+
+    """
+    Convert a DataFrame or Series to a JSON object with split orient
+    """
+
+    is_series = isinstance(value, pd.Series)
+    frame = value.to_frame() if is_series else value
+    split = json.loads(frame.to_json(orient='split', date_format='iso', double_precision=6))
+    split['series'] = is_series
+    split['name'] = value.name if is_series else None
+    split['dates'] = isinstance(frame.index, pd.DatetimeIndex)
+    return split
+
+
+def _decode(split):
+    df = pd.DataFrame(split['data'], index=split['index'], columns=split['columns'])
+    if split['dates']:
+        df.index = pd.to_datetime(df.index)
+    if split['series']:
+        return df.iloc[:, 0].rename(split['name'])
+    return df
+
+
+def export_bundle(conn, filepath=BUNDLE_FILE, aggregates=None):
+
+    """
+    Write the report aggregates to a versioned, gzip compressed JSON bundle,
+    so the report can be rendered without all_data.db
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    filepath : str (optional)
+        Complete filepath of the bundle
+    aggregates : dict (optional)
+        Result of build_aggregates, computed from conn if None
+
+    Returns
+    ----------
+    size : int
+        Size of the bundle in bytes
+
+    """
+
+    if aggregates is None:
+        aggregates = build_aggregates(conn)
+
+    bundle = {'version': BUNDLE_VERSION,
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'rows': {name: len(value) for name, value in aggregates.items()},
+              'aggregates': {name: _encode(value) for name, value in aggregates.items()}}
+
+    with instrument.span('export_bundle') as span:
+        folder = os.path.dirname(filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with gzip.open(filepath, 'wt', encoding='utf-8') as file:
+            json.dump(bundle, file, separators=(',', ':'))
+
+        span.add(bytes=os.path.getsize(filepath))
+
+    return os.path.getsize(filepath)
+
+
+def load_bundle(filepath=BUNDLE_FILE):
+
+    """
+    Read a bundle written by export_bundle
+
+    Parameters
+    ----------
+    filepath : str (optional)
+        Complete filepath of the bundle
+
+    Returns
+    ----------
+    aggregates : dict of pandas.DataFrame or pandas.Series
+        Aggregates of the report, see build_aggregates
+
+    """
+
+    with gzip.open(filepath, 'rt', encoding='utf-8') as file:
+        bundle = json.load(file)
+
+    if bundle['version'].split('.')[0] != BUNDLE_VERSION.split('.')[0]:
+        raise ValueError('bundle version {} is not supported, expected {}'.format(bundle['version'], BUNDLE_VERSION))
+
+    return {name: _decode(split) for name, split in bundle['aggregates'].items()}
+
+
+def render_report(aggregates, directory='source/report', dpi=80):
+
+    """
+    Draw the charts of the report from the aggregates to png files
+
+    Parameters
+    ----------
+    aggregates : dict
+        Result of build_aggregates or load_bundle
+    directory : str (optional)
+        Folder of the png files
+    dpi : int (optional)
+        Resolution of the png files
+
+    Returns
+    ----------
+    filepaths : list of str
+        Complete filepath of every chart
+
+    """
+
+    # Imported here, only rendering needs matplotlib
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    os.makedirs(directory, exist_ok=True)
+    filepaths = []
+
+    def save(fig, name):
+        filepath = os.path.join(directory, name + '.png')
+        fig.savefig(filepath, dpi=dpi, bbox_inches='tight')
+        plt.close(fig)
+        filepaths.append(filepath)
+
+    def ranking(counts, title, xlabel, name, top=True):
+        fig, ax = plt.subplots(figsize=(10, 5))
+        values = counts[:10] if top else counts[-20:]
+        ax.bar(values.index.astype(str), values.values)
+        if top:
+            ax.axhline(counts.mean(), color='red')
+            ax.text(1.02, counts.mean(), 'mean: {:,.0f}'.format(counts.mean()), va='center', ha='left',
+                    bbox=dict(facecolor='w', alpha=0.5), transform=ax.get_yaxis_transform())
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Count')
+        save(fig, name)
+
+    with instrument.span('render_report'):
+        ranking(aggregates['dest_counts'], 'Destination flights per Airport', 'Destination of the Flight',
+                'dest_ranking')
+        ranking(aggregates['origin_counts'], 'Origin flights per Airport', 'Origin of the Flight',
+                'origin_ranking')
+        ranking(aggregates['origin_counts'], 'Origin flights per Airport', 'Origin of the Flight',
+                'origin_bottom', top=False)
+        ranking(aggregates['carrier_counts'], 'Number of flights per Carrier', 'Carrier', 'carrier_ranking')
+
+        fig, ax = plt.subplots()
+        share = aggregates['carrier_share']
+        ax.pie(share.values, labels=share.index, autopct='%1.0f%%', startangle=90)
+        ax.axis('equal')
+        save(fig, 'carrier_share')
+
+        for name, title in [('daily_hubs', 'Trends of the Commercial flights within the US - Departure'),
+                            ('daily_carriers', 'Trends of the Commercial flights within the US - Carriers')]:
+            fig, ax = plt.subplots(figsize=(20, 10))
+            # Bundles of version 1.0 have the daily matrices instead of the
+            # trend lines
+            trend = aggregates.get(name + '_trend')
+            if trend is None:
+                trend = downsample.trend(aggregates[name], TREND_WINDOW, int(fig.get_figwidth()*dpi))
+            for series, line in trend.groupby('series', sort=False):
+                ax.plot(pd.to_datetime(line['Date']), line['value'], label=series)
+            ax.legend()
+            ax.set_xlabel('Years')
+            ax.set_ylabel('Number of flights')
+            ax.set_title(title)
+            ax.grid(axis='x')
+            save(fig, name)
+
+        fig, ax = plt.subplots(figsize=(20, 10))
+        aggregates['hub_carriers'].plot.bar(stacked=True, ax=ax)
+        ax.set_ylabel('Number of flights')
+        save(fig, 'hub_carriers')
+
+        fig, ax = plt.subplots(figsize=(15, 8))
+        routes = aggregates['routes'].dropna(subset=['start_long', 'end_long'])
+        segments = np.stack([routes[['start_long', 'start_lat']].values.astype(np.float64),
+                             routes[['end_long', 'end_lat']].values.astype(np.float64)], axis=1)
+        ax.add_collection(LineCollection(segments, colors='red', linewidths=0.1))
+        airports = aggregates['airports']
+        ax.scatter(airports['long'], airports['lat'], s=1)
+        ax.set_title('Flight routes in 2008')
+        save(fig, 'routes')
+
+    return filepaths
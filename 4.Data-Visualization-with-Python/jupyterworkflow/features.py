@@ -0,0 +1,408 @@
+# Import packages
+import time
+import hashlib
+import pandas as pd
+import numpy as np
+
+from jupyterworkflow import chunking
+from jupyterworkflow import dictionary
+from jupyterworkflow import dimensions
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+############ Packages to stream model features and train incrementally #############
+####################################################################################
+####################################################################################
+
+# A flight is delayed when it arrives 15 minutes late or more, as in the
+# on-time statistics of the Bureau of Transportation Statistics
+DELAY_MINUTES = 15
+
+# Columns of raw_data read for the features and the target
+FEATURE_COLUMNS = ['Month', 'DayOfWeek', 'CRSDepTime', 'CRSElapsedTime', 'Distance',
+                   'UniqueCarrier', 'Origin', 'Dest']
+
+CATEGORICAL_COLUMNS = ['UniqueCarrier', 'Origin', 'Dest']
+
+# Calendar features one-hot encoded: column -> number of values, from 1
+CALENDAR = {'Month': 12, 'DayOfWeek': 7, 'hour': 24}
+
+# Fixed scales of the numeric features, so every chunk is scaled the same way
+# without a pass over the table
+NUMERIC_SCALES = {'Distance': 5000.0, 'CRSElapsedTime': 600.0}
+
+# Columns of the hashed features
+HASH_FEATURES = 2**18
+
+FEATURE_QUERY = """SELECT {}, ArrDelay
+                     FROM raw_data
+                    WHERE Cancelled = 0 AND Diverted = 0{}"""
+
+
+def feature_query(start_year=None, last_year=None):
+
+    """
+    Get the query of the flights used to train a model: the flights that
+    were neither cancelled nor diverted, in raw_data order
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First year, the first loaded year if None
+    last_year : int (optional)
+        Last year, the last loaded year if None
+
+    Returns
+    ----------
+    query : str
+
+    """
+
+    years = ''
+    if start_year is not None:
+        years += ' AND Year >= {:d}'.format(start_year)
+    if last_year is not None:
+        years += ' AND Year <= {:d}'.format(last_year)
+
+    return FEATURE_QUERY.format(', '.join(FEATURE_COLUMNS), years)
+
+
+def _hashes(values, name):
+
+    """
+    Hash the values of a column to 64 bits, the same value of the same
+    column always to the same hash, in any process. Codes of the text and
+    of the encoded layout get different hashes
+    """
+
+    # The hashes of a column depend on a key derived from its name
+    key = hashlib.md5(name.encode()).hexdigest()[:16]
+    values = np.asarray(values)
+
+    if values.dtype.kind in 'iuf':
+        ids = np.nan_to_num(values.astype(np.float64), nan=-1).astype(np.int64).view(np.uint64)
+        return pd.util.hash_array(ids ^ np.uint64(int(key, 16)))
+    return pd.util.hash_array(values.astype(object), hash_key=key)
+
+
+class FlightFeatures:
+
+    """
+    Sparse features of the flights, computed chunk by chunk with a fixed
+    number of columns, so every chunk feeds the same model:
+    - one-hot Month, DayOfWeek and scheduled departure hour
+    - Distance and CRSElapsedTime over NUMERIC_SCALES, and the scheduled
+      departure time of day as a sine and a cosine
+    - UniqueCarrier, Origin and Dest, hashed or one-hot
+    - the crossed columns, for example the route Origin x Dest, hashed
+
+    Parameters
+    ----------
+    encoding : str (optional)
+        'hash' to hash the carrier and airports with the crosses, no reading
+        of the database needed, or 'onehot' for one column per carrier and
+        airport of the database, and one for the unknown codes
+    hash_features : int (optional)
+        Columns of the hashed features
+    crosses : tuple of tuple of str (optional)
+        Pairs of categorical columns crossed
+    conn : sqlite3.Connection (optional)
+        Database of the codes, needed by 'onehot'
+
+    Attributes
+    ----------
+    n_features : int
+        Columns of the features
+
+    """
+
+    def __init__(self, encoding='hash', hash_features=HASH_FEATURES, crosses=(('Origin', 'Dest'),), conn=None):
+
+        if encoding not in ('hash', 'onehot'):
+            raise ValueError("encoding must be 'hash' or 'onehot', not {!r}".format(encoding))
+
+        self.encoding = encoding
+        self.hash_features = hash_features
+        self.crosses = [tuple(cross) for cross in crosses]
+        self.codes = {}
+        self.encoded = False
+
+        if encoding == 'onehot':
+            if conn is None:
+                raise ValueError("the 'onehot' encoding reads the codes of the database, conn is needed")
+            self.encoded = dictionary.is_encoded(conn)
+            if self.encoded:
+                # Ids of the encoded layout are the positions of the codes
+                codes = dictionary.load_codes(conn)
+                self.codes = {column: codes[dictionary.COLUMN_DIMENSION[column]] for column in CATEGORICAL_COLUMNS}
+            else:
+                dims = dimensions.load_dimensions(conn)
+                self.codes = {'UniqueCarrier': dims['carriers'].codes,
+                              'Origin': dims['airports'].codes,
+                              'Dest': dims['airports'].codes}
+
+        # Offset of each block of columns
+        self.offsets = {}
+        position = 0
+        for name, size in CALENDAR.items():
+            self.offsets[name] = position
+            position += size
+        self.offsets['numeric'] = position
+        position += len(NUMERIC_SCALES) + 2
+        if encoding == 'onehot':
+            for column in CATEGORICAL_COLUMNS:
+                self.offsets[column] = position
+                position += len(self.codes[column]) + 1
+        self.offsets['hashed'] = position
+        self.n_features = position + (hash_features if encoding == 'hash' or self.crosses else 0)
+
+    def _category_ids(self, values, column):
+
+        """
+        Get the column of each code of the one-hot encoding, the last one for
+        unknown and missing codes
+        """
+
+        codes = self.codes[column]
+        if self.encoded:
+            ids = pd.to_numeric(values, errors='coerce').fillna(-1).to_numpy(np.int64, copy=True)
+            ids[(ids < 0) | (ids >= len(codes))] = -1
+        else:
+            ids = codes.get_indexer(values.astype(object))
+        ids[ids < 0] = len(codes)
+        return self.offsets[column] + ids
+
+    def transform(self, chunk):
+
+        """
+        Compute the features of a chunk of flights
+
+        Parameters
+        ----------
+        chunk : pandas.DataFrame
+            FEATURE_COLUMNS of the flights, see feature_query
+
+        Returns
+        ----------
+        X : scipy.sparse.csr_matrix, shape (rows, n_features)
+
+        """
+
+        # Imported here, only the model features need scipy
+        from scipy import sparse
+
+        rows = len(chunk)
+        departure = pd.to_numeric(chunk['CRSDepTime'], errors='coerce').fillna(0).to_numpy(np.float64)
+        minutes = (departure//100)*60 + departure % 100
+        hour = np.clip(departure//100, 0, 23).astype(np.int64)
+
+        indices, values = [], []
+
+        # One-hot calendar, the values start at 1
+        for name in ['Month', 'DayOfWeek']:
+            value = pd.to_numeric(chunk[name], errors='coerce').fillna(1).to_numpy(np.int64)
+            indices.append(self.offsets[name] + np.clip(value, 1, CALENDAR[name]) - 1)
+            values.append(np.ones(rows))
+        indices.append(self.offsets['hour'] + hour)
+        values.append(np.ones(rows))
+
+        # Numeric features, on scales about 0 to 1
+        position = self.offsets['numeric']
+        for name, scale in NUMERIC_SCALES.items():
+            indices.append(np.full(rows, position))
+            values.append(pd.to_numeric(chunk[name], errors='coerce').fillna(0).to_numpy(np.float64)/scale)
+            position += 1
+        angle = 2*np.pi*minutes/(24*60)
+        for function in (np.sin, np.cos):
+            indices.append(np.full(rows, position))
+            values.append(function(angle))
+            position += 1
+
+        # Carrier and airports
+        for column in CATEGORICAL_COLUMNS:
+            if self.encoding == 'onehot':
+                indices.append(self._category_ids(chunk[column], column))
+            else:
+                hashed = _hashes(chunk[column], column) % np.uint64(self.hash_features)
+                indices.append(self.offsets['hashed'] + hashed.astype(np.int64))
+            values.append(np.ones(rows))
+
+        # Crosses, hashed from the hashes of their columns
+        for left, right in self.crosses:
+            pair = _hashes(chunk[left], left)*np.uint64(0x9E3779B97F4A7C15) ^ _hashes(chunk[right], right)
+            indices.append(self.offsets['hashed'] + (pair % np.uint64(self.hash_features)).astype(np.int64))
+            values.append(np.ones(rows))
+
+        # Every row has the same number of values: build the CSR arrays directly
+        width = len(indices)
+        return sparse.csr_matrix((np.column_stack(values).ravel(), np.column_stack(indices).ravel(),
+                                  np.arange(0, rows*width + 1, width)), shape=(rows, self.n_features))
+
+
+def target_values(chunk, target='delayed'):
+
+    """
+    Get the target of a chunk of flights
+
+    Parameters
+    ----------
+    chunk : pandas.DataFrame
+        ArrDelay of the flights
+    target : str (optional)
+        'delayed' for 1 when the flight arrived DELAY_MINUTES late or more,
+        or 'ArrDelay' for the minutes of delay
+
+    Returns
+    ----------
+    y : numpy.ndarray
+
+    """
+
+    delay = pd.to_numeric(chunk['ArrDelay'], errors='coerce').fillna(0).to_numpy(np.float64)
+    if target == 'delayed':
+        return (delay >= DELAY_MINUTES).astype(np.int8)
+    if target == 'ArrDelay':
+        return delay
+    raise ValueError("target must be 'delayed' or 'ArrDelay', not {!r}".format(target))
+
+
+def iter_batches(conn, features, target='delayed', start_year=None, last_year=None,
+                 chunksize=200000, memory_budget=None):
+
+    """
+    Stream the features and target of the flights chunk by chunk, the
+    memory held is about one chunk and its features
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    features : FlightFeatures
+        Features of the flights
+    target : str (optional)
+        'delayed' or 'ArrDelay', see target_values
+    start_year : int (optional)
+        First year
+    last_year : int (optional)
+        Last year
+    chunksize : int (optional)
+        Rows of each chunk, ignored if memory_budget is given
+    memory_budget : int or str (optional)
+        Memory allowed for each chunk, see chunking.ChunkSizer
+
+    Returns
+    ----------
+    batches : generator of tuple
+        X (scipy.sparse.csr_matrix) and y (numpy.ndarray) of each chunk
+
+    """
+
+    sizer = chunksize if memory_budget is None else chunking.ChunkSizer(memory_budget)
+
+    for number, chunk in enumerate(chunking.iter_query(feature_query(start_year, last_year), conn, sizer)):
+        with instrument.span('features', number=number) as span:
+            X = features.transform(chunk)
+            y = target_values(chunk, target)
+            span.add(rows=len(chunk))
+        del chunk
+        yield X, y
+
+
+def default_model(target='delayed'):
+
+    """
+    Get a linear model trained with stochastic gradient descent, which
+    learns chunk by chunk with partial_fit: logistic regression for
+    'delayed', least squares for 'ArrDelay'. The weights are averaged over
+    the steps, steadier than the last step on noisy delays
+    """
+
+    # Imported here, only the model training needs scikit-learn
+    from sklearn.linear_model import SGDClassifier, SGDRegressor
+
+    if target == 'delayed':
+        return SGDClassifier(loss='log_loss', alpha=1e-5, average=True, random_state=0)
+    return SGDRegressor(alpha=1e-5, average=True, random_state=0)
+
+
+def train_incremental(conn, model=None, features=None, target='delayed', start_year=None, last_year=None,
+                      epochs=1, chunksize=200000, memory_budget=None):
+
+    """
+    Train a model on the flights chunk by chunk with partial_fit. Each chunk
+    is scored before the model learns from it (progressive validation), so
+    the scores are on flights the model has not seen yet
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    model : estimator (optional)
+        Model with partial_fit, for example SGDClassifier, MultinomialNB or
+        PassiveAggressiveRegressor, default_model(target) if None
+    features : FlightFeatures (optional)
+        Features of the flights, hashed if None
+    target : str (optional)
+        'delayed' or 'ArrDelay', see target_values
+    start_year : int (optional)
+        First year
+    last_year : int (optional)
+        Last year
+    epochs : int (optional)
+        Passes over the flights
+    chunksize : int (optional)
+        Rows of each chunk, ignored if memory_budget is given
+    memory_budget : int or str (optional)
+        Memory allowed for each chunk, see chunking.ChunkSizer
+
+    Returns
+    ----------
+    model : estimator
+        Trained model
+    history : pandas.DataFrame
+        Per chunk: epoch, rows, score before training (accuracy for a
+        classifier, R^2 otherwise), seconds of the features and of
+        partial_fit, and rows per second
+
+    """
+
+    from sklearn.base import is_classifier
+    from sklearn.exceptions import NotFittedError
+
+    model = default_model(target) if model is None else model
+    features = FlightFeatures() if features is None else features
+    classifier = is_classifier(model)
+
+    records = []
+    with instrument.span('train_incremental', target=target, encoding=features.encoding) as span:
+        for epoch in range(epochs):
+            batches = iter_batches(conn, features, target, start_year, last_year, chunksize, memory_budget)
+            start = time.perf_counter()
+
+            for number, (X, y) in enumerate(batches):
+                feature_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                try:
+                    score = model.score(X, y)
+                except NotFittedError:
+                    score = np.nan
+                if classifier:
+                    model.partial_fit(X, y, classes=np.array([0, 1]))
+                else:
+                    model.partial_fit(X, y)
+                fit_seconds = time.perf_counter() - start
+
+                span.add(rows=len(y))
+                records.append({'epoch': epoch,
+                                'chunk': number,
+                                'rows': len(y),
+                                'score': score,
+                                'feature_seconds': feature_seconds,
+                                'fit_seconds': fit_seconds,
+                                'rows_per_sec': len(y)/(feature_seconds + fit_seconds)})
+                del X, y
+                start = time.perf_counter()
+
+    return model, pd.DataFrame(records)
@@ -0,0 +1,788 @@
+# Import packages
+import pandas as pd
+import numpy as np
+import time
+import sqlite3
+
+from jupyterworkflow import chunking
+from jupyterworkflow import dictionary
+from jupyterworkflow import instrument
+from jupyterworkflow import profiling
+
+####################################################################################
+####################################################################################
+################### Packages to create SQL tables with csv files ###################
+####################################################################################
+####################################################################################
+
+def create_raw_table(conn, encoded=False):
+
+    """
+    Create empty sqlite table arranged to be filled with raw csv files
+
+    Parameters
+    ----------
+    conn : str
+        Connection object that represents the database
+    encoded : bool (optional)
+        if True, UniqueCarrier, TailNum, Origin and Dest are stored as integer
+        ids of the dimension tables (dim_carrier, dim_tailnum, dim_airport),
+        which are created and seeded with the supplemental files
+
+    Returns
+    ----------
+
+    """
+
+    c = conn.cursor()
+
+    c.execute('DROP TABLE IF EXISTS raw_data')
+
+    # The Ids of the new raw_data table start over, so the tables derived
+    # from the old one cannot be updated incrementally
+    reset_derived_tables(conn)
+
+    if encoded:
+        dictionary.create_dimension_tables(conn)
+    else:
+        for table in dictionary.DIMENSIONS:
+            c.execute('DROP TABLE IF EXISTS {}'.format(table))
+
+    code_type = 'INTEGER' if encoded else 'TEXT'
+    
+    sql_query = """CREATE TABLE raw_data (Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                          Year INTEGER,
+                                          Month INTEGER, 
+                                          DayofMonth INTEGER,
+                                          DayOfWeek INTEGER, 
+                                          DepTime INTEGER,
+                                          CRSDepTime INTEGER, 
+                                          ArrTime INTEGER,
+                                          CRSArrTime INTEGER, 
+                                          UniqueCarrier {0},
+                                          FlightNum INTEGER, 
+                                          TailNum {0},
+                                          ActualElapsedTime INTEGER, 
+                                          CRSElapsedTime INTEGER,
+                                          AirTime INTEGER, 
+                                          ArrDelay INTEGER,
+                                          DepDelay INTEGER, 
+                                          Origin {0},
+                                          Dest {0}, 
+                                          Distance INTEGER, 
+                                          TaxiIn INTEGER,
+                                          TaxiOut INTEGER, 
+                                          Cancelled INTEGER,
+                                          CancellationCode TEXT, 
+                                          Diverted INTEGER,
+                                          CarrierDelay INTEGER, 
+                                          WeatherDelay INTEGER,
+                                          NASDelay INTEGER, 
+                                          SecurityDelay INTEGER,
+                                          LateAircraftDelay INTEGER)""".format(code_type)
+    with instrument.span('create_raw_table'):
+        c.execute(sql_query)
+    
+    c.close()
+    conn.close()
+    
+    return print('Table created successfully')
+
+
+# Pages of the WAL file after which SQLite checkpoints it into the database
+WAL_AUTOCHECKPOINT = 10000
+
+
+def enable_wal(conn, autocheckpoint=WAL_AUTOCHECKPOINT):
+
+    """
+    Switch a database to write-ahead logging. The mode is stored in the
+    database file, so every later connection uses it. Readers then see the
+    last committed snapshot while a writer appends, instead of waiting for
+    the rollback journal lock
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    autocheckpoint : int (optional)
+        Pages of the WAL file after which it is checkpointed
+
+    Returns
+    ----------
+    journal_mode : str
+        Journal mode of the database, 'wal' unless it is in memory
+
+    """
+
+    journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    # Commits are durable at the next checkpoint, which is safe for a reloadable ingest
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA wal_autocheckpoint={}'.format(int(autocheckpoint)))
+
+    return journal_mode
+
+
+def _insert_chunk(conn, chunk, table='raw_data'):
+
+    """
+    Insert a chunk without committing, unlike DataFrame.to_sql, so a year is
+    committed at once
+    """
+
+    columns = list(chunk.columns)
+    rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+    conn.executemany('INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns),
+                                                             ', '.join('?'*len(columns))), rows)
+
+
+def raw_data_entry(conn,start_year=1987,last_year=1988,chunksize=3000000,encoding='latin-1',
+                   memory_budget=None, profile=None, wal=False):
+
+    """
+    Entry raw data from csv files to raw_data table
+
+    Parameters
+    ----------
+    start_year : int (optimal)
+        First csv file year to be insert into raw_data table
+
+    last_year : int (optimal)
+        Last csv file year to be insert into raw_data table
+
+    chunksize : int (optimal)
+        Chunksize of read_csv function, ignored if memory_budget is given
+
+    encoding : str (optimal)
+        Encoding of csv files
+
+    memory_budget : int or str (optional)
+        Memory allowed for the ingest, for example '4GB'. The chunksize is
+        measured on the first chunk and adapted to the budget
+
+    profile : dict or str (optional)
+        Profile of profiling.profile_years or the filepath of its JSON file.
+        The columns of each profiled year are parsed with their narrowest
+        type, and the columns without any value are not parsed
+
+    wal : bool (optional)
+        if True, the database is switched to WAL, see enable_wal, and each
+        year is committed at once and checkpointed. Other connections can
+        query the years already loaded, and never see a partial year
+
+    Returns
+    ----------
+
+    """
+
+    c = conn.cursor()
+
+    if isinstance(profile, str):
+        profile = profiling.load_profile(profile)
+
+    # Tables created by create_raw_table(conn, encoded=True) store integer ids
+    codes = dictionary.load_codes(conn) if dictionary.is_encoded(conn) else None
+
+    sizer = chunking.ChunkSizer(memory_budget) if memory_budget is not None else None
+
+    if wal:
+        enable_wal(conn)
+
+    with instrument.span('raw_data_entry', start_year=start_year, last_year=last_year):
+
+        for years in range(0,last_year-start_year+1):
+
+            with instrument.span('csv_file', year=start_year+years) as year_span:
+
+                filepath = 'source/{}.csv'.format(start_year+years)
+
+                year = profiling.year_profile(profile, start_year+years) if profile is not None else None
+                if year is not None:
+                    empty = profiling.empty_columns(year)
+                    dtypes = profiling.column_dtypes(year)
+                    integers = profiling.integer_dtypes(year)
+                    options = {'usecols': list(dtypes), 'dtype': dtypes}
+                    # A year smaller than the chunksize is read at once
+                    year_chunksize = max(1, min(chunksize, year['rows']))
+                else:
+                    empty = []
+                    options = {}
+                    year_chunksize = chunksize
+
+                if sizer is None:
+                    reader = pd.read_csv(filepath, chunksize=year_chunksize, encoding=encoding, **options)
+                else:
+                    reader = chunking.iter_csv(filepath, sizer, encoding=encoding, **options)
+
+                for number, chunk in enumerate(reader):
+
+                    with instrument.span('chunk', number=number, chunksize=len(chunk)) as span:
+
+                        if codes is not None:
+                            chunk = dictionary.encode_chunk(chunk, conn, codes)
+                            id_columns = list(dictionary.COLUMN_DIMENSION)
+                        else:
+                            id_columns = []
+
+                        if year is not None:
+                            # Integer columns with missing values, read as floats
+                            for column, dtype in integers.items():
+                                if column not in id_columns and chunk[column].dtype.kind == 'f':
+                                    chunk[column] = chunk[column].fillna(0).to_numpy(dtype)
+
+                            # Columns without values are 0 as after fillna, ids stay NULL
+                            for column in empty:
+                                if column not in id_columns:
+                                    chunk[column] = np.zeros(len(chunk), dtype=np.int8)
+
+                        float_columns = []
+                        float_columns = (chunk.select_dtypes(['float'])).columns
+
+                        # Missing ids stay NULL instead of 0
+                        int_columns = []
+                        int_columns = (chunk.select_dtypes(['int'])).columns.difference(id_columns)
+
+                        chunk.loc[:,float_columns] = chunk.loc[:,float_columns].fillna(0).astype(int)
+                        chunk.loc[:,int_columns] = chunk.loc[:,int_columns].fillna(0)
+
+                        if wal:
+                            _insert_chunk(conn, chunk)
+                        else:
+                            chunk.to_sql(name="raw_data", con=conn, if_exists="append", index=False)
+                            conn.commit()
+
+                        span.add(rows=len(chunk), bytes=int(chunk.memory_usage(index=False).sum()))
+
+                    del chunk
+
+                if wal:
+                    conn.commit()
+                    # Checkpoint between years, without waiting for the readers
+                    busy, log_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+                    year_span.add(wal_pages=log_pages, checkpointed_pages=checkpointed)
+    
+    c.close()
+    conn.close()
+    
+    return print('Values inserted successfully')
+
+
+
+def create_supl_tables(conn):
+
+    """
+    Create empty sqlite table of supplemental files, arranged to be filled with raw csv files:
+    - Airports data file;
+    - Carriers data file;
+    - Plane-data file;
+
+    Parameters
+    ----------
+    conn : str
+        Connection object that represents the database
+
+    Returns
+    ----------
+
+    """
+
+    c = conn.cursor()
+    
+    # airports table
+    c.execute('DROP TABLE IF EXISTS airports')
+    
+    sql_query = """CREATE TABLE airports (Id_airports INTEGER PRIMARY KEY AUTOINCREMENT,
+                                          iata TEXT,
+                                          airport TEXT,
+                                          city TEXT,
+                                          state TEXT,
+                                          country TEXT,
+                                          lat NUMERIC,
+                                          long NUMERIC)"""
+    c.execute(sql_query)
+    
+    print('airport table created successfully')
+    
+    # carriers table    
+    c.execute('DROP TABLE IF EXISTS carriers')
+    
+    sql_query = """CREATE TABLE carriers (Id_carriers INTEGER PRIMARY KEY AUTOINCREMENT,
+                                          Code TEXT,
+                                          Description TEXT)"""
+    c.execute(sql_query)
+    
+    print('carriers table created successfully')
+   
+    # plane_data table
+    c.execute('DROP TABLE IF EXISTS plane_data')
+    
+    sql_query = """CREATE TABLE plane_data (Id_plane_data INTEGER PRIMARY KEY AUTOINCREMENT,
+                                            tailnum TEXT,
+                                            type TEXT,
+                                            manufacturer TEXT,
+                                            issue_date TEXT,
+                                            model TEXT,
+                                            status TEXT,
+                                            aircraft_type TEXT,
+                                            engine_type TEXT,
+                                            year INTEGER)"""
+    c.execute(sql_query)
+    
+    print('plane_data table created successfully')
+    
+    c.close()
+    conn.close()
+
+def supl_tables_data_entry(conn,encoding='latin-1'):
+
+    """
+    Entry raw supplemental data from csv files to airports, carriers and plane_data tables
+
+    Parameters
+    ----------
+    conn : str
+        Connection object that represents the database
+
+    Returns
+    ----------
+
+    """
+
+    c = conn.cursor()
+
+    # airports table
+    df = pd.read_csv('source/airports.csv',encoding=encoding)
+    df.to_sql(name="airports", con=conn, if_exists="append", index=False)
+    print('airports values inserted successfully')
+
+    # carriers table
+    df = pd.read_csv('source/carriers.csv',encoding=encoding)
+    df.to_sql(name="carriers", con=conn, if_exists="append", index=False)
+    print('carriers values inserted successfully')
+
+    # plane_data table
+    df = pd.read_csv('source/plane-data.csv',encoding=encoding)
+
+    df.year = df.year.fillna(1900)
+    df.year = df.year.replace(to_replace='None', value=1900)
+    df.year = df.year.replace(to_replace=np.nan, value=1900)
+
+    # float_columns = (df.select_dtypes(['float'])).columns
+    # int_columns = (df.select_dtypes(['int'])).columns
+    # obj_columns = (df.select_dtypes(['object'])).columns
+
+    # df.loc[:,float_columns] = df.loc[:,float_columns].fillna(0)
+    # df.loc[:,int_columns] = df.loc[:,int_columns].fillna(0)
+    # df.loc[:,obj_columns] = df.loc[:,obj_columns].fillna(0)
+
+    df.to_sql(name="plane_data", con=conn, if_exists="append", index=False)
+    print('plane_data values inserted successfully')
+
+    c.close()
+    conn.close()
+
+# Aggregates of data table kept up to date with it: name -> grouping columns.
+# Each table has the grouping columns and a flights count
+DATA_AGGREGATES = {
+    'agg_flights_origin_date': ['Origin', 'Date'],
+    'agg_flights_carrier_date': ['UniqueCarrier', 'Date'],
+    'agg_flights_route': ['Origin', 'Dest'],
+}
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def _high_water(conn, name):
+
+    """
+    Get the last raw_data Id included in a derived table, None if unknown
+    """
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS derived_state (name TEXT PRIMARY KEY,
+                                                              high_water INTEGER,
+                                                              updated REAL)""")
+    row = conn.execute('SELECT high_water FROM derived_state WHERE name = ?', (name,)).fetchone()
+    return None if row is None else row[0]
+
+
+def _set_high_water(conn, name, high_water):
+    conn.execute('INSERT OR REPLACE INTO derived_state VALUES (?, ?, ?)', (name, high_water, time.time()))
+
+
+def reset_derived_tables(conn):
+
+    """
+    Drop data table, its aggregates and their high-water marks, for example
+    when raw_data table is created again and its Ids start over
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+
+    Returns
+    ----------
+
+    """
+
+    for table in ['data'] + list(DATA_AGGREGATES):
+        conn.execute('DROP TABLE IF EXISTS {}'.format(table))
+    conn.execute('DROP TABLE IF EXISTS derived_state')
+    conn.commit()
+
+
+def create_data_table(conn, aggregates=None):
+
+    """
+    Create data table from raw_data table and create Date column from Year, Month and DayofMonth atributes.
+
+    The table is maintained incrementally: only the raw_data rows above the
+    high-water mark of the last run (the largest Id already copied) are
+    added, so loading one new year costs time proportional to that year.
+    The Date index and the indexes of create_indexes are updated by SQLite
+    with the inserted rows, and the DATA_AGGREGATES tables are updated
+    with update_aggregates. raw_data rows are only appended, never changed.
+
+    Parameters
+    ----------
+    conn : str
+        Connection object that represents the database
+    aggregates : list of str (optional)
+        Names of DATA_AGGREGATES to maintain, all of them if None
+
+    Returns
+    ----------
+    rows : int
+        Number of rows added to data table
+
+    """
+
+    c = conn.cursor()
+
+    with instrument.span('create_data_table') as stage:
+
+        high_water = _high_water(conn, 'data')
+        new_table = not _table_exists(conn, 'data')
+
+        if new_table:
+            code_type = 'INTEGER' if dictionary.is_encoded(conn) else 'TEXT'
+
+            sql_query = """CREATE TABLE data (Id INTEGER PRIMARY KEY,
+                                              Year INTEGER, 
+                                              Month INTEGER, 
+                                              DayofMonth INTEGER, 
+                                              FlightNum INTEGER, 
+                                              Distance INTEGER, 
+                                              UniqueCarrier {0}, 
+                                              TailNum {0}, 
+                                              Origin {0}, 
+                                              Dest {0},
+                                              Date datetime)""".format(code_type)
+            c.execute(sql_query)
+            high_water = 0
+
+        elif high_water is None:
+            # data table built before the high-water mark existed, the Id index
+            # lets the aggregates read the new rows only
+            c.execute('CREATE INDEX IF NOT EXISTS data_id ON data(Id)')
+            high_water = c.execute('SELECT COALESCE(MAX(Id), 0) FROM data').fetchone()[0]
+
+        # Add the new rows, with the Date column built from Year, Month and DayofMonth atributes
+        sql_query = """INSERT INTO data (Id, Year, Month, DayofMonth, FlightNum, Distance,
+                                         UniqueCarrier, TailNum, Origin, Dest, Date)
+                            SELECT Id,
+                                   Year, 
+                                   Month, 
+                                   DayofMonth, 
+                                   FlightNum, 
+                                   Distance, 
+                                   UniqueCarrier, 
+                                   TailNum, 
+                                   Origin, 
+                                   Dest,
+                                   Year || '-' || Month || '-' || DayofMonth
+                              FROM raw_data
+                             WHERE Id > ?"""
+
+        with instrument.span('insert', high_water=high_water) as span:
+            rows = c.execute(sql_query, (high_water,)).rowcount
+            span.add(rows=rows)
+
+        new_high_water = c.execute('SELECT COALESCE(MAX(Id), ?) FROM raw_data', (high_water,)).fetchone()[0]
+        _set_high_water(conn, 'data', new_high_water)
+
+        # Create Index, after the first load so it is built once instead of row by row
+        sql_query = """CREATE INDEX IF NOT EXISTS Date
+                                 ON data(Date);"""
+
+        with instrument.span('date_index'):
+            c.execute(sql_query)
+
+        conn.commit()
+
+        update_aggregates(conn, aggregates)
+        stage.fields['new_table'] = new_table
+
+    c.close()
+    conn.close()
+
+    return rows
+
+
+def update_aggregates(conn, aggregates=None):
+
+    """
+    Create or update the flight counts of DATA_AGGREGATES with the data rows
+    added since their own high-water mark
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    aggregates : list of str (optional)
+        Names of DATA_AGGREGATES to update, all of them if None
+
+    Returns
+    ----------
+    groups : dict
+        Number of groups inserted or updated in each aggregate
+
+    """
+
+    if aggregates is None:
+        aggregates = list(DATA_AGGREGATES)
+
+    c = conn.cursor()
+    groups = {}
+
+    for name in aggregates:
+        columns = ', '.join(DATA_AGGREGATES[name])
+
+        with instrument.span('aggregate', table=name):
+            c.execute("""CREATE TABLE IF NOT EXISTS {0} ({1}, flights INTEGER,
+                                                         PRIMARY KEY ({1})) WITHOUT ROWID""".format(name, columns))
+
+            high_water = _high_water(conn, name) or 0
+            new_high_water = c.execute('SELECT COALESCE(MAX(Id), ?) FROM data', (high_water,)).fetchone()[0]
+
+            c.execute("""INSERT INTO {0} ({1}, flights)
+                              SELECT {1}, COUNT(*)
+                                FROM data
+                               WHERE Id > ? AND Id <= ?
+                            GROUP BY {1}
+                         ON CONFLICT ({1}) DO UPDATE SET flights = flights + excluded.flights""".format(name, columns),
+                      (high_water, new_high_water))
+
+            groups[name] = c.rowcount
+            _set_high_water(conn, name, new_high_water)
+            conn.commit()
+
+    c.close()
+
+    return groups
+
+
+# Composite and covering indexes matched to the access paths of the report.
+# Each entry: index name -> (table, columns, query that uses the index)
+ANALYTIC_INDEXES = {
+    'idx_data_origin_date': ('data', ['Origin', 'Date'],
+                             """SELECT Date, Origin
+                                  FROM data
+                                 WHERE Origin IN ('ORD','ATL','DFW','LAX','PHX')"""),
+    'idx_data_dest_date': ('data', ['Dest', 'Date'],
+                           """SELECT Date, Dest
+                                FROM data
+                               WHERE Dest IN ('ORD','ATL','DFW','LAX','PHX')"""),
+    'idx_data_carrier_date': ('data', ['UniqueCarrier', 'Date'],
+                              """SELECT Date, UniqueCarrier
+                                   FROM data
+                                  WHERE UniqueCarrier IN ('AA','DL','UA')"""),
+    'idx_data_date_route': ('data', ['Date', 'Origin', 'Dest', 'Distance'],
+                            """SELECT Date, Origin, Dest, Distance
+                                 FROM data
+                                WHERE Date >= date('2008-01-01')"""),
+}
+
+
+def _index_size(conn, name):
+
+    """
+    Get the size in bytes of an index, using the dbstat virtual table when available
+    """
+
+    try:
+        return conn.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ?', (name,)).fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return None
+
+
+def _database_size(conn):
+
+    """
+    Get the size in bytes of the database from its page count
+    """
+
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return page_count*page_size
+
+
+def create_indexes(conn, indexes=None, analyze=True):
+
+    """
+    Create composite and covering indexes of the analytic access paths and
+    update the query planner statistics with ANALYZE
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    indexes : list of str (optional)
+        Names of ANALYTIC_INDEXES to create, all of them if None
+    analyze : bool (optional)
+        if True, run ANALYZE after the indexes are created
+
+    Returns
+    ----------
+    sizes : dict
+        Size in bytes of each created index
+
+    """
+
+    if indexes is None:
+        indexes = list(ANALYTIC_INDEXES)
+
+    c = conn.cursor()
+    sizes = {}
+
+    with instrument.span('create_indexes'):
+
+        for name in indexes:
+            table, columns, _ = ANALYTIC_INDEXES[name]
+
+            with instrument.span('index', index=name) as span:
+                size_before = _database_size(conn)
+                c.execute('CREATE INDEX IF NOT EXISTS {} ON {}({})'.format(name, table, ', '.join(columns)))
+                conn.commit()
+
+                size = _index_size(conn, name)
+                sizes[name] = size if size is not None else _database_size(conn) - size_before
+                span.add(bytes=sizes[name])
+
+        if analyze:
+            with instrument.span('analyze'):
+                c.execute('ANALYZE')
+                conn.commit()
+
+    c.close()
+
+    return sizes
+
+
+def drop_indexes(conn, indexes=None):
+
+    """
+    Drop indexes created by create_indexes
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    indexes : list of str (optional)
+        Names of ANALYTIC_INDEXES to drop, all of them if None
+
+    Returns
+    ----------
+
+    """
+
+    if indexes is None:
+        indexes = list(ANALYTIC_INDEXES)
+
+    for name in indexes:
+        conn.execute('DROP INDEX IF EXISTS {}'.format(name))
+    conn.commit()
+
+
+def benchmark_indexes(conn, indexes=None, repeat=3):
+
+    """
+    Measure, for each analytic index, its size on disk against the speedup of
+    the query that uses it. Every index is created, measured and dropped
+    again, and the planner statistics written by ANALYZE (sqlite_stat1)
+    are restored, so the database is left as it was found.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    indexes : list of str (optional)
+        Names of ANALYTIC_INDEXES to measure, all of them if None
+    repeat : int (optional)
+        Number of runs of each query, the best time is kept
+
+    Returns
+    ----------
+    report : pandas.DataFrame
+        Index size, query time without and with the index, speedup and
+        query plan of each index
+
+    """
+
+    if indexes is None:
+        indexes = list(ANALYTIC_INDEXES)
+
+    def best_time(query):
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            rows = sum(1 for _ in conn.execute(query))
+            times.append(time.time() - start)
+        return min(times), rows
+
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    codes = dictionary.load_codes(conn) if dictionary.is_encoded(conn) else None
+    report = []
+
+    # ANALYZE of create_indexes changes the plans of later queries
+    has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+    stats = conn.execute('SELECT tbl, idx, stat FROM sqlite_stat1').fetchall() if has_stats else None
+
+    try:
+        for name in indexes:
+            table, columns, query = ANALYTIC_INDEXES[name]
+            if codes is not None:
+                query = dictionary.translate_query(query, codes)
+
+            if name in existing:
+                print(name,'already exists and was skipped')
+                continue
+
+            seconds_without, rows = best_time(query)
+            size = create_indexes(conn, [name], analyze=True)[name]
+            seconds_with, _ = best_time(query)
+            plan = ' | '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query))
+            drop_indexes(conn, [name])
+
+            report.append({'index': name,
+                           'columns': ', '.join(columns),
+                           'size_mb': size/1024**2,
+                           'rows': rows,
+                           'seconds_without': seconds_without,
+                           'seconds_with': seconds_with,
+                           'speedup': seconds_without/seconds_with if seconds_with else np.nan,
+                           'plan': plan})
+    finally:
+        if stats is None:
+            conn.execute('DROP TABLE IF EXISTS sqlite_stat1')
+            conn.commit()
+        else:
+            conn.execute('DELETE FROM sqlite_stat1')
+            conn.executemany('INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)', stats)
+            conn.commit()
+            # Reload the statistics into the query planner
+            conn.execute('ANALYZE sqlite_master')
+
+    return pd.DataFrame(report)
@@ -0,0 +1,363 @@
+# Import packages
+import os
+import sys
+import json
+import time
+import uuid
+import resource
+import threading
+from contextlib import contextmanager
+
+####################################################################################
+####################################################################################
+###################### Packages to instrument the workflow stages ##################
+####################################################################################
+####################################################################################
+
+# Seconds between two samples of the resident set size
+RSS_SAMPLE_INTERVAL = 0.1
+
+
+def current_rss_mb():
+
+    """
+    Get the resident set size of the process in MB, from /proc on Linux
+    and from the peak RSS elsewhere
+    """
+
+    try:
+        with open('/proc/self/statm') as file:
+            pages = int(file.read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/1024**2
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+
+    """
+    Get the peak resident set size of the process in MB
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024
+
+
+####################################################################################
+###################################### Sinks #######################################
+####################################################################################
+
+class QuietSink:
+
+    """
+    Sink that discards every event
+    """
+
+    def emit(self, event):
+        pass
+
+
+class LogSink:
+
+    """
+    Sink that prints one human readable line per finished span
+
+    Parameters
+    ----------
+    max_depth : int (optional)
+        Deepest span level printed, all levels if None. Use 1 to hide per chunk spans
+    file : file object (optional)
+        Where lines are written, sys.stdout if None
+
+    """
+
+    def __init__(self, max_depth=None, file=None):
+        self.max_depth = max_depth
+        self.file = file
+
+    def emit(self, event):
+
+        if self.max_depth is not None and event['depth'] >= self.max_depth:
+            return
+
+        fields = ', '.join('{}={}'.format(key, value) for key, value in event['fields'].items())
+        line = '  '*event['depth'] + event['name']
+        if fields:
+            line += ' [' + fields + ']'
+        line += ': {:0.2f} seconds'.format(event['seconds'])
+
+        counters = event['counters']
+        if 'rows' in counters:
+            line += ', {:,.0f} rows'.format(counters['rows'])
+            if event.get('rows_per_sec'):
+                line += ' ({:,.0f} rows/sec)'.format(event['rows_per_sec'])
+        if 'bytes' in counters:
+            line += ', {:0.1f} MB'.format(counters['bytes']/1024**2)
+        line += ', peak RSS {:0.0f} MB'.format(event['peak_rss_mb'])
+
+        print(line, file=self.file or sys.stdout)
+
+
+class JsonLinesSink:
+
+    """
+    Sink that appends every event as one JSON line to a trace file
+
+    Parameters
+    ----------
+    filepath : str
+        Complete filepath of the trace file
+
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock, open(self.filepath, 'a') as file:
+            file.write(line + '\n')
+
+
+class MultiSink:
+
+    """
+    Sink that forwards every event to several sinks
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink.emit(event)
+
+
+# Sink of the process, the notebook output is kept by default
+_SINK = LogSink()
+_RUN_ID = uuid.uuid4().hex[:12]
+
+
+def set_sink(sink):
+
+    """
+    Set the sink of the process and return the previous one
+
+    Parameters
+    ----------
+    sink : QuietSink, LogSink, JsonLinesSink or MultiSink
+        Object with an emit(event) method
+
+    Returns
+    ----------
+    previous : object
+        Sink replaced by sink
+
+    """
+
+    global _SINK
+    previous, _SINK = _SINK, sink
+    return previous
+
+
+def get_sink():
+    return _SINK
+
+
+def get_run_id():
+    return _RUN_ID
+
+
+@contextmanager
+def use_sink(sink):
+
+    """
+    Use a sink inside a with block, for example to trace one ingest run:
+
+        with use_sink(JsonLinesSink('source/trace.jsonl')):
+            raw_data_entry(conn, 1987, 2008)
+
+    """
+
+    previous = set_sink(sink)
+    try:
+        yield sink
+    finally:
+        set_sink(previous)
+
+
+####################################################################################
+####################################### Spans ######################################
+####################################################################################
+
+class _RssSampler:
+
+    """
+    Background thread that samples the RSS while spans are open and keeps
+    the peak of each open span
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.spans = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.spans:
+                    self.thread = None
+                    return
+                rss = current_rss_mb()
+                for span in self.spans:
+                    span.peak_rss = max(span.peak_rss, rss)
+            time.sleep(self.interval)
+
+    def add(self, span):
+        with self.lock:
+            self.spans.add(span)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def remove(self, span):
+        with self.lock:
+            self.spans.discard(span)
+
+
+_SAMPLER = _RssSampler()
+_STACK = threading.local()
+
+
+class Span:
+
+    """
+    Timing span of one stage or chunk, created by span()
+
+    Attributes
+    ----------
+    name : str
+        Name of the span
+    fields : dict
+        Labels of the span, for example the year of a file
+    counters : dict
+        Counters added with add, for example rows and bytes
+    seconds : float
+        Duration of the span, set when the span ends
+
+    """
+
+    def __init__(self, name, fields, parent):
+        self.name = name
+        self.fields = fields
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.path = name if parent is None else parent.path + '/' + name
+        self.counters = {}
+        self.seconds = None
+        self.peak_rss = current_rss_mb()
+
+    def add(self, **counters):
+
+        """
+        Add values to the counters of the span, for example span.add(rows=len(chunk))
+        """
+
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def event(self, start):
+
+        event = {'type': 'span',
+                 'run_id': _RUN_ID,
+                 'pid': os.getpid(),
+                 'name': self.name,
+                 'path': self.path,
+                 'depth': self.depth,
+                 'start': start,
+                 'seconds': self.seconds,
+                 'fields': self.fields,
+                 'counters': self.counters,
+                 'peak_rss_mb': self.peak_rss}
+
+        for key in ('rows', 'bytes'):
+            if key in self.counters and self.seconds:
+                event[key + '_per_sec'] = self.counters[key]/self.seconds
+
+        return event
+
+
+@contextmanager
+def span(name, **fields):
+
+    """
+    Time a block of code as a span nested in the open span of the thread.
+    Counters added to the span and the peak RSS sampled while it is open
+    are emitted to the sink when the block ends.
+
+    Parameters
+    ----------
+    name : str
+        Name of the span, for example 'raw_data_entry'
+    fields : dict (optional)
+        Labels of the span, for example year=2008
+
+    Returns
+    ----------
+    span : Span
+        Span object, use span.add(rows=..., bytes=...) to count
+
+    """
+
+    stack = getattr(_STACK, 'spans', None)
+    if stack is None:
+        stack = _STACK.spans = []
+
+    current = Span(name, fields, stack[-1] if stack else None)
+    stack.append(current)
+    _SAMPLER.add(current)
+
+    wall_start = time.time()
+    start = time.perf_counter()
+
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        _SAMPLER.remove(current)
+        current.peak_rss = max(current.peak_rss, current_rss_mb())
+        stack.pop()
+
+        # Parent spans accumulate the counters of their children
+        if current.parent is not None:
+            current.parent.add(**current.counters)
+
+        _SINK.emit(current.event(wall_start))
+
+
+def load_trace(filepath):
+
+    """
+    Read a JsonLinesSink trace file into a DataFrame to compare runs
+
+    Parameters
+    ----------
+    filepath : str
+        Complete filepath of the trace file
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        One row per span, counters and fields as columns
+
+    """
+
+    import pandas as pd
+
+    with open(filepath) as file:
+        events = [json.loads(line) for line in file if line.strip()]
+
+    return pd.json_normalize(events)
@@ -0,0 +1,940 @@
+# Import packages
+import os
+import datetime
+import pandas as pd
+from collections import OrderedDict
+
+from jupyterworkflow import dictionary
+from jupyterworkflow import instrument
+from jupyterworkflow import sampling
+
+####################################################################################
+####################################################################################
+############### Packages to build queries lazily and compile them to SQL ###########
+####################################################################################
+####################################################################################
+
+# Supplemental tables that can be joined: table -> (key column, columns)
+JOINS = {'airports': ('iata', ['airport', 'city', 'state', 'country', 'lat', 'long']),
+         'carriers': ('Code', ['Description'])}
+
+# Fact column -> dimension table of its codes, for the joins of the encoded layout
+_JOIN_DIMENSION = {'airports': 'dim_airport', 'carriers': 'dim_carrier'}
+
+# Results of collect kept per process, keyed by database file, its size and
+# modification time and the SQL query
+RESULT_CACHE_SIZE = 32
+_RESULT_CACHE = OrderedDict()
+
+def _literal(value):
+
+    """
+    Write a Python value as a SQL literal
+    """
+
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if hasattr(value, 'item'):
+        return _literal(value.item())
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+class Context:
+
+    """
+    What an expression needs to compile: the SQL of each column name and the
+    codes of an encoded database, used to compare the fact columns by id
+    """
+
+    def __init__(self, columns, codes=None):
+        self.columns = columns
+        self.codes = codes
+
+    def column(self, name):
+        return self.columns.get(name, 'data.{}'.format(name))
+
+    def is_encoded(self, name):
+        # Joined columns are never encoded
+        return self.codes is not None and name in dictionary.COLUMN_DIMENSION and name not in self.columns
+
+    def ordered(self, name, operator):
+
+        """
+        Refuse an ordered comparison of an encoded column, its ids are not
+        in the order of the codes, as translate_query does
+        """
+
+        if self.is_encoded(name):
+            raise ValueError('{} is stored as integer ids in the encoded layout and cannot be compared '
+                             'with {}, compare codes with ==, != or isin'.format(name, operator))
+
+    def values(self, name, values):
+
+        """
+        Translate the values compared with a column to ids when the column
+        is encoded. Codes that are not in the dimension match no row
+        """
+
+        if not self.is_encoded(name):
+            return list(values)
+        table = dictionary.COLUMN_DIMENSION[name]
+        positions = self.codes[table].get_indexer([str(value) for value in values])
+        return [int(position) for position in positions if position >= 0]
+
+
+class Expr:
+
+    """
+    Expression over the columns of a query. Comparisons build predicates
+    that are combined with &, | and ~
+    """
+
+    def sql(self, context):
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return Boolean('AND', self, other)
+
+    def __or__(self, other):
+        return Boolean('OR', self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Column(Expr):
+
+    def __init__(self, name):
+        self.name = name
+
+    def sql(self, context):
+        return context.column(self.name)
+
+    def _compare(self, operator, value):
+        return Comparison(self.name, operator, value)
+
+    def __eq__(self, value):
+        return self._compare('=', value)
+
+    def __ne__(self, value):
+        return self._compare('<>', value)
+
+    def __lt__(self, value):
+        return self._compare('<', value)
+
+    def __le__(self, value):
+        return self._compare('<=', value)
+
+    def __gt__(self, value):
+        return self._compare('>', value)
+
+    def __ge__(self, value):
+        return self._compare('>=', value)
+
+    __hash__ = object.__hash__
+
+    def isin(self, values):
+        return In(self.name, values)
+
+    def between(self, low, high):
+        return Between(self.name, low, high)
+
+    def isnull(self):
+        return Raw('{} IS NULL', self.name)
+
+    def notnull(self):
+        return Raw('{} IS NOT NULL', self.name)
+
+    def count(self):
+        return Aggregate('COUNT', self.name)
+
+    def sum(self):
+        return Aggregate('SUM', self.name)
+
+    def mean(self):
+        return Aggregate('AVG', self.name)
+
+    def min(self):
+        return Aggregate('MIN', self.name)
+
+    def max(self):
+        return Aggregate('MAX', self.name)
+
+
+class Comparison(Expr):
+
+    def __init__(self, name, operator, value):
+        self.name, self.operator, self.value = name, operator, value
+
+    def sql(self, context):
+        if self.operator in ('=', '<>'):
+            values = context.values(self.name, [self.value])
+            if not values:
+                # A code missing from the dimension: <> keeps the rows with a code, as on text
+                if self.operator == '=':
+                    return '1 = 0'
+                return '{} IS NOT NULL'.format(context.column(self.name))
+            return '{} {} {}'.format(context.column(self.name), self.operator, _literal(values[0]))
+        context.ordered(self.name, self.operator)
+        return '{} {} {}'.format(context.column(self.name), self.operator, _literal(self.value))
+
+
+class In(Expr):
+
+    def __init__(self, name, values):
+        self.name, self.values = name, list(values)
+
+    def sql(self, context):
+        values = context.values(self.name, self.values)
+        if not values:
+            return '1 = 0'
+        return '{} IN ({})'.format(context.column(self.name), ', '.join(_literal(value) for value in values))
+
+
+class Between(Expr):
+
+    def __init__(self, name, low, high):
+        self.name, self.low, self.high = name, low, high
+
+    def sql(self, context):
+        context.ordered(self.name, 'BETWEEN')
+        return '{} BETWEEN {} AND {}'.format(context.column(self.name), _literal(self.low), _literal(self.high))
+
+
+class DateRange(Expr):
+
+    """
+    Flights from start to end, both included. The Date column is not zero
+    padded, so the range is compared on Year, Month and DayofMonth. The
+    bounds on Year let query_partitions prune the years, and the day bounds
+    are only added when the range does not cover whole years
+    """
+
+    def __init__(self, start, end):
+        self.start = _to_date(start)
+        self.end = _to_date(end)
+
+    def sql(self, context):
+        predicates = ['{} BETWEEN {} AND {}'.format(context.column('Year'), self.start.year, self.end.year)]
+
+        if (self.start.month, self.start.day) != (1, 1) or (self.end.month, self.end.day) != (12, 31):
+            day = '({}*10000 + {}*100 + {})'.format(context.column('Year'), context.column('Month'),
+                                                    context.column('DayofMonth'))
+            predicates.append('{} BETWEEN {} AND {}'.format(day, self.start.strftime('%Y%m%d'),
+                                                          self.end.strftime('%Y%m%d')))
+
+        return ' AND '.join(predicates)
+
+
+class Raw(Expr):
+
+    def __init__(self, template, name):
+        self.template, self.name = template, name
+
+    def sql(self, context):
+        return self.template.format(context.column(self.name))
+
+
+class Boolean(Expr):
+
+    def __init__(self, operator, left, right):
+        self.operator, self.left, self.right = operator, left, right
+
+    def sql(self, context):
+        return '({} {} {})'.format(self.left.sql(context), self.operator, self.right.sql(context))
+
+
+class Not(Expr):
+
+    def __init__(self, expr):
+        self.expr = expr
+
+    def sql(self, context):
+        return 'NOT ({})'.format(self.expr.sql(context))
+
+
+class Aggregate(Expr):
+
+    def __init__(self, function, name=None):
+        self.function, self.name = function, name
+
+    def sql(self, context, weighted=False):
+        column = '*' if self.name is None else context.column(self.name)
+
+        if not weighted or self.function in ('MIN', 'MAX'):
+            return '{}({})'.format(self.function, column)
+
+        # Sample rows stand for weight flights of the full table
+        if self.function == 'COUNT':
+            if self.name is None:
+                return 'SUM(data.weight)'
+            return 'SUM(CASE WHEN {} IS NOT NULL THEN data.weight END)'.format(column)
+        if self.function == 'SUM':
+            return 'SUM({}*data.weight)'.format(column)
+        return 'SUM({0}*data.weight)/SUM(CASE WHEN {0} IS NOT NULL THEN data.weight END)'.format(column)
+
+
+def col(name):
+
+    """
+    Get a column of the query, for example col('Origin').isin(['ORD', 'ATL'])
+    """
+
+    return Column(name)
+
+
+def count():
+
+    """
+    Count the flights of each group
+    """
+
+    return Aggregate('COUNT')
+
+
+def _to_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date(*(int(part) for part in str(value)[:10].split('-')))
+
+
+def date_range(start, end):
+
+    """
+    Keep the flights from start to end, both included, for example
+    date_range('2008-01-01', '2008-06-30')
+    """
+
+    return DateRange(start, end)
+
+
+class LazyFrame:
+
+    """
+    Query over data table built step by step and compiled to one SQL query.
+
+    Every method returns a new LazyFrame and nothing runs until collect.
+    Only the selected, grouped, aggregated and filtered columns are read,
+    the joined tables only bring the columns asked for, and the filters are
+    in the WHERE clause, so SQLite can use the indexes and query_partitions
+    can prune the years.
+
+    Parameters
+    ----------
+    table : str (optional)
+        Fact table of the query
+
+    """
+
+    def __init__(self, table='data'):
+        self.table = table
+        self._columns = None
+        self._joins = []
+        self._filters = []
+        self._group = []
+        self._aggregates = OrderedDict()
+        self._order = []
+        self._limit = None
+
+    def _copy(self):
+        other = LazyFrame(self.table)
+        other._columns = None if self._columns is None else list(self._columns)
+        other._joins = list(self._joins)
+        other._filters = list(self._filters)
+        other._group = list(self._group)
+        other._aggregates = OrderedDict(self._aggregates)
+        other._order = list(self._order)
+        other._limit = self._limit
+        return other
+
+    def select(self, *columns):
+
+        """
+        Keep only these columns of the fact table and of the joins
+        """
+
+        other = self._copy()
+        other._columns = list(columns)
+        return other
+
+    def filter(self, *predicates):
+
+        """
+        Keep the rows matching every predicate, for example
+        filter(col('Origin').isin(hubs), date_range('2008-01-01', '2008-12-31'))
+        """
+
+        other = self._copy()
+        other._filters += list(predicates)
+        return other
+
+    def join(self, table, on, columns=None, prefix=None):
+
+        """
+        Join airports on a fact column (Origin or Dest) or carriers on
+        UniqueCarrier
+
+        Parameters
+        ----------
+        table : str
+            'airports' or 'carriers'
+        on : str
+            Fact column matching the key of the table
+        columns : list of str (optional)
+            Columns of the table to add, all of them if None
+        prefix : str (optional)
+            Prefix of the added columns, the lower case on column and an
+            underscore if None, for example origin_lat
+
+        """
+
+        if table not in JOINS:
+            raise ValueError('unknown table {}, expected one of {}'.format(table, sorted(JOINS)))
+
+        other = self._copy()
+        other._joins.append((table, on, list(columns or JOINS[table][1]),
+                             '{}_'.format(on.lower()) if prefix is None else prefix))
+        return other
+
+    def group_by(self, *columns):
+
+        """
+        Group the rows by these columns, see agg
+        """
+
+        other = self._copy()
+        other._group = list(columns)
+        return other
+
+    def agg(self, **aggregates):
+
+        """
+        Aggregate each group, for example agg(flights=count(),
+        distance=col('Distance').mean())
+        """
+
+        other = self._copy()
+        other._aggregates.update(aggregates)
+        return other
+
+    def sort(self, *columns, ascending=True):
+
+        """
+        Order the result by these columns
+        """
+
+        other = self._copy()
+        other._order = [(column, ascending) for column in columns]
+        return other
+
+    def limit(self, rows):
+
+        """
+        Keep the first rows of the result
+        """
+
+        other = self._copy()
+        other._limit = int(rows)
+        return other
+
+    def _context(self, codes=None):
+
+        """
+        Map each output name to its SQL: fact columns to data.column and the
+        joined columns to their table alias
+        """
+
+        columns = {}
+        for number, (table, on, names, prefix) in enumerate(self._joins):
+            for name in names:
+                columns[prefix + name] = 'j{}.{}'.format(number, name)
+        return Context(columns, codes)
+
+    def to_sql(self, codes=None, sample=None):
+
+        """
+        Compile the query to SQL
+
+        Parameters
+        ----------
+        codes : dict of pandas.Index (optional)
+            Codes of an encoded database, see dictionary.load_codes. The
+            filters on encoded columns compare ids and the joins go through
+            the dimension tables
+        sample : float or str (optional)
+            Sampling rate or name of a sample table of sampling module. The
+            counts and sums of agg are weighted, and the weight column is
+            selected when there is no group
+
+        Returns
+        ----------
+        query : str
+
+        """
+
+        context = self._context(codes)
+        table = self.table if sample is None else '{} AS data'.format(
+            sample if isinstance(sample, str) else sampling.sample_table(sample))
+        if sample is None and self.table != 'data':
+            table = '{} AS data'.format(self.table)
+
+        # Projection: only the columns of the result are read
+        if self._group or self._aggregates:
+            select = ['{} AS {}'.format(context.column(name), name) for name in self._group]
+            select += ['{} AS {}'.format(aggregate.sql(context, weighted=sample is not None), name)
+                       for name, aggregate in self._aggregates.items()]
+        elif self._columns is not None:
+            select = ['{} AS {}'.format(context.column(name), name) for name in self._columns]
+        else:
+            select = ['data.*'] + ['{} AS {}'.format(sql, name) for name, sql in context.columns.items()]
+
+        if sample is not None and not (self._group or self._aggregates):
+            select.append('data.weight AS weight')
+
+        # Joins bring only the columns used by the query
+        used = ' '.join(select + [predicate.sql(context) for predicate in self._filters] +
+                        [context.column(name) for name, _ in self._order])
+        joins = []
+        for number, (join_table, on, names, prefix) in enumerate(self._joins):
+            alias = 'j{}'.format(number)
+            if alias + '.' not in used:
+                continue
+            key = JOINS[join_table][0]
+            if codes is not None:
+                dimension = _JOIN_DIMENSION[join_table]
+                joins.append('LEFT JOIN {0} AS {1}_dim ON {1}_dim.id = data.{2}'.format(dimension, alias, on))
+                joins.append('LEFT JOIN {0} AS {1} ON {1}.{2} = {1}_dim.code'.format(join_table, alias, key))
+            else:
+                joins.append('LEFT JOIN {0} AS {1} ON {1}.{2} = data.{3}'.format(join_table, alias, key, on))
+
+        lines = ['SELECT ' + ',\n       '.join(select), '  FROM ' + table]
+        lines += ['  ' + join for join in joins]
+        if self._filters:
+            lines.append(' WHERE ' + '\n   AND '.join(predicate.sql(context) for predicate in self._filters))
+        if self._group:
+            lines.append(' GROUP BY ' + ', '.join(context.column(name) for name in self._group))
+        if self._order:
+            lines.append(' ORDER BY ' + ', '.join('{} {}'.format(name, 'ASC' if ascending else 'DESC')
+                                                  for name, ascending in self._order))
+        if self._limit is not None:
+            lines.append(' LIMIT {}'.format(self._limit))
+
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'LazyFrame(\n{}\n)'.format(self.to_sql())
+
+    def collect(self, conn=None, cache=True, sample=None, **kwargs):
+
+        """
+        Run the query with query_to_df, with its typed decoding of encoded
+        ids and optimized column types
+
+        Parameters
+        ----------
+        conn : sqlite3.Connection (optional)
+            Connection object that represents the database, DATABASE is
+            opened and closed again if None
+        cache : bool (optional)
+            if True, reuse the result of the same query on the same,
+            unchanged database file
+        sample : float or str (optional)
+            Sampling rate or name of a sample table, see to_sql
+        kwargs : dict (optional)
+            Arguments of query_to_df, for example chunksize or memory_budget
+
+        Returns
+        ----------
+        df : pandas.DataFrame
+
+        """
+
+        from jupyterworkflow.query import connect_database, query_to_df
+
+        opened = conn is None
+        if opened:
+            conn = connect_database()
+
+        try:
+            encoded = dictionary.is_encoded(conn)
+            query = self.to_sql(dictionary.load_codes(conn) if encoded else None, sample)
+            key = _cache_key(conn, query) if cache else None
+
+            if key is not None and key in _RESULT_CACHE:
+                _RESULT_CACHE.move_to_end(key)
+                with instrument.span('collect', cached=True):
+                    return _RESULT_CACHE[key].copy()
+
+            # The rows of the chunks of query_to_df roll up into the span
+            with instrument.span('collect', cached=False):
+                df = query_to_df(query, conn, decode=encoded, **kwargs)
+
+            if key is not None:
+                _RESULT_CACHE[key] = df.copy()
+                while len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+                    _RESULT_CACHE.popitem(last=False)
+
+            return df
+        finally:
+            if opened:
+                conn.close()
+
+
+def _cache_key(conn, query):
+
+    """
+    Get the key of a query on the database file of conn, None for a database
+    in memory. The size and modification time of the file and of its WAL
+    file change with every write
+    """
+
+    filename = None
+    for _, name, path in conn.execute('PRAGMA database_list').fetchall():
+        if name == 'main':
+            filename = path
+    if not filename:
+        return None
+
+    state = []
+    for path in [filename, filename + '-wal']:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            state.append((stat.st_size, stat.st_mtime_ns))
+
+    return (filename, tuple(state), query)
+
+
+def clear_cache():
+
+    """
+    Drop the results kept by collect
+    """
+
+    _RESULT_CACHE.clear()
+
+
+def scan(table='data'):
+
+    """
+    Start a lazy query over a fact table, for example
+    scan().filter(col('Origin').isin(hubs)).group_by('Origin').agg(flights=count()).collect(conn)
+    """
+
+    return LazyFrame(table)
+
+
+def _check_shared(frames):
+    for frame in frames:
+        if frame.table != 'data' or frame._joins or not frame._aggregates:
+            raise ValueError('collect_all only runs aggregations of data table without joins, '
+                             'group the join keys and join the results instead')
+
+
+def _where(frame, context):
+    return ' AND '.join(predicate.sql(context) for predicate in frame._filters)
+
+
+def _sets(frames):
+
+    """
+    Get the key columns of the frames and their distinct groups, in order
+    """
+
+    keys = sorted({name for frame in frames for name in frame._group})
+    sets = []
+    for frame in frames:
+        columns = tuple(name for name in keys if name in frame._group)
+        if columns not in sets:
+            sets.append(columns)
+
+    return keys, sets
+
+
+def _set_mask(keys, columns):
+
+    """
+    Number of a grouping set as GROUPING() gives it: the bits of the key
+    columns it does not group
+    """
+
+    return sum(1 << (len(keys) - 1 - position) for position, name in enumerate(keys) if name not in columns)
+
+
+def _union_sets(frames, codes):
+
+    """
+    Compile the one query of collect_all for SQLite, which has no GROUPING
+    SETS: the columns and the filters of every frame are read once from
+    data into a materialized CTE, and each distinct group of the frames is
+    a GROUP BY over it, joined with UNION ALL. The aggregates of each frame
+    keep the rows of its filters with FILTER, and the rows have the columns
+    of _grouping_sets
+    """
+
+    _check_shared(frames)
+    context = Context({}, codes)
+    keys, sets = _sets(frames)
+
+    columns = set(keys)
+    for frame in frames:
+        columns.update(aggregate.name for aggregate in frame._aggregates.values() if aggregate.name)
+    where = {number: _where(frame, context) for number, frame in enumerate(frames) if frame._filters}
+
+    scan = ['{} AS {}'.format(context.column(name), name) for name in sorted(columns)]
+    scan += ['CASE WHEN {} THEN 1 ELSE 0 END AS _where{}'.format(sql, number) for number, sql in where.items()]
+    scan = 'SELECT ' + ',\n       '.join(scan or ['1 AS _row']) + '\n  FROM data'
+    if len(where) == len(frames):
+        scan += '\n WHERE ' + '\n    OR '.join('({})'.format(sql) for sql in where.values())
+
+    # Each GROUP BY reads the CTE under the name data, so the aggregates
+    # compile as in to_sql. The frames of the other groups are NULL
+    branches = []
+    for grouped in sets:
+        select = ['{} AS {}'.format(context.column(name) if name in grouped else 'NULL', name) for name in keys]
+        select.append('{} AS _set'.format(_set_mask(keys, grouped)))
+        members = [number for number, frame in enumerate(frames)
+                   if tuple(name for name in keys if name in frame._group) == grouped]
+
+        for number, frame in enumerate(frames):
+            names = ['_rows{}'.format(number)] + ['_{}_{}'.format(number, name) for name in frame._aggregates]
+            if number not in members:
+                select += ['NULL AS ' + name for name in names]
+                continue
+            restrict = ' FILTER (WHERE data._where{} = 1)'.format(number) if frame._filters else ''
+            sql = ['COUNT(*)'] + [aggregate.sql(context) for aggregate in frame._aggregates.values()]
+            select += ['{}{} AS {}'.format(aggregate, restrict, name) for aggregate, name in zip(sql, names)]
+
+        branch = 'SELECT ' + ',\n       '.join(select) + '\n  FROM scan AS data'
+        # Only the rows of the frames of the group are grouped
+        if grouped and all(number in where for number in members):
+            branch += '\n WHERE ' + ' OR '.join('data._where{} = 1'.format(number) for number in members)
+        if grouped:
+            branch += '\n GROUP BY ' + ', '.join(context.column(name) for name in grouped)
+        branches.append(branch)
+
+    query = 'WITH scan AS MATERIALIZED (\n' + scan + '\n)\n' + '\nUNION ALL\n'.join(branches)
+
+    return query, keys
+
+
+def _grouping_sets(frames):
+
+    """
+    Compile the one query of collect_all for engines with GROUPING SETS
+    such as DuckDB: one grouping set per distinct group of the frames, and
+    the aggregates of each frame restricted to its rows with FILTER. _set
+    tells the grouping set of each row, as the bits of the key columns it
+    does not group, and _rows<number> the rows of the frame in each group
+    """
+
+    _check_shared(frames)
+    context = Context({})
+
+    keys, sets = _sets(frames)
+
+    select = ['{} AS {}'.format(context.column(name), name) for name in keys]
+    if keys:
+        select.append('GROUPING({}) AS _set'.format(', '.join(context.column(name) for name in keys)))
+    else:
+        select.append('0 AS _set')
+
+    for number, frame in enumerate(frames):
+        restrict = ' FILTER (WHERE {})'.format(_where(frame, context)) if frame._filters else ''
+        select.append('COUNT(*){} AS _rows{}'.format(restrict, number))
+        select += ['{}{} AS _{}_{}'.format(aggregate.sql(context), restrict, number, name)
+                   for name, aggregate in frame._aggregates.items()]
+
+    query = 'SELECT ' + ',\n       '.join(select) + '\n  FROM data'
+    if all(frame._filters for frame in frames):
+        query += '\n WHERE ' + '\n    OR '.join('({})'.format(_where(frame, context)) for frame in frames)
+    if keys:
+        query += '\n GROUP BY GROUPING SETS ({})'.format(', '.join(
+            '({})'.format(', '.join(context.column(name) for name in columns)) for columns in sets))
+
+    return query, keys
+
+
+def _finish(df, frame):
+
+    """
+    Order and limit the result of a frame as its SQL would
+    """
+
+    if frame._order:
+        df = df.sort_values([name for name, _ in frame._order],
+                            ascending=[ascending for _, ascending in frame._order])
+    if frame._limit is not None:
+        df = df.head(frame._limit)
+
+    return df.reset_index(drop=True)
+
+
+def _empty_result(frame):
+
+    """
+    Get the one row SQL returns for a frame without group_by whose filters
+    keep no row: counts are 0 and the other aggregates NULL
+    """
+
+    return pd.DataFrame({name: [0 if aggregate.function == 'COUNT' else None]
+                         for name, aggregate in frame._aggregates.items()})
+
+
+def _split_sets(parts, frames, keys):
+
+    """
+    Get the result of each frame from the rows of its grouping set, parts
+    maps the number of each grouping set to its rows
+    """
+
+    results = []
+    for number, frame in enumerate(frames):
+        rows = parts.get(_set_mask(keys, frame._group))
+        if rows is not None and frame._group:
+            rows = rows[rows['_rows{}'.format(number)] > 0]
+
+        if rows is None or not len(rows):
+            if frame._group:
+                results.append(pd.DataFrame(columns=list(frame._group) + list(frame._aggregates)))
+            else:
+                results.append(_finish(_empty_result(frame), frame))
+            continue
+
+        result = rows[list(frame._group)].copy()
+        for name in frame._aggregates:
+            result[name] = rows['_{}_{}'.format(number, name)]
+        if frame._group:
+            result = result.sort_values(list(frame._group))
+        results.append(_finish(result, frame))
+
+    return results
+
+
+def _read_sets(query, conn):
+
+    """
+    Run the query of _union_sets on SQLite, the rows of each grouping set
+    in their own DataFrame, so the NULL keys and aggregates of the other
+    sets do not turn their integer columns to float
+    """
+
+    cursor = conn.execute(query)
+    columns = [description[0] for description in cursor.description]
+    position = columns.index('_set')
+
+    records = {}
+    for record in cursor.fetchall():
+        records.setdefault(record[position], []).append(record)
+
+    return {mask: pd.DataFrame.from_records(rows, columns=columns) for mask, rows in records.items()}
+
+
+def collect_all(frames, conn=None, cache=True, chunksize=500000, memory_budget=None, backend=None,
+                shared=True):
+
+    """
+    Run several aggregations of data table in one shared scan, aggregated
+    by the engine.
+
+    On DuckDB the frames are one query with GROUPING SETS. On SQLite the
+    columns and filters of every frame are read from data once, into a
+    materialized CTE, and each distinct group of the frames is one GROUP BY
+    over it, joined with UNION ALL. Only the groups come back to pandas.
+
+    Parameters
+    ----------
+    frames : dict or list of LazyFrame
+        Aggregations of data table, built with filter, group_by, agg, sort
+        and limit, without joins
+    conn : sqlite3.Connection (optional)
+        Connection object that represents the database, DATABASE is opened
+        and closed again if None and no backend is given
+    cache : bool (optional)
+        if True, frames already in the result cache of collect are not
+        scanned again, and the results are added to it. SQLite only
+    chunksize : int (optional)
+        Rows of each chunk of collect, when shared is False
+    memory_budget : int or str (optional)
+        Memory allowed for each chunk of collect, when shared is False,
+        see chunking.ChunkSizer
+    backend : SQLiteBackend or DuckDBBackend (optional)
+        Backend of backends module that runs the scan instead of conn
+    shared : bool (optional)
+        if False, each frame runs its own query instead, with collect on
+        SQLite
+
+    Returns
+    ----------
+    results : dict or list of pandas.DataFrame
+        Result of each frame in the shape of frames, as collect would
+        return it, the groups in the order of their keys unless sorted
+
+    """
+
+    from jupyterworkflow.query import connect_database
+
+    as_list = not isinstance(frames, dict)
+    frames = dict(enumerate(frames)) if as_list else dict(frames)
+    names = list(frames)
+
+    if backend is not None and backend.name != 'sqlite':
+        with instrument.span('collect_all', frames=len(frames), backend=backend.name, shared=shared) as span:
+            if shared:
+                query, keys = _grouping_sets([frames[name] for name in names])
+                df = backend.query(query)
+                span.add(rows=len(df))
+                parts = dict(tuple(df.groupby('_set')))
+                results = dict(zip(names, _split_sets(parts, [frames[name] for name in names], keys)))
+            else:
+                results = {name: backend.query(frames[name].to_sql()) for name in names}
+        return [results[name] for name in names] if as_list else results
+
+    if backend is not None:
+        conn = backend.conn
+    opened = conn is None
+    if opened:
+        conn = connect_database()
+
+    try:
+        if not shared:
+            with instrument.span('collect_all', frames=len(frames), shared=False):
+                results = {name: frames[name].collect(conn, cache=cache, chunksize=chunksize,
+                                                      memory_budget=memory_budget) for name in names}
+            return [results[name] for name in names] if as_list else results
+
+        encoded = dictionary.is_encoded(conn)
+        codes = dictionary.load_codes(conn) if encoded else None
+        keys = {name: _cache_key(conn, frame.to_sql(codes)) if cache else None
+                for name, frame in frames.items()}
+
+        results = {}
+        for name, key in keys.items():
+            if key is not None and key in _RESULT_CACHE:
+                _RESULT_CACHE.move_to_end(key)
+                results[name] = _RESULT_CACHE[key].copy()
+
+        pending = [name for name in names if name not in results]
+
+        with instrument.span('collect_all', frames=len(frames), scanned=len(pending)) as span:
+            if pending:
+                query, set_keys = _union_sets([frames[name] for name in pending], codes)
+                parts = _read_sets(query, conn)
+                span.add(rows=sum(len(rows) for rows in parts.values()))
+
+                scanned = _split_sets(parts, [frames[name] for name in pending], set_keys)
+                for name, df in zip(pending, scanned):
+                    results[name] = df if codes is None else dictionary.decode_chunk(df, codes)
+                    if keys[name] is not None:
+                        _RESULT_CACHE[keys[name]] = results[name].copy()
+
+                while len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+                    _RESULT_CACHE.popitem(last=False)
+    finally:
+        if opened:
+            conn.close()
+
+    return [results[name] for name in names] if as_list else results
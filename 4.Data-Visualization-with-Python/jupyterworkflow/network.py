@@ -0,0 +1,329 @@
+# Import packages
+import pandas as pd
+import numpy as np
+
+from jupyterworkflow import instrument
+from jupyterworkflow.query import query_to_df
+
+####################################################################################
+####################################################################################
+################ Packages to analyse the airport network of the routes #############
+####################################################################################
+####################################################################################
+
+# Period of the graphs, built from the Year and Month columns as the Date
+# column is not zero padded
+PERIODS = {'Y': "CAST(Year AS TEXT)",
+           'M': "Year || '-' || substr('0' || Month, -2)"}
+
+ROUTE_QUERY = """SELECT {} AS period, Origin, Dest, COUNT(*) AS flights
+                   FROM data
+               GROUP BY period, Origin, Dest"""
+
+
+def route_counts(conn=None, freq='Y'):
+
+    """
+    Count the flights of every route of each period in SQLite
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection (optional)
+        Connection object that represents the database, see query_to_df
+    freq : str (optional)
+        'Y' for one graph per year, 'M' for one graph per month
+
+    Returns
+    ----------
+    routes : pandas.DataFrame
+        period, Origin, Dest and flights of each route
+
+    """
+
+    routes = query_to_df(ROUTE_QUERY.format(PERIODS[freq]), conn)
+    routes['period'] = routes['period'].astype(str)
+
+    return routes
+
+
+def build_graphs(routes, airports=None):
+
+    """
+    Build one weighted, directed graph per period as a sparse CSR matrix,
+    the flights of the route Origin -> Dest at row Origin and column Dest.
+    All the graphs share the same airport index, so their metrics align
+
+    Parameters
+    ----------
+    routes : pandas.DataFrame
+        period, Origin, Dest and flights of each route, see route_counts
+    airports : array-like of str (optional)
+        Airport codes of the index, the airports of routes if None
+
+    Returns
+    ----------
+    graphs : dict of scipy.sparse.csr_matrix
+        Graph of each period
+    index : pandas.Index
+        Airport code of each row and column
+
+    """
+
+    # Imported here, only the network analysis needs scipy
+    from scipy import sparse
+
+    routes = routes.dropna(subset=['Origin', 'Dest'])
+    origin = np.asarray(routes['Origin'], dtype=object)
+    dest = np.asarray(routes['Dest'], dtype=object)
+
+    if airports is None:
+        index = pd.Index(np.unique(np.concatenate([origin, dest]).astype(str)))
+    else:
+        index = pd.Index(airports)
+
+    rows = index.get_indexer(origin.astype(str))
+    columns = index.get_indexer(dest.astype(str))
+    known = (rows >= 0) & (columns >= 0)
+
+    period_codes, periods = pd.factorize(np.asarray(routes['period']), sort=True)
+    weights = np.asarray(routes['flights'], dtype=np.float64)
+
+    graphs = {}
+    with instrument.span('build_graphs', periods=len(periods)):
+        # One sort by period, then every graph is a contiguous slice
+        order = np.argsort(period_codes[known], kind='stable')
+        codes = period_codes[known][order]
+        bounds = np.searchsorted(codes, np.arange(len(periods) + 1))
+        rows, columns, weights = rows[known][order], columns[known][order], weights[known][order]
+
+        for number, period in enumerate(periods):
+            part = slice(bounds[number], bounds[number+1])
+            graphs[period] = sparse.csr_matrix((weights[part], (rows[part], columns[part])),
+                                               shape=(len(index), len(index)))
+
+    return graphs, index
+
+
+def pagerank(graph, damping=0.85, tol=1e-10, max_iter=100):
+
+    """
+    PageRank of the airports by power iteration on the sparse graph, a
+    passenger following the flights, weighted by their number
+
+    Parameters
+    ----------
+    graph : scipy.sparse.csr_matrix
+        Weighted graph of one period
+    damping : float (optional)
+        Probability of following a flight instead of jumping to any airport
+    tol : float (optional)
+        Sum of the absolute changes that stops the iteration
+    max_iter : int (optional)
+        Maximum number of iterations
+
+    Returns
+    ----------
+    rank : numpy.ndarray
+        PageRank of each airport, summing to 1
+
+    """
+
+    n = graph.shape[0]
+    out_strength = np.asarray(graph.sum(axis=1)).ravel()
+    dangling = out_strength == 0
+
+    # Transition matrix transposed: rank flows along the flights
+    scale = np.divide(1.0, out_strength, out=np.zeros(n), where=~dangling)
+    transition = graph.multiply(scale[:, None]).T.tocsr()
+
+    rank = np.full(n, 1.0/n)
+    for _ in range(max_iter):
+        # Airports without departures spread their rank uniformly
+        new_rank = damping*(transition @ rank + rank[dangling].sum()/n) + (1 - damping)/n
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tol:
+            break
+
+    return rank
+
+
+def hub_metrics(graph, index, damping=0.85):
+
+    """
+    Get the hub metrics of every airport of one graph
+
+    Parameters
+    ----------
+    graph : scipy.sparse.csr_matrix
+        Weighted graph of one period
+    index : pandas.Index
+        Airport code of each row and column
+    damping : float (optional)
+        Damping of the PageRank
+
+    Returns
+    ----------
+    metrics : pandas.DataFrame
+        Per airport: out, in and total degree (routes), out, in and total
+        strength (flights), distinct neighbours and PageRank
+
+    """
+
+    binary = (graph > 0).astype(np.int32)
+    undirected = ((binary + binary.T) > 0).astype(np.int32)
+
+    out_strength = np.asarray(graph.sum(axis=1)).ravel()
+    in_strength = np.asarray(graph.sum(axis=0)).ravel()
+
+    metrics = pd.DataFrame({'out_degree': np.asarray(binary.sum(axis=1)).ravel(),
+                            'in_degree': np.asarray(binary.sum(axis=0)).ravel(),
+                            'neighbours': np.asarray(undirected.sum(axis=1)).ravel(),
+                            'out_strength': out_strength,
+                            'in_strength': in_strength,
+                            'pagerank': pagerank(graph, damping)},
+                           index=pd.Index(index, name='iata'))
+    metrics['degree'] = metrics['out_degree'] + metrics['in_degree']
+    metrics['strength'] = metrics['out_strength'] + metrics['in_strength']
+
+    return metrics
+
+
+def shortest_paths(graph, index, sources=None):
+
+    """
+    Get the fewest flights needed between airports, with breadth-first
+    searches on the sparse graph
+
+    Parameters
+    ----------
+    graph : scipy.sparse.csr_matrix
+        Weighted graph of one period
+    index : pandas.Index
+        Airport code of each row and column
+    sources : list of str (optional)
+        Airports of departure, all the airports if None
+
+    Returns
+    ----------
+    hops : pandas.DataFrame
+        Flights from each source (rows) to each airport (columns), inf when
+        the airport cannot be reached
+
+    """
+
+    from scipy.sparse import csgraph
+
+    positions = None if sources is None else index.get_indexer(sources)
+    hops = csgraph.shortest_path(graph, method='D', directed=True, unweighted=True, indices=positions)
+
+    return pd.DataFrame(np.atleast_2d(hops), index=index if sources is None else pd.Index(sources),
+                        columns=index)
+
+
+def connectivity(graphs, index):
+
+    """
+    Summarize the connectivity of each period and its changes from the
+    previous period
+
+    Parameters
+    ----------
+    graphs : dict of scipy.sparse.csr_matrix
+        Graph of each period, see build_graphs
+    index : pandas.Index
+        Airport code of each row and column
+
+    Returns
+    ----------
+    summary : pandas.DataFrame
+        Per period: active airports, routes, flights, density, weak and
+        strong components, airports of the largest strong component, mean
+        and max flights between the airports it connects, and the routes
+        opened and closed since the previous period
+
+    """
+
+    from scipy.sparse import csgraph
+
+    records = []
+    previous = None
+
+    for period, graph in graphs.items():
+
+        with instrument.span('connectivity', period=period):
+            binary = (graph > 0).astype(np.int8)
+            degree = np.asarray(binary.sum(axis=1)).ravel() + np.asarray(binary.sum(axis=0)).ravel()
+            active = np.flatnonzero(degree)
+            sub = binary[active][:, active]
+
+            weak = csgraph.connected_components(sub, directed=True, connection='weak')[0]
+            strong, labels = csgraph.connected_components(sub, directed=True, connection='strong')
+            largest = np.flatnonzero(labels == np.bincount(labels).argmax()) if len(active) else active
+
+            hops = csgraph.shortest_path(sub[largest][:, largest], method='D', unweighted=True)
+            reachable = hops[np.isfinite(hops) & (hops > 0)]
+
+            n = len(active)
+            record = {'period': period,
+                      'airports': n,
+                      'routes': int(binary.nnz),
+                      'flights': float(graph.sum()),
+                      'density': binary.nnz/(n*(n - 1)) if n > 1 else np.nan,
+                      'weak_components': weak,
+                      'strong_components': strong,
+                      'largest_component': len(largest),
+                      'mean_hops': reachable.mean() if len(reachable) else np.nan,
+                      'diameter': reachable.max() if len(reachable) else np.nan}
+
+            if previous is not None:
+                change = binary.astype(np.int16) - previous
+                record['routes_opened'] = int((change > 0).sum())
+                record['routes_closed'] = int((change < 0).sum())
+
+            previous = binary.astype(np.int16)
+            records.append(record)
+
+    return pd.DataFrame(records).set_index('period')
+
+
+def airport_metrics(graphs, index, conn=None, damping=0.85):
+
+    """
+    Get the hub metrics of every airport and period, joined to the airports
+    table
+
+    Parameters
+    ----------
+    graphs : dict of scipy.sparse.csr_matrix
+        Graph of each period, see build_graphs
+    index : pandas.Index
+        Airport code of each row and column
+    conn : sqlite3.Connection (optional)
+        Connection object that represents the database, see query_to_df
+    damping : float (optional)
+        Damping of the PageRank
+
+    Returns
+    ----------
+    metrics : pandas.DataFrame
+        period, iata, the hub metrics and airport, city, state, lat and long
+        of the airports table, for the airports with flights in the period
+
+    """
+
+    frames = []
+    with instrument.span('airport_metrics', periods=len(graphs)):
+        for period, graph in graphs.items():
+            metrics = hub_metrics(graph, index, damping)
+            metrics = metrics[metrics['degree'] > 0].reset_index()
+            metrics.insert(0, 'period', period)
+            frames.append(metrics)
+
+    metrics = pd.concat(frames, ignore_index=True)
+
+    airports = query_to_df("""SELECT iata, airport, city, state, lat, long
+                                FROM airports""", conn)
+    airports['iata'] = airports['iata'].astype(str)
+
+    return metrics.merge(airports, on='iata', how='left')
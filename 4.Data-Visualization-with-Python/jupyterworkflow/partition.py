@@ -0,0 +1,514 @@
+# Import packages
+import os
+import re
+import sqlite3
+import pandas as pd
+from multiprocessing import Pool
+
+from jupyterworkflow import instrument
+from jupyterworkflow.ingest import create_raw_table
+from jupyterworkflow.ingest import raw_data_entry
+from jupyterworkflow.ingest import create_data_table
+from jupyterworkflow.query import query_to_df
+from jupyterworkflow.query import df_processing_cat
+
+####################################################################################
+####################################################################################
+################### Packages to split flights data by year files ###################
+####################################################################################
+####################################################################################
+
+# Ids of each partition start at year*ID_OFFSET, so Id stays unique across files
+ID_OFFSET = 10**8
+
+# Tables of every partition file
+PARTITION_TABLES = ['raw_data', 'data']
+
+# Supplemental tables kept in the main database
+SUPPLEMENTAL_TABLES = ['airports', 'carriers', 'plane_data']
+
+# Conjuncts of the WHERE clause used to select partitions, any other form
+# of a conjunct is not used and keeps every year
+_YEAR_PREDICATE = re.compile(r"(?:\w+\.)?Year\s*(>=|<=|==|=|>|<)\s*(\d{4})", re.IGNORECASE)
+_DATE_LITERAL = r"(?:date\s*\(\s*)?'(\d{4})(?:-\d{1,2}){0,2}'(?:\s*\))?"
+_DATE_PREDICATE = re.compile(r"(?:\w+\.)?Date\s*(>=|<=|==|=|>|<)\s*" + _DATE_LITERAL, re.IGNORECASE)
+_YEAR_IN = re.compile(r"(?:\w+\.)?Year\s+IN\s*\(([\d\s,]+)\)", re.IGNORECASE)
+_YEAR_BETWEEN = re.compile(r"(?:\w+\.)?Year\s+BETWEEN\s+(\d{4})\s+AND\s+(\d{4})", re.IGNORECASE)
+_DATE_BETWEEN = re.compile(r"(?:\w+\.)?Date\s+BETWEEN\s+" + _DATE_LITERAL + r"\s+AND\s+" + _DATE_LITERAL,
+                           re.IGNORECASE)
+
+_LITERAL = re.compile(r"'[^']*'")
+_TOKEN = re.compile(r"\(|\)|\b(?:AND|OR|BETWEEN)\b", re.IGNORECASE)
+_WHERE_END = re.compile(r"\b(?:GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|WINDOW)\b|;", re.IGNORECASE)
+
+# Forms whose result depends on the rows of every partition at once
+_ACROSS_ROWS = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(|"
+                          r"\b(?:GROUP\s+BY|DISTINCT|ORDER\s+BY|LIMIT|OVER|UNION|EXCEPT|INTERSECT)\b",
+                          re.IGNORECASE)
+
+
+def partition_path(year, directory='source/partitions'):
+
+    """
+    Get the database filepath of one year partition
+
+    Parameters
+    ----------
+    year : int
+        Year of the partition
+    directory : str (optional)
+        Folder of the partition files
+
+    Returns
+    ----------
+    filepath : str
+        Complete filepath of the partition database
+
+    """
+
+    return os.path.join(directory, '{}.db'.format(year))
+
+
+def partition_years(directory='source/partitions'):
+
+    """
+    List the years with a partition file
+
+    Parameters
+    ----------
+    directory : str (optional)
+        Folder of the partition files
+
+    Returns
+    ----------
+    years : list of int
+        Sorted years found in directory
+
+    """
+
+    if not os.path.exists(directory):
+        return []
+
+    return sorted(int(file[:-3]) for file in os.listdir(directory)
+                  if file.endswith('.db') and file[:-3].isdigit())
+
+
+def load_partition(year, directory='source/partitions', chunksize=3000000, encoding='latin-1'):
+
+    """
+    Create the partition database of one year:
+    1. Create raw_data table with Id starting at year*ID_OFFSET
+    2. Entry source/<year>.csv into raw_data table
+    3. Create data table and its Date index
+
+    Parameters
+    ----------
+    year : int
+        Year of the csv file to be loaded
+    directory : str (optional)
+        Folder of the partition files
+    chunksize : int (optional)
+        Chunksize of read_csv function
+    encoding : str (optional)
+        Encoding of csv files
+
+    Returns
+    ----------
+    filepath : str
+        Complete filepath of the partition database
+
+    """
+
+    filepath = partition_path(year, directory)
+
+    create_raw_table(sqlite3.connect(filepath))
+
+    # Start the AUTOINCREMENT sequence of this partition at year*ID_OFFSET
+    conn = sqlite3.connect(filepath)
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'raw_data'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('raw_data', ?)", (year*ID_OFFSET,))
+    conn.commit()
+    conn.close()
+
+    raw_data_entry(sqlite3.connect(filepath), year, year, chunksize=chunksize, encoding=encoding)
+
+    conn = sqlite3.connect(filepath)
+    conn.execute('DROP TABLE IF EXISTS data')
+    conn.commit()
+    create_data_table(conn)
+
+    return filepath
+
+
+def _load_partition_args(args):
+    return load_partition(*args)
+
+
+def load_partitions(start_year=1987, last_year=2008, directory='source/partitions',
+                    processes=None, chunksize=3000000, encoding='latin-1'):
+
+    """
+    Load yearly csv files into one database file per year, in parallel
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First csv file year to be loaded
+    last_year : int (optional)
+        Last csv file year to be loaded
+    directory : str (optional)
+        Folder of the partition files
+    processes : int (optional)
+        Number of worker processes, os.cpu_count() if None
+    chunksize : int (optional)
+        Chunksize of read_csv function
+    encoding : str (optional)
+        Encoding of csv files
+
+    Returns
+    ----------
+    filepath : list of str
+        Complete filepath of each partition database
+
+    """
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    args = [(year, directory, chunksize, encoding) for year in range(start_year, last_year+1)]
+
+    with instrument.span('load_partitions', start_year=start_year, last_year=last_year):
+        if processes == 1:
+            filepath = [_load_partition_args(arg) for arg in args]
+        else:
+            with Pool(processes) as pool:
+                filepath = pool.map(_load_partition_args, args)
+
+    return filepath
+
+
+def _closing(masked, start):
+
+    """
+    Get the position of the parenthesis closing the one at start
+    """
+
+    depth = 0
+    for position in range(start, len(masked)):
+        if masked[position] == '(':
+            depth += 1
+        elif masked[position] == ')':
+            depth -= 1
+            if depth == 0:
+                return position
+    return None
+
+
+def _conjuncts(text, masked):
+
+    """
+    Split a predicate on its top-level AND operators. Parentheses around
+    the whole predicate are removed, the AND of a BETWEEN is kept.
+    None if the predicate has a top-level OR.
+    """
+
+    text, masked = text.strip(), masked.strip()
+    while masked.startswith('(') and _closing(masked, 0) == len(masked) - 1:
+        text, masked = text[1:-1].strip(), masked[1:-1].strip()
+
+    parts, start, depth, between = [], 0, 0, False
+    for token in _TOKEN.finditer(masked):
+        word = token.group().upper()
+        if word == '(':
+            depth += 1
+        elif word == ')':
+            depth -= 1
+        elif depth > 0:
+            continue
+        elif word == 'OR':
+            return None
+        elif word == 'BETWEEN':
+            between = True
+        elif between:
+            between = False
+        else:
+            parts.append((text[start:token.start()], masked[start:token.start()]))
+            start = token.end()
+    parts.append((text[start:], masked[start:]))
+
+    conjuncts = []
+    for part, part_masked in parts:
+        part, part_masked = part.strip(), part_masked.strip()
+        if part_masked.startswith('(') and _closing(part_masked, 0) == len(part_masked) - 1:
+            # A nested OR only stops the use of this conjunct
+            conjuncts += _conjuncts(part, part_masked) or []
+        else:
+            conjuncts.append(part)
+    return conjuncts
+
+
+def years_from_query(query):
+
+    """
+    Get the year range of a query from its Year or Date predicates.
+    Only the plain conjuncts of the WHERE clause of a query with a single
+    SELECT are used: Year or Date compared with a literal, Year IN (...)
+    and BETWEEN. A top-level OR, a subquery, a compound query or a comment
+    keeps every year, and a conjunct of any other form (NOT, CASE,
+    functions) is not used, so a pruned query never misses a partition.
+
+    Parameters
+    ----------
+    query : str
+        SQL query
+
+    Returns
+    ----------
+    first_year : int or None
+        First year needed by the query, None if unbounded
+    last_year : int or None
+        Last year needed by the query, None if unbounded
+    years : set of int or None
+        Years of a Year IN (...) predicate, None if there is none
+
+    """
+
+    first_year, last_year, years = None, None, None
+
+    # Keywords inside string literals are not part of the query structure
+    masked = _LITERAL.sub(lambda match: "'" + '_'*(len(match.group()) - 2) + "'", query)
+
+    where = list(re.finditer(r'\bWHERE\b', masked, re.IGNORECASE))
+    if (len(re.findall(r'\bSELECT\b', masked, re.IGNORECASE)) != 1 or len(where) != 1 or
+            re.search(r'\b(?:UNION|INTERSECT|EXCEPT)\b|--|/\*', masked, re.IGNORECASE)):
+        return first_year, last_year, years
+
+    start = where[0].end()
+    end = _WHERE_END.search(masked, start)
+    end = len(masked) if end is None else end.start()
+
+    conjuncts = _conjuncts(query[start:end], masked[start:end])
+    if conjuncts is None:
+        return first_year, last_year, years
+
+    def narrow(operator, year, is_year):
+        nonlocal first_year, last_year
+        if operator in ('>=', '>', '=', '=='):
+            # Date > '2008-06-30' still needs 2008, so '>' keeps the year
+            bound = year + 1 if operator == '>' and is_year else year
+            first_year = bound if first_year is None else max(first_year, bound)
+        if operator in ('<=', '<', '=', '=='):
+            bound = year - 1 if operator == '<' and is_year else year
+            last_year = bound if last_year is None else min(last_year, bound)
+
+    for conjunct in conjuncts:
+        match = _YEAR_PREDICATE.fullmatch(conjunct)
+        if match:
+            narrow(match.group(1), int(match.group(2)), True)
+            continue
+
+        match = _DATE_PREDICATE.fullmatch(conjunct)
+        if match:
+            narrow(match.group(1), int(match.group(2)), False)
+            continue
+
+        match = _YEAR_BETWEEN.fullmatch(conjunct) or _DATE_BETWEEN.fullmatch(conjunct)
+        if match:
+            narrow('>=', int(match.group(1)), True)
+            narrow('<=', int(match.group(2)), True)
+            continue
+
+        match = _YEAR_IN.fullmatch(conjunct)
+        if match:
+            found = {int(value) for value in match.group(1).split(',') if value.strip()}
+            years = found if years is None else years & found
+
+    return first_year, last_year, years
+
+
+def _needed_years(query, years, directory):
+
+    """
+    Get the available partition years needed by a query
+    """
+
+    available = partition_years(directory)
+
+    if years is not None:
+        return [year for year in years if year in available]
+
+    first_year, last_year, in_years = years_from_query(query or '')
+
+    return [year for year in available
+            if (first_year is None or year >= first_year)
+            and (last_year is None or year <= last_year)
+            and (in_years is None or year in in_years)]
+
+
+def attach_limit():
+
+    """
+    Get the number of databases SQLite attaches to one connection
+
+    Returns
+    ----------
+    limit : int
+        Maximum number of attached databases
+
+    """
+
+    conn = sqlite3.connect(':memory:')
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(conn, 'getlimit') else 10
+    conn.close()
+
+    return limit
+
+
+def _row_level(query):
+
+    """
+    Check that a query gives the same rows run on batches of partitions and
+    concatenated: no aggregate, grouping, DISTINCT, window, ordering or LIMIT
+    """
+
+    masked = _LITERAL.sub("''", query)
+
+    return _ACROSS_ROWS.search(masked) is None
+
+
+def connect_partitions(query=None, years=None, directory='source/partitions',
+                       main_database='source/all_data.db'):
+
+    """
+    Open an in-memory connection that attaches only the partitions needed
+    by a query. Temporary views with the names of the partition tables
+    (raw_data, data) union the attached partitions, and the supplemental
+    tables are read from main_database, so queries written for all_data.db
+    run unchanged. A query that selects no partition gets empty views.
+
+    Parameters
+    ----------
+    query : str (optional)
+        SQL query whose Year and Date predicates select the partitions
+    years : list of int (optional)
+        Years to attach, overrides the predicates of query
+    directory : str (optional)
+        Folder of the partition files
+    main_database : str (optional)
+        Database with the supplemental tables, skipped if it does not exist
+
+    Returns
+    ----------
+    conn : sqlite3.Connection
+        Connection object with the attached partitions
+
+    Raises
+    ----------
+    ValueError
+        if more partitions are needed than SQLite attaches at once, see
+        query_partitions to run the query in batches
+
+    """
+
+    years = _needed_years(query, years, directory)
+    use_main = main_database is not None and os.path.exists(main_database)
+    limit = attach_limit()
+
+    if len(years) + use_main > limit:
+        raise ValueError('{} partitions are needed, more than the {} SQLite attaches at once: '
+                         'run the query with query_partitions'.format(len(years), limit - use_main))
+
+    with instrument.span('connect_partitions', years=years) as span:
+        conn = sqlite3.connect(':memory:')
+
+        for year in years:
+            conn.execute('ATTACH DATABASE ? AS p{}'.format(year), (partition_path(year, directory),))
+        sources = ['p{}'.format(year) for year in years]
+
+        if not years:
+            # No partition selected: empty views with the columns of a partition
+            available = partition_years(directory)
+            if not available:
+                conn.close()
+                raise FileNotFoundError('no partition in {}, see load_partitions'.format(directory))
+            conn.execute('ATTACH DATABASE ? AS empty', (partition_path(available[0], directory),))
+
+        for table in PARTITION_TABLES:
+            if sources:
+                union = ' UNION ALL '.join('SELECT * FROM {}.{}'.format(source, table) for source in sources)
+            else:
+                union = 'SELECT * FROM empty.{} WHERE 0'.format(table)
+            conn.execute('CREATE TEMP VIEW {} AS {}'.format(table, union))
+
+        if use_main:
+            conn.execute('ATTACH DATABASE ? AS main_db', (main_database,))
+            for table in SUPPLEMENTAL_TABLES:
+                conn.execute('CREATE TEMP VIEW {0} AS SELECT * FROM main_db.{0}'.format(table))
+
+        span.add(partitions=len(years))
+
+    return conn
+
+
+def query_partitions(query, years=None, directory='source/partitions',
+                     main_database='source/all_data.db', chunksize=500000, per_partition=False):
+
+    """
+    Get SQL queries over the year partitions into DataFrames. When more
+    partitions are needed than SQLite attaches at once, a row level query
+    runs on batches of partitions and the results are concatenated
+
+    Parameters
+    ----------
+    query : str
+        SQL query written against raw_data or data tables
+    years : list of int (optional)
+        Years to query, overrides the predicates of query
+    directory : str (optional)
+        Folder of the partition files
+    main_database : str (optional)
+        Database with the supplemental tables
+    chunksize : int (optional)
+        Chunksize of read_sql_query function
+    per_partition : bool (optional)
+        if True, run the query once per partition and concatenate the results.
+        Only valid for row level queries, not for aggregations across years
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with column optimized column types
+
+    Raises
+    ----------
+    ValueError
+        if the query aggregates, groups, orders or limits rows across more
+        partitions than SQLite attaches at once
+
+    """
+
+    years = _needed_years(query, years, directory)
+
+    if per_partition:
+        size = 1
+    else:
+        use_main = main_database is not None and os.path.exists(main_database)
+        size = attach_limit() - use_main
+
+        if len(years) > size and not _row_level(query):
+            raise ValueError('the query needs {} partitions, more than the {} SQLite attaches at once, and its '
+                             'rows depend on every partition: select fewer years'.format(len(years), size))
+
+    # One batch with empty views if no partition is needed
+    batches = [years[start:start+size] for start in range(0, len(years), size)] or [[]]
+
+    df = []
+    for batch in batches:
+        conn = connect_partitions(years=batch, directory=directory, main_database=main_database)
+        df.append(query_to_df(query, conn, chunksize=chunksize))
+        conn.close()
+
+    if len(df) == 1:
+        return df[0]
+
+    return df_processing_cat(pd.concat(df, ignore_index=True))
@@ -0,0 +1,509 @@
+# Import packages
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+################### Packages to run the workflow as a stage graph ##################
+####################################################################################
+####################################################################################
+
+# Fingerprints of the last run of every stage
+STATE_FILE = 'source/pipeline_state.json'
+
+# Seconds a stage waits for the database lock held by a concurrent stage
+BUSY_TIMEOUT = 3600
+
+SUPPLEMENTAL_FILES = ['source/airports.csv', 'source/carriers.csv', 'source/plane-data.csv']
+
+
+def _file_signature(filepath):
+
+    """
+    Get the size and modification time of a file, None if it is missing
+    """
+
+    if not os.path.exists(filepath):
+        return [filepath, None, None]
+    stat = os.stat(filepath)
+    return [filepath, stat.st_size, stat.st_mtime_ns]
+
+
+def _table_signatures(database, tables):
+
+    """
+    Get the schema and the largest rowid of tables of the database, None for
+    a missing table. Appending, dropping or recreating a table with other
+    rows changes its signature, without a scan of the table
+    """
+
+    if not tables:
+        return []
+    if not os.path.exists(database):
+        return [[table, None, None] for table in tables]
+
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+    try:
+        signatures = []
+        for table in tables:
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()
+            if row is None:
+                signatures.append([table, None, None])
+            else:
+                last = conn.execute('SELECT MAX(rowid) FROM {}'.format(table)).fetchone()[0]
+                signatures.append([table, row[0], last])
+        return signatures
+    finally:
+        conn.close()
+
+
+class Stage:
+
+    """
+    Stage of the workflow with its inputs and outputs.
+
+    A stage is up to date when its fingerprint, made of its parameters and
+    the size and modification time of its input files and the signature of
+    the tables it reads, is the one recorded by its last run, and its output
+    files and tables are still the ones it left. A stage whose upstream
+    stage ran without changing its outputs is skipped.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    func : callable
+        Function without arguments that runs the stage. It can return False
+        to report that its outputs are unchanged, for example a download
+        answered with 304 Not Modified
+    after : list of str (optional)
+        Stages that must be finished before this one
+    inputs : list of str (optional)
+        Files read by the stage
+    outputs : list of str (optional)
+        Files written by the stage
+    tables : list of str (optional)
+        Database tables written by the stage
+    reads : list of str (optional)
+        Database tables read by the stage
+    params : dict (optional)
+        Parameters of the stage, a change runs it again
+
+    """
+
+    def __init__(self, name, func, after=(), inputs=(), outputs=(), tables=(), reads=(), params=None):
+        self.name = name
+        self.func = func
+        self.after = list(after)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.tables = list(tables)
+        self.reads = list(reads)
+        self.params = params or {}
+
+    def __repr__(self):
+        return 'Stage({!r}, after={})'.format(self.name, self.after)
+
+    def fingerprint(self, database):
+
+        """
+        Get the fingerprint of the stage from its parameters, input files
+        and the tables it reads
+
+        Parameters
+        ----------
+        database : str
+            Complete filepath of the database of the tables
+
+        Returns
+        ----------
+        fingerprint : str
+            Hexadecimal sha256 digest
+
+        """
+
+        content = json.dumps({'params': self.params,
+                              'inputs': [_file_signature(filepath) for filepath in self.inputs],
+                              'reads': _table_signatures(database, self.reads)},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def output_signature(self, database):
+
+        """
+        Get the signature of the output files and tables of the stage
+        """
+
+        return json.loads(json.dumps({'outputs': [_file_signature(filepath) for filepath in self.outputs],
+                                      'tables': _table_signatures(database, self.tables)}, default=str))
+
+    def is_up_to_date(self, state, database):
+
+        """
+        Check that the last run of the stage is still valid
+
+        Parameters
+        ----------
+        state : dict
+            State of the pipeline, see load_state
+        database : str
+            Complete filepath of the database of the tables
+
+        Returns
+        ----------
+        up_to_date : bool
+
+        """
+
+        recorded = state.get(self.name, {})
+        if recorded.get('fingerprint') is None or recorded['fingerprint'] != self.fingerprint(database):
+            return False
+
+        outputs = self.output_signature(database)
+        if any(size is None for _, size, _ in outputs['outputs'] + outputs['tables']):
+            return False
+
+        return recorded.get('outputs') == outputs
+
+
+def build_stages(start_year=1987, last_year=2008, base_url=None, database=None, chunksize=3000000,
+                 encoded=False, memory_budget=None, profile=True):
+
+    """
+    Create the stages of the workflow:
+    - download_flights: get_url and get_flights_data
+    - download_supplemental: get_supplemental_data
+    - profile: profiling.profile_years, if profile is True
+    - raw_data: create_raw_table and raw_data_entry
+    - supplemental_tables: create_supl_tables and supl_tables_data_entry
+    - data_table: create_data_table
+    The supplemental stages do not depend on the yearly stages, so they run
+    next to them, but with encoded True raw_data comes after
+    supplemental_tables, the dimension tables are seeded from its tables
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First year
+    last_year : int (optional)
+        Last year
+    base_url : str (optional)
+        url of the folder of the files, acquisition.BASE_URL if None
+    database : str (optional)
+        Complete filepath of the database, query.DATABASE if None
+    chunksize : int (optional)
+        Chunksize of raw_data_entry
+    encoded : bool (optional)
+        if True, raw_data table stores integer ids, see create_raw_table
+    memory_budget : int or str (optional)
+        Memory allowed for raw_data_entry
+    profile : bool (optional)
+        if True, raw_data_entry uses the profile of the yearly files
+
+    Returns
+    ----------
+    stages : list of Stage
+
+    """
+
+    # Imported here, so the command line starts without pandas
+    from jupyterworkflow import acquisition
+    from jupyterworkflow import query
+
+    base_url = base_url or acquisition.BASE_URL
+    database = database or query.DATABASE
+    years = list(range(start_year, last_year+1))
+    csv_files = ['source/{}.csv'.format(year) for year in years]
+
+    def connect():
+        return sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+
+    # One download cache for both download stages, its records are locked
+    shared = {}
+    lock = threading.Lock()
+
+    def download_cache():
+        with lock:
+            if 'cache' not in shared:
+                from jupyterworkflow import cache
+                shared['cache'] = cache.DownloadCache()
+            return shared['cache']
+
+    def download_flights():
+        url, filepath = acquisition.get_url(start_year, last_year, base_url)
+        status = acquisition.get_flights_data(url, filepath, cache=download_cache())
+        return 'downloaded' in status.values()
+
+    def download_supplemental():
+        status = acquisition.get_supplemental_data(base_url, cache=download_cache())
+        return 'downloaded' in status.values()
+
+    def profile_years():
+        from jupyterworkflow import profiling
+        profiling.profile_years(start_year, last_year)
+
+    def raw_data():
+        from jupyterworkflow import ingest
+        from jupyterworkflow import profiling
+        ingest.create_raw_table(connect(), encoded=encoded)
+        ingest.raw_data_entry(connect(), start_year, last_year, chunksize=chunksize,
+                              memory_budget=memory_budget,
+                              profile=profiling.PROFILE_FILE if profile else None)
+
+    def supplemental_tables():
+        from jupyterworkflow import ingest
+        ingest.create_supl_tables(connect())
+        ingest.supl_tables_data_entry(connect())
+
+    def data_table():
+        from jupyterworkflow import ingest
+        ingest.create_data_table(connect())
+
+    raw_data_inputs = csv_files + (['source/profile.json'] if profile else [])
+
+    # The downloads are up to date once their files exist, a forced run sends
+    # conditional requests for the files of the download cache
+    stages = [Stage('download_flights', download_flights, outputs=csv_files, params={'years': years}),
+              Stage('download_supplemental', download_supplemental, outputs=SUPPLEMENTAL_FILES)]
+
+    if profile:
+        stages.append(Stage('profile', profile_years, after=['download_flights'], inputs=csv_files,
+                            outputs=['source/profile.json'], params={'years': years}))
+
+    # The encoded table seeds its dimension tables from the supplemental tables
+    raw_data_after = ['profile' if profile else 'download_flights']
+    raw_data_tables = ['raw_data']
+    raw_data_reads = []
+    if encoded:
+        from jupyterworkflow import dictionary
+        raw_data_after.append('supplemental_tables')
+        raw_data_tables += list(dictionary.DIMENSIONS)
+        raw_data_reads = ['airports', 'carriers', 'plane_data']
+
+    stages += [Stage('raw_data', raw_data, after=raw_data_after, inputs=raw_data_inputs,
+                     tables=raw_data_tables, reads=raw_data_reads,
+                     params={'years': years, 'encoded': encoded, 'chunksize': chunksize,
+                             'memory_budget': memory_budget, 'database': database}),
+               Stage('supplemental_tables', supplemental_tables, after=['download_supplemental'],
+                     inputs=SUPPLEMENTAL_FILES, tables=['airports', 'carriers', 'plane_data'],
+                     params={'database': database}),
+               Stage('data_table', data_table, after=['raw_data'], tables=['data'], reads=['raw_data'],
+                     params={'database': database})]
+
+    return stages
+
+
+def load_state(state_file=STATE_FILE):
+
+    """
+    Read the fingerprints of the last run of every stage, empty if the
+    pipeline never ran
+    """
+
+    try:
+        with open(state_file) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, state_file=STATE_FILE):
+
+    """
+    Write the state of the pipeline, replacing the file atomically
+    """
+
+    folder = os.path.dirname(state_file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    temporary = state_file + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(temporary, state_file)
+
+
+def _check_graph(stages):
+
+    """
+    Check that every stage comes after known stages and that there is no cycle
+    """
+
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = set(stage.after) - names
+        if unknown:
+            raise ValueError('stage {} comes after unknown stages: {}'.format(stage.name, sorted(unknown)))
+
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if set(stage.after) <= done]
+        if not ready:
+            raise ValueError('stages with a cycle: {}'.format(sorted(stage.name for stage in remaining)))
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def run_pipeline(stages, workers=2, force=(), database=None, state_file=STATE_FILE, dry_run=False):
+
+    """
+    Run the stages in the order of the graph. A stage starts once the stages
+    it comes after are finished, and independent stages run concurrently in
+    threads. A stage waits for the running stages that write the tables it
+    reads or writes, or read the tables it writes; stages on other tables
+    share the database, a write waiting on the busy timeout of SQLite for
+    the write of another stage. Stages up to date are skipped, and the
+    stages after a failed stage are not run
+
+    Parameters
+    ----------
+    stages : list of Stage
+        Stages of the pipeline, see build_stages
+    workers : int (optional)
+        Number of stages running at once
+    force : list of str or bool (optional)
+        Stages run even if up to date, all of them if True
+    database : str (optional)
+        Complete filepath of the database, query.DATABASE if None
+    state_file : str (optional)
+        Complete filepath of the state of the pipeline
+    dry_run : bool (optional)
+        if True, report the stages that would run without running them
+
+    Returns
+    ----------
+    summary : list of dict
+        Stage, status (ran, unchanged, skipped, failed, blocked or
+        would_run), start and seconds of each stage, and error of failed
+        stages
+
+    """
+
+    if database is None:
+        from jupyterworkflow import query
+        database = query.DATABASE
+
+    _check_graph(stages)
+
+    state = load_state(state_file)
+    pending = {stage.name: stage for stage in stages}
+    status = {}
+    summary = {}
+    running = {}
+    origin = time.perf_counter()
+
+    def run(stage):
+        start = time.perf_counter()
+        with instrument.span('stage', stage=stage.name):
+            changed = stage.func()
+        return changed is not False, start - origin, time.perf_counter() - start
+
+    def conflicts(stage):
+        # Tables of the stage written, or read while written, by a running stage
+        return any(set(stage.tables) & set(other.tables + other.reads) or set(stage.reads) & set(other.tables)
+                   for other, _ in running.values())
+
+    with instrument.span('pipeline', stages=len(stages)), ThreadPoolExecutor(max(1, workers)) as executor:
+
+        while pending or running:
+
+            # Pass over the pending stages until none of them can start, a
+            # stage skipped in a pass lets the stages after it start
+            progress = True
+            while progress:
+                progress = False
+
+                for name, stage in list(pending.items()):
+                    if not all(upstream in status for upstream in stage.after):
+                        continue
+
+                    # A stage is checked and run once no running stage uses
+                    # its tables, its fingerprint reads them
+                    if conflicts(stage):
+                        continue
+                    del pending[name]
+                    progress = True
+
+                    if any(status[upstream] in ('failed', 'blocked') for upstream in stage.after):
+                        status[name] = 'blocked'
+                    elif dry_run and any(status[upstream] == 'would_run' for upstream in stage.after):
+                        # The stages after it would run with it
+                        status[name] = 'would_run'
+                    elif force is not True and name not in force and stage.is_up_to_date(state, database):
+                        status[name] = 'skipped'
+                    elif dry_run:
+                        status[name] = 'would_run'
+                    else:
+                        running[executor.submit(run, stage)] = (stage, stage.fingerprint(database))
+                        continue
+
+                    summary[name] = {'stage': name, 'status': status[name], 'start': None, 'seconds': 0.0}
+
+            if not running:
+                # _check_graph rules out stages waiting for each other
+                if pending:
+                    raise RuntimeError('stages waiting without a running stage: {}'.format(sorted(pending)))
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage, fingerprint = running.pop(future)
+                try:
+                    changed, start, seconds = future.result()
+                except Exception as error:
+                    status[stage.name] = 'failed'
+                    summary[stage.name] = {'stage': stage.name, 'status': 'failed', 'start': None,
+                                           'seconds': None, 'error': repr(error)}
+                    continue
+
+                # The stages after an unchanged stage check their own inputs
+                status[stage.name] = 'ran' if changed else 'unchanged'
+                state[stage.name] = {'fingerprint': fingerprint, 'outputs': stage.output_signature(database),
+                                     'completed': time.time(), 'seconds': seconds}
+                save_state(state, state_file)
+                summary[stage.name] = {'stage': stage.name, 'status': status[stage.name], 'start': start,
+                                       'seconds': seconds}
+
+    return [summary[stage.name] for stage in stages]
+
+
+def format_summary(summary):
+
+    """
+    Format the summary of run_pipeline as a table of stage timings
+
+    Parameters
+    ----------
+    summary : list of dict
+        Summary returned by run_pipeline
+
+    Returns
+    ----------
+    table : str
+
+    """
+
+    lines = ['{:<24}{:<11}{:>10}{:>12}'.format('stage', 'status', 'start s', 'seconds')]
+    for record in summary:
+        start = '' if record['start'] is None else '{:.1f}'.format(record['start'])
+        seconds = '' if record['seconds'] is None else '{:.1f}'.format(record['seconds'])
+        lines.append('{:<24}{:<11}{:>10}{:>12}'.format(record['stage'], record['status'], start, seconds))
+        if record.get('error'):
+            lines.append('    ' + record['error'])
+
+    elapsed = max([record['start'] + record['seconds'] for record in summary if record['start'] is not None],
+                  default=0.0)
+    total = sum(record['seconds'] or 0.0 for record in summary)
+    lines.append('elapsed {:.1f} s, {:.1f} s of stages'.format(elapsed, total))
+
+    return '\n'.join(lines)
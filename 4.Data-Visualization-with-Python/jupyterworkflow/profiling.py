@@ -0,0 +1,287 @@
+# Import packages
+import os
+import json
+import time
+import pandas as pd
+import numpy as np
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+################ Packages to profile the yearly csv files before ingest ############
+####################################################################################
+####################################################################################
+
+PROFILE_FILE = 'source/profile.json'
+
+# Kinds of column, a column takes the widest kind seen in any chunk
+KINDS = ['empty', 'integer', 'float', 'string']
+
+# Integer types tried in order for the values of a column
+INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _source_file(year, directory):
+
+    """
+    Get the csv file of a year, or its bz2 download when it was not unzipped
+    """
+
+    filepath = os.path.join(directory, '{}.csv'.format(year))
+    return filepath if os.path.exists(filepath) else filepath + '.bz2'
+
+
+def _profile_chunk(chunk, columns):
+
+    """
+    Update the column profiles with one chunk of a csv file
+    """
+
+    for name in chunk.columns:
+
+        values = chunk[name]
+        present = values.notna()
+        count = int(present.sum())
+        column = columns.setdefault(name, {'count': 0, 'kind': 'empty', 'min': None, 'max': None,
+                                           'length': 0})
+        column['count'] += count
+
+        if count == 0:
+            continue
+
+        values = values[present]
+
+        if pd.api.types.is_numeric_dtype(values.dtype):
+            numbers = values.to_numpy(dtype=np.float64)
+            kind = 'integer' if np.array_equal(numbers, np.floor(numbers)) else 'float'
+            low, high = float(numbers.min()), float(numbers.max())
+            column['min'] = low if column['min'] is None else min(column['min'], low)
+            column['max'] = high if column['max'] is None else max(column['max'], high)
+        else:
+            kind = 'string'
+            column['length'] = max(column['length'], int(values.astype(str).str.len().max()))
+
+        if KINDS.index(kind) > KINDS.index(column['kind']):
+            column['kind'] = kind
+
+
+def profile_year(year, directory='source', chunksize=1000000, encoding='latin-1'):
+
+    """
+    Profile one yearly file in one streaming pass, from the csv or straight
+    from the bz2 download
+
+    Parameters
+    ----------
+    year : int
+        Year of the file
+    directory : str (optional)
+        Folder of the yearly files
+    chunksize : int (optional)
+        Chunksize of read_csv function
+    encoding : str (optional)
+        Encoding of csv files
+
+    Returns
+    ----------
+    profile : dict
+        rows, bytes and file of the year, and for each column the count of
+        non null values, the kind (empty, integer, float or string), the
+        min and max of numeric values and the max length of strings
+
+    """
+
+    filepath = _source_file(year, directory)
+    profile = {'year': year, 'file': filepath, 'bytes': os.path.getsize(filepath), 'rows': 0, 'columns': {}}
+
+    with instrument.span('profile_year', year=year):
+        for chunk in pd.read_csv(filepath, chunksize=chunksize, encoding=encoding):
+            with instrument.span('chunk') as span:
+                _profile_chunk(chunk, profile['columns'])
+                profile['rows'] += len(chunk)
+                span.add(rows=len(chunk))
+
+    for column in profile['columns'].values():
+        column['na_rate'] = 1 - column['count']/profile['rows'] if profile['rows'] else 1.0
+
+    return profile
+
+
+def _profile_year_args(args):
+    year, kwargs = args
+    return profile_year(year, **kwargs)
+
+
+def profile_years(start_year=1987, last_year=2008, processes=None, filepath=PROFILE_FILE, **kwargs):
+
+    """
+    Profile the yearly files in parallel processes and write the profile
+    file used by raw_data_entry
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First year
+    last_year : int (optional)
+        Last year
+    processes : int (optional)
+        Number of worker processes, os.cpu_count() if None, no pool if 1
+    filepath : str (optional)
+        Complete filepath of the JSON profile, not written if None
+    kwargs : dict (optional)
+        Arguments of profile_year
+
+    Returns
+    ----------
+    profile : dict
+        Profile of each year under its year as str, see profile_year
+
+    """
+
+    from multiprocessing import Pool
+
+    args = [(year, kwargs) for year in range(start_year, last_year+1)]
+
+    with instrument.span('profile_years', start_year=start_year, last_year=last_year):
+        if processes == 1:
+            years = [_profile_year_args(arg) for arg in args]
+        else:
+            with Pool(processes) as pool:
+                years = pool.map(_profile_year_args, args)
+
+    profile = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'years': {str(year['year']): year for year in years}}
+
+    if filepath is not None:
+        folder = os.path.dirname(filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        temporary = filepath + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(profile, file, indent=1)
+        os.replace(temporary, filepath)
+
+    return profile
+
+
+def load_profile(filepath=PROFILE_FILE):
+
+    """
+    Read a profile written by profile_years
+
+    Parameters
+    ----------
+    filepath : str (optional)
+        Complete filepath of the JSON profile
+
+    Returns
+    ----------
+    profile : dict
+        Profile of each year, see profile_years
+
+    """
+
+    with open(filepath) as file:
+        return json.load(file)
+
+
+def year_profile(profile, year):
+
+    """
+    Get the profile of one year, None if the year was not profiled
+    """
+
+    return profile['years'].get(str(year))
+
+
+def empty_columns(profile):
+
+    """
+    Get the columns of a year profile without any value
+
+    Parameters
+    ----------
+    profile : dict
+        Profile of a year, see profile_year
+
+    Returns
+    ----------
+    columns : list of str
+
+    """
+
+    return [name for name, column in profile['columns'].items() if column['count'] == 0]
+
+
+def integer_type(low, high):
+
+    """
+    Get the narrowest signed integer type holding low, high and 0, the value
+    of the missing values after ingest
+    """
+
+    for dtype in INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min(low, 0) and max(high, 0) <= info.max:
+            return dtype
+    return np.int64
+
+
+def column_dtypes(profile):
+
+    """
+    Get the narrowest read_csv dtype of every column of a year profile that
+    is not empty. Integer columns with missing values are read as float32,
+    which parses faster than the nullable integer types and holds their
+    values exactly, see integer_dtypes to convert them after fillna
+
+    Parameters
+    ----------
+    profile : dict
+        Profile of a year, see profile_year
+
+    Returns
+    ----------
+    dtypes : dict
+        Column -> dtype for pandas.read_csv
+
+    """
+
+    dtypes = {}
+
+    for name, column in profile['columns'].items():
+        if column['kind'] == 'integer':
+            dtype = integer_type(column['min'], column['max'])
+            if column['count'] == profile['rows']:
+                dtypes[name] = dtype
+            else:
+                dtypes[name] = np.float32 if np.iinfo(dtype).bits <= 16 else np.float64
+        elif column['kind'] == 'float':
+            dtypes[name] = np.float64
+        elif column['kind'] == 'string':
+            dtypes[name] = str
+
+    return dtypes
+
+
+def integer_dtypes(profile):
+
+    """
+    Get the narrowest integer type of every integer column of a year profile
+
+    Parameters
+    ----------
+    profile : dict
+        Profile of a year, see profile_year
+
+    Returns
+    ----------
+    dtypes : dict
+        Column -> numpy integer type
+
+    """
+
+    return {name: integer_type(column['min'], column['max'])
+            for name, column in profile['columns'].items() if column['kind'] == 'integer'}
@@ -0,0 +1,602 @@
+# Import packages
+import pandas as pd
+import numpy as np
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+from jupyterworkflow import chunking
+from jupyterworkflow import dictionary
+from jupyterworkflow import instrument
+from jupyterworkflow import sampling
+
+####################################################################################
+####################################################################################
+##################### Packages to get SQL queries to DataFrame #####################
+####################################################################################
+####################################################################################
+
+
+def chunk_preprocessing_numpy(chunk):
+
+    """
+    Optimize DataFrame columns which could be transformed into numpy arrays
+
+    Parameters
+    ----------
+    chunk : pandas.DataFrame
+        Chunk DataFrame
+
+    Returns
+    ----------
+    chunk : pandas.DataFrame
+        Chunk DataFrame with optimized column types
+
+    """
+
+    # data table
+    try:
+        chunk.loc[:,'Id'] = chunk.loc[:,'Id'].values.astype(np.int64)
+    except:
+        pass
+    try:
+        chunk.loc[:,'Date'] = pd.to_datetime(chunk.loc[:,'Date'].values, format='%Y-%m-%d')
+    except:
+        pass
+    try:
+        chunk.loc[:,'FlightNum'] = chunk.loc[:,'FlightNum'].values.astype(np.int16)
+    except:
+        pass
+    try:
+        chunk.loc[:,'Distance'] = chunk.loc[:,'Distance'].values.astype(np.int16)
+    except:
+        pass
+
+    # airports table
+    try:
+        chunk.loc[:,'Id_airports'] = chunk.loc[:,'Id_airports'].values.astype(np.int64)
+    except:
+        pass
+    # carriers table
+    try:
+        chunk.loc[:,'Id_carriers'] = chunk.loc[:,'Id_carriers'].values.astype(np.int64)
+    except:
+        pass       
+    # plane_data table
+    try:
+        chunk.loc[:,'Id_plane_data'] = chunk.loc[:,'Id_plane_data'].values.astype(np.int64)
+    except:
+        pass   
+    try:
+        chunk.loc[:,'issue_date'] = pd.to_datetime(chunk.loc[:,'issue_date'].values, format='%m/%d/%Y')
+    except:
+        pass
+    try:
+        chunk.loc[:,'year'] = chunk.loc[:,'year'].values.astype(np.int32)
+    except:
+        pass
+    return chunk
+   
+def df_processing_cat(df):  
+
+    """
+    Optimize Categorical columns of the DataFrame
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Chunk DataFrame
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with column optimized column types
+
+    """
+
+    # data table
+    try:
+        df.loc[:,'UniqueCarrier'] = df.loc[:,'UniqueCarrier'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'TailNum'] = df.loc[:,'TailNum'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'Origin'] = df.loc[:,'Origin'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'Dest'] = df.loc[:,'Dest'].astype('category')
+    except:
+        pass
+
+    # airports table
+    try:
+        df.loc[:,'iata'] = df.loc[:,'iata'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'airport'] = df.loc[:,'airport'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'airport1'] = df.loc[:,'airport1'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'airport2'] = df.loc[:,'airport2'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'city'] = df.loc[:,'city'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'state'] = df.loc[:,'state'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'country'] = df.loc[:,'country'].astype('category')
+    except:
+        pass
+
+    # carriers table
+    try:
+        df.loc[:,'Code'] = df.loc[:,'Code'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'Description'] = df.loc[:,'Description'].astype('category')
+    except:
+        pass
+
+    # plane_data table
+    try:
+        df.loc[:,'tailnum'] = df.loc[:,'tailnum'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'type'] = df.loc[:,'type'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'manufacturer'] = df.loc[:,'manufacturer'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'model'] = df.loc[:,'model'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'status'] = df.loc[:,'status'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'aircraft_type'] = df.loc[:,'aircraft_type'].astype('category')
+    except:
+        pass
+    try:
+        df.loc[:,'engine_type'] = df.loc[:,'engine_type'].astype('category')
+    except:
+        pass
+    return df
+
+
+def df_processing_cat_opt(df):  
+
+    """
+    Optimize Categorical columns of the DataFrame
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Chunk DataFrame
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with column optimized column types
+
+    """
+
+    try:
+        if col_obj.empty:
+            col_obj = df.select_dtypes(include=['object']).columns
+        else:
+            df.loc[:,col_obj] = df.loc[:,col_obj].astype('category')
+    except:
+        pass
+
+    return df
+
+
+# Database of the workflow, opened by query_to_df when no connection is given
+DATABASE = 'source/all_data.db'
+
+
+def connect_database(database=DATABASE):
+
+    """
+    Open an existing database. Unlike sqlite3.connect, a missing file raises
+    an error instead of creating an empty database, for example when the
+    notebook is started from another folder
+
+    Parameters
+    ----------
+    database : str (optional)
+        Complete filepath of the database
+
+    Returns
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+
+    """
+
+    if not os.path.exists(database):
+        raise FileNotFoundError('database not found: {} (working directory: {})'.format(
+            database, os.getcwd()))
+
+    return sqlite3.connect(database)
+
+
+# Suggested slow-query log. query_to_df only appends the queries slower than
+# SLOW_QUERY_SECONDS with their plan and timings, one JSON line per query,
+# when it is given a slow_log
+SLOW_QUERY_LOG = 'source/slow_queries.jsonl'
+SLOW_QUERY_SECONDS = 60
+
+
+@contextmanager
+def _timer(timings, key):
+
+    """
+    Add the seconds of a block of code to timings[key]
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[key] = timings.get(key, 0.0) + time.perf_counter() - start
+
+
+def _timed(chunks, timings):
+
+    """
+    Iterate over chunks, adding the seconds spent to get each one to
+    timings['fetch']
+    """
+
+    chunks = iter(chunks)
+    while True:
+        with _timer(timings, 'fetch'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def explain_query(query, conn=None, backend=None):
+
+    """
+    Get the plan of a query, for example whether SQLite scans data table or
+    searches it with an index
+
+    Parameters
+    ----------
+    query : str
+        SQL query
+    conn : sqlite3.Connection (optional)
+        Connection object that represents the database
+    backend : SQLiteBackend or DuckDBBackend (optional)
+        Backend of backends module, used instead of conn
+
+    Returns
+    ----------
+    plan : list of str
+        Steps of the plan, for example 'SEARCH data USING INDEX ... (Date>? AND Date<?)',
+        None if the query cannot be explained
+
+    """
+
+    try:
+        if backend is not None:
+            return backend.explain(query)
+        # Last column of EXPLAIN QUERY PLAN rows is the step
+        return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query)]
+    except Exception:
+        return None
+
+
+def _query_profile(query, df, timings, seconds, chunks, rss, plan, conn=None, backend=None):
+
+    """
+    Gather the profile of a query_to_df call into a flat record
+    """
+
+    text = re.sub(r'\s+', ' ', query).strip()
+    if backend is not None:
+        database = getattr(backend, 'database', None)
+    else:
+        database = conn.execute('PRAGMA database_list').fetchone()[2]
+
+    rows = len(df)
+    nbytes = int(df.memory_usage(index=False, deep=True).sum()) if rows else 0
+    engine = timings.get('engine')
+
+    return {'run_id': instrument.get_run_id(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'query_id': hashlib.sha1(text.encode()).hexdigest()[:12],
+            'query': text,
+            'backend': 'sqlite' if backend is None else backend.name,
+            'database': database,
+            'seconds': seconds,
+            'engine_seconds': engine,
+            'frames_seconds': timings.get('frames'),
+            'fetch_seconds': timings.get('fetch', 0.0),
+            'decode_seconds': timings.get('decode', 0.0),
+            'dtypes_seconds': timings.get('dtypes', 0.0),
+            'concat_seconds': timings.get('concat', 0.0),
+            'python_seconds': None if engine is None else seconds - engine,
+            'chunks': chunks,
+            'rows': rows,
+            'bytes': nbytes,
+            'rows_per_sec': rows/seconds if seconds else None,
+            'bytes_per_sec': nbytes/seconds if seconds else None,
+            'peak_rss_mb': rss[1],
+            'rss_growth_mb': rss[1] - rss[0],
+            'plan': None if plan is None else ' | '.join(plan)}
+
+
+def log_slow_query(record, filepath=SLOW_QUERY_LOG):
+
+    """
+    Append the profile of a query to the slow-query log
+
+    Parameters
+    ----------
+    record : dict
+        Profile of the query, see query_to_df
+    filepath : str (optional)
+        Complete filepath of the log
+
+    Returns
+    ----------
+
+    """
+
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(filepath, 'a') as file:
+        file.write(json.dumps(record, default=str) + '\n')
+
+
+def load_slow_queries(filepath=SLOW_QUERY_LOG):
+
+    """
+    Read the slow-query log into a DataFrame
+
+    Parameters
+    ----------
+    filepath : str (optional)
+        Complete filepath of the log
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        One row per slow query, the columns of the profile of query_to_df
+
+    """
+
+    with open(filepath) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+
+    return pd.DataFrame(records)
+
+
+def compare_slow_queries(filepath=SLOW_QUERY_LOG):
+
+    """
+    Compare the slow queries across runs of the workflow
+
+    Parameters
+    ----------
+    filepath : str (optional)
+        Complete filepath of the log
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        Median seconds of each query (rows, by query_id) in each run
+        (columns, by run_id, in order of first appearance), with the number
+        of distinct plans seen and the query text. More than one plan means
+        the plan changed between runs, for example after an index was dropped
+
+    """
+
+    log = load_slow_queries(filepath)
+    runs = log['run_id'].drop_duplicates().tolist()
+
+    df = log.pivot_table(index='query_id', columns='run_id', values='seconds', aggfunc='median')[runs]
+    df['plans'] = log.groupby('query_id')['plan'].nunique(dropna=False)
+    df['query'] = log.groupby('query_id')['query'].first()
+
+    return df
+
+
+def query_to_df(query, conn=None, chunksize=500000, memory_budget=None, decode=None,
+                sample=None, backend=None, profile=False, slow_seconds=SLOW_QUERY_SECONDS,
+                slow_log=None):
+
+    """
+    Get SQL queries into DataFrames
+
+    Parameters
+    ----------
+    query : str
+        SQL query
+
+    conn : sqlite3.Connection (optional)
+        Connection object that represents the database, DATABASE is opened
+        and closed again if None
+
+    chunksize : int (optimal)
+        Chunksize of read_sql_query function, ignored if memory_budget is given
+
+    memory_budget : int or str (optional)
+        Memory allowed for each pulled chunk and its conversion, for example
+        '2GB'. The chunksize is measured on the first chunk and adapted to the budget
+
+    decode : bool (optional)
+        if True, UniqueCarrier, TailNum, Origin and Dest integer ids of an encoded
+        database are returned as categorical codes. Detected from the database if None.
+        On an encoded database the codes compared or joined as text in query are
+        translated to ids, see dictionary.translate_query
+
+    sample : float or str (optional)
+        Sampling rate or name of a sample table created by sampling.create_samples.
+        The query runs against the sample instead of data table and the weight
+        column is added, see sampling.weighted_counts to scale counts
+
+    backend : SQLiteBackend or DuckDBBackend (optional)
+        Backend of backends module that runs the query instead of conn
+
+    profile : bool (optional)
+        if True, the profile of the query is stored in df.attrs['query_profile']:
+        EXPLAIN QUERY PLAN, seconds spent in SQLite (engine_seconds) and in
+        Python building the chunks, decoding, optimizing dtypes and concatenating,
+        rows and bytes per second and peak RSS. SQLite is then read with
+        chunking.iter_query, the other paths only time the whole fetch
+
+    slow_seconds : float (optional)
+        Queries taking longer are appended with their profile to slow_log,
+        never if None
+
+    slow_log : str (optional)
+        Complete filepath of the slow-query log, for example SLOW_QUERY_LOG,
+        see compare_slow_queries. Nothing is logged if None
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with column optimized column types
+
+    """
+
+    opened = backend is None and conn is None
+    if opened:
+        conn = connect_database()
+
+    if backend is None:
+        c = conn.cursor()
+
+    encoded = dictionary.is_encoded(conn) if backend is None else backend.is_encoded()
+    if decode is None:
+        decode = encoded
+    if decode or encoded:
+        codes = dictionary.load_codes(conn) if backend is None else backend.load_codes()
+    else:
+        codes = None
+
+    if sample is not None:
+        query = sampling.sample_query(query, sample)
+
+    # Codes compared or joined as text are translated to the ids of the encoded layout
+    if encoded:
+        query = dictionary.translate_query(query, codes)
+    if not decode:
+        codes = None
+    
+    df = pd.DataFrame()
+    chunk = pd.DataFrame()
+    timings = {}
+    chunks = 0
+    rss_start = instrument.current_rss_mb()
+
+    with instrument.span('query_to_df') as query_span:
+
+        if backend is not None:
+            reader = backend.iter_query(query, chunksize=chunksize, memory_budget=memory_budget)
+        elif profile:
+            # Own fetch loop, to time SQLite apart from building the chunks
+            sizer = chunksize if memory_budget is None else chunking.ChunkSizer(memory_budget)
+            reader = chunking.iter_query(query, conn, sizer, timings)
+        elif memory_budget is None:
+            reader = pd.read_sql_query(sql=query, con=conn, chunksize=chunksize)
+        else:
+            reader = chunking.iter_query(query, conn, chunking.ChunkSizer(memory_budget))
+
+        for number, chunk in enumerate(_timed(reader, timings)):
+
+            with instrument.span('chunk', number=number, chunksize=len(chunk)) as span:
+
+                span.add(rows=len(chunk))
+                with _timer(timings, 'decode'):
+                    if codes is not None:
+                        chunk = dictionary.decode_chunk(chunk, codes)
+                with _timer(timings, 'dtypes'):
+                    chunk = chunk_preprocessing_numpy(chunk)
+                with _timer(timings, 'concat'):
+                    df = pd.concat([df, chunk])
+                    del chunk
+                with _timer(timings, 'dtypes'):
+                    df = df_processing_cat(df)
+                chunks += 1
+
+    slow = slow_log is not None and slow_seconds is not None and query_span.seconds >= slow_seconds
+    if profile or slow:
+        plan = explain_query(query, conn, backend)
+        record = _query_profile(query, df, timings, query_span.seconds, chunks,
+                                (rss_start, query_span.peak_rss), plan, conn, backend)
+        if slow:
+            log_slow_query(record, slow_log)
+        if profile:
+            df.attrs['query_profile'] = record
+
+    if backend is None:
+        c.close()
+        conn.commit()
+    if opened:
+        conn.close()
+        
+    return df
+
+def query_to_df_opt(query, conn, chunksize=500000):
+
+    """
+    Get SQL queries into DataFrames
+
+    Parameters
+    ----------
+    query : str
+        SQL query
+
+    chunksize : int (optimal)
+        Chunksize of read_sql_query function
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        df DataFrame with column optimized column types
+
+    """
+    
+    df = pd.DataFrame()
+    chunk = pd.DataFrame()
+
+    for chunk in pd.read_sql_query(sql=query, con=conn, chunksize=chunksize):
+
+        df = pd.concat([df, chunk_preprocessing_numpy(chunk)])
+        del chunk
+        df = df_processing_cat_opt(df)
+        
+    return df
@@ -0,0 +1,336 @@
+# Import packages
+import re
+import warnings
+import pandas as pd
+import numpy as np
+from statistics import NormalDist
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+############### Packages to build and query stratified sample tables ###############
+####################################################################################
+####################################################################################
+
+# Default sampling rates: 0.1% and 1% of the flights
+SAMPLE_RATES = (0.001, 0.01)
+
+# Default strata: every airport of every year keeps its share of the sample
+STRATA = ('Year', 'Origin')
+
+# Smallest sample of a stratum, so small airports are not left out
+MIN_STRATUM_ROWS = 10
+
+# Relative excess of the effective rate over the nominal one that is warned about
+RATE_TOLERANCE = 0.1
+
+_TABLE = re.compile(r"\b(FROM|JOIN)\s+data\b(\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_SELECT = re.compile(r"^\s*SELECT\s+(DISTINCT\s+)?", re.IGNORECASE)
+_KEYWORDS = {'WHERE', 'LEFT', 'RIGHT', 'FULL', 'INNER', 'OUTER', 'CROSS', 'JOIN', 'ON', 'USING',
+             'GROUP', 'ORDER', 'LIMIT', 'OFFSET', 'UNION', 'EXCEPT', 'INTERSECT', 'NATURAL', 'HAVING',
+             'WINDOW', 'INDEXED', 'NOT', 'RETURNING'}
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SUBQUERY = re.compile(r"\(\s*SELECT\b|\bWITH\b", re.IGNORECASE)
+_SET_OPERATION = re.compile(r"\b(?:UNION|EXCEPT|INTERSECT)\b", re.IGNORECASE)
+
+
+def sample_table(rate):
+
+    """
+    Get the table name of a sample, for example data_sample_0_1pct for 0.1%
+
+    Parameters
+    ----------
+    rate : float
+        Sampling rate between 0 and 1
+
+    Returns
+    ----------
+    name : str
+        Name of the sample table
+
+    """
+
+    return 'data_sample_' + '{:g}'.format(rate*100).replace('.', '_') + 'pct'
+
+
+def _uniform(ids, seed):
+
+    """
+    Map row ids to reproducible uniform numbers in [0, 1) with the splitmix64 hash
+    """
+
+    with np.errstate(over='ignore'):
+        z = ids.astype(np.uint64) + np.uint64(seed)*np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+
+    return (z >> np.uint64(11)).astype(np.float64)/2.0**53
+
+
+def create_samples(conn, rates=SAMPLE_RATES, strata=STRATA, seed=0, min_rows=MIN_STRATUM_ROWS,
+                   chunksize=1000000):
+
+    """
+    Create persistent stratified samples of data table, one table per rate.
+
+    Each stratum is sampled at max(rate, min_rows/rows of the stratum), with
+    the same hash of Id for every rate, so the smaller samples are subsets
+    of the larger ones. The weight column holds the rows of the stratum
+    divided by its sampled rows, so weighted counts estimate full counts.
+    The samples are listed in the samples table.
+
+    min_rows raises the rate of the small strata, so with many of them the
+    sample holds more rows than the nominal rate gives: the effective rate,
+    sampled rows over the rows of data, is stored and returned for every
+    sample, and a warning is issued when the strata push it more than
+    RATE_TOLERANCE above the nominal rate.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    rates : tuple of float (optional)
+        Sampling rates between 0 and 1
+    strata : tuple of str (optional)
+        Columns of data table defining the strata
+    seed : int (optional)
+        Seed of the row hash
+    min_rows : int (optional)
+        Smallest sample of a stratum, whole stratum if smaller
+    chunksize : int (optional)
+        Rows of data table hashed at once
+
+    Returns
+    ----------
+    samples : pandas.DataFrame
+        Table, rate, effective_rate and rows of each sample
+
+    """
+
+    strata = list(strata)
+    columns = ', '.join(strata)
+    c = conn.cursor()
+
+    with instrument.span('create_samples', rates=list(rates)):
+
+        with instrument.span('strata'):
+            sizes = pd.read_sql_query('SELECT {0}, COUNT(*) AS n FROM data GROUP BY {0}'.format(columns), conn)
+            sizes['stratum'] = np.arange(len(sizes))
+            stratum_index = pd.MultiIndex.from_frame(sizes[strata])
+
+        # Rate of each stratum for every sample
+        probabilities = {rate: np.minimum(1.0, np.maximum(rate, min_rows/sizes.n.values)) for rate in rates}
+        selected = {rate: [] for rate in rates}
+
+        with instrument.span('select'):
+            c.execute('SELECT Id, {} FROM data'.format(columns))
+
+            while True:
+                records = c.fetchmany(chunksize)
+                if not records:
+                    break
+
+                with instrument.span('chunk') as span:
+                    chunk = pd.DataFrame.from_records(records, columns=['Id'] + strata)
+                    del records
+
+                    ids = chunk.Id.values
+                    stratum = stratum_index.get_indexer(pd.MultiIndex.from_frame(chunk[strata]))
+                    u = _uniform(ids, seed)
+
+                    for rate in rates:
+                        keep = u < probabilities[rate][stratum]
+                        selected[rate].append(pd.DataFrame({'Id': ids[keep], 'stratum': stratum[keep]}))
+
+                    span.add(rows=len(chunk))
+
+        c.execute("""CREATE TABLE IF NOT EXISTS samples (name TEXT PRIMARY KEY,
+                                                        rate REAL,
+                                                        strata TEXT,
+                                                        seed INTEGER,
+                                                        rows INTEGER,
+                                                        source_rows INTEGER,
+                                                        effective_rate REAL)""")
+        # samples tables created before effective_rate was recorded
+        if 'effective_rate' not in {row[1] for row in c.execute('PRAGMA table_info(samples)')}:
+            c.execute('ALTER TABLE samples ADD COLUMN effective_rate REAL')
+
+        source_rows = int(sizes.n.sum())
+
+        records = []
+
+        for rate in rates:
+            name = sample_table(rate)
+
+            expected = (probabilities[rate]*sizes.n.values).sum()/source_rows
+            if expected > rate*(1 + RATE_TOLERANCE):
+                warnings.warn('{} samples about {:.3%} of the flights instead of {:.3%}: min_rows={} keeps '
+                              'more rows of the small strata'.format(name, expected, rate, min_rows), stacklevel=2)
+
+            with instrument.span('sample_table', table=name) as span:
+                ids = pd.concat(selected.pop(rate), ignore_index=True)
+
+                # Post-stratified weights: stratum rows over sampled rows
+                sampled = np.bincount(ids.stratum.values, minlength=len(sizes))
+                weights = sizes.n.values/np.maximum(sampled, 1)
+                ids['weight'] = weights[ids.stratum.values]
+
+                c.execute('DROP TABLE IF EXISTS temp.sample_ids')
+                c.execute('CREATE TEMP TABLE sample_ids (Id INTEGER PRIMARY KEY, weight REAL)')
+                c.executemany('INSERT INTO sample_ids VALUES (?, ?)',
+                              zip(ids.Id.tolist(), ids.weight.tolist()))
+
+                c.execute('DROP TABLE IF EXISTS {}'.format(name))
+                c.execute("""CREATE TABLE {} AS
+                                  SELECT data.*, sample_ids.weight AS weight
+                                    FROM sample_ids
+                                    JOIN data ON data.Id = sample_ids.Id""".format(name))
+                c.execute('CREATE INDEX IF NOT EXISTS {0}_date ON {0}(Date)'.format(name))
+                c.execute('DROP TABLE temp.sample_ids')
+
+                effective_rate = len(ids)/source_rows
+                c.execute("""INSERT OR REPLACE INTO samples (name, rate, strata, seed, rows, source_rows, effective_rate)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                          (name, rate, columns, seed, len(ids), source_rows, effective_rate))
+                conn.commit()
+
+                span.add(rows=len(ids))
+                records.append({'table': name, 'rate': rate, 'effective_rate': effective_rate, 'rows': len(ids)})
+
+    c.close()
+
+    return pd.DataFrame(records)
+
+
+def sample_query(query, sample):
+
+    """
+    Rewrite a query on data table to run against a sample table.
+
+    data is replaced by the sample table under the same name, so column
+    references such as data.Origin keep working, and the weight column of
+    the sample is added to the SELECT. Aggregates computed in SQL are not
+    scaled, pull rows and use weighted_counts instead. Only one SELECT
+    reading data in its FROM clause can be rewritten: subqueries, WITH and
+    set operations raise a ValueError.
+
+    Parameters
+    ----------
+    query : str
+        SQL query on data table
+    sample : float or str
+        Sampling rate of a table created by create_samples, or its name
+
+    Returns
+    ----------
+    query : str
+        SQL query on the sample table
+
+    """
+
+    table = sample if isinstance(sample, str) else sample_table(sample)
+
+    # Blank the string literals, at the same positions, before matching
+    masked = _STRING.sub(lambda match: "'" + ' '*(len(match.group()) - 2) + "'", query)
+
+    for pattern, form in [(_SUBQUERY, 'subqueries'), (_SET_OPERATION, 'set operations')]:
+        match = pattern.search(masked)
+        if match:
+            raise ValueError('sample_query rewrites one SELECT on data table, {} are not supported: '
+                             'near {!r}'.format(form, query[match.start():match.end() + 20]))
+
+    matches = list(_TABLE.finditer(masked))
+    if not matches:
+        raise ValueError('the query does not read data table in its FROM clause')
+
+    aliases = []
+    parts = []
+    end = 0
+    for match in matches:
+        alias = match.group(3)
+        if alias is None or alias.upper() in _KEYWORDS:
+            aliases.append('data')
+            replacement = '{} {} AS data{}'.format(match.group(1), table, match.group(2) or '')
+        else:
+            aliases.append(alias)
+            replacement = '{} {} AS {}'.format(match.group(1), table, alias)
+        parts += [query[end:match.start()], replacement]
+        end = match.end()
+    query = ''.join(parts) + query[end:]
+
+    if not re.search(r'\bweight\b', masked[:matches[0].start()], re.IGNORECASE):
+        query = _SELECT.sub(lambda match: match.group(0) + '{}.weight AS weight, '.format(aliases[0]),
+                            query, count=1)
+
+    return query
+
+
+def weighted_counts(df, by, weight='weight', confidence=0.95):
+
+    """
+    Estimate the flights of each group with a confidence interval. Rows of
+    a sample count their weight and the variance is the Horvitz-Thompson
+    estimate sum(weight*(weight - 1)). A DataFrame without weight column
+    gives exact counts with an empty interval, so the same cell works on
+    the full table and on a sample.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Result of query_to_df, with a weight column in sample mode
+    by : str or list of str
+        Columns of the groups
+    weight : str (optional)
+        Name of the weight column
+    confidence : float (optional)
+        Confidence level of the interval
+
+    Returns
+    ----------
+    counts : pandas.DataFrame
+        count, stderr, lower and upper of each group, in descending order of count
+
+    """
+
+    if weight in df.columns:
+        w = df[weight].values.astype(np.float64)
+    else:
+        w = np.ones(len(df))
+
+    frame = pd.DataFrame({'count': w, 'variance': w*(w - 1)}, index=df.index)
+    grouped = frame.groupby([df[column] for column in np.atleast_1d(by)], observed=True).sum()
+
+    z = NormalDist().inv_cdf(0.5 + confidence/2)
+    grouped['stderr'] = np.sqrt(grouped.pop('variance'))
+    grouped['lower'] = np.maximum(grouped['count'] - z*grouped['stderr'], 0)
+    grouped['upper'] = grouped['count'] + z*grouped['stderr']
+
+    return grouped.sort_values('count', ascending=False)
+
+
+def weighted_value_counts(series, weights=None):
+
+    """
+    Weighted version of Series.value_counts, exact counts if weights is None
+
+    Parameters
+    ----------
+    series : pandas.Series
+        Values to be counted
+    weights : pandas.Series (optional)
+        Weight of each value, for example df.weight in sample mode
+
+    Returns
+    ----------
+    counts : pandas.Series
+        Estimated count of each value, in descending order
+
+    """
+
+    if weights is None:
+        return series.value_counts()
+
+    return weights.groupby(series, observed=True).sum().sort_values(ascending=False)
@@ -0,0 +1,1238 @@
+# Import packages
+import os
+import copy
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+
+from jupyterworkflow import instrument
+
+####################################################################################
+####################################################################################
+################## Packages to sketch delay distributions in one pass ##############
+####################################################################################
+####################################################################################
+
+# Delay columns of raw_data table with a quantile sketch
+DELAY_COLUMNS = ['ArrDelay', 'DepDelay', 'TaxiIn', 'TaxiOut',
+                 'CarrierDelay', 'WeatherDelay', 'NASDelay', 'SecurityDelay', 'LateAircraftDelay']
+
+# Delay cause columns, reported from 2003 on
+CAUSE_COLUMNS = ['CarrierDelay', 'WeatherDelay', 'NASDelay', 'SecurityDelay', 'LateAircraftDelay']
+
+# Default groups: carrier, departure airport and month of the year
+GROUP_BY = ['UniqueCarrier', 'Origin', 'Month']
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def compress_groups(means, weights, groups, compression):
+
+    """
+    Merge the centroids of many sketches at once with the k1 scale function.
+    Centroids of the same group sharing the same integer part of k(q) are
+    merged. As k is steep at the tails, the centroids there stay small
+
+    Parameters
+    ----------
+    means : numpy.ndarray
+        Means of the centroids, or values
+    weights : numpy.ndarray
+        Weights of the centroids
+    groups : numpy.ndarray of int
+        Sketch of each centroid
+    compression : int
+        Accuracy of the sketches
+
+    Returns
+    ----------
+    means : numpy.ndarray
+        Means of the merged centroids, sorted by group and mean
+    weights : numpy.ndarray
+        Weights of the merged centroids
+    groups : numpy.ndarray of int
+        Sketch of each merged centroid
+
+    """
+
+    order = np.lexsort((means, groups))
+    means, weights, groups = means[order], weights[order], groups[order]
+
+    # Weight before each group and weight of each group, repeated for its centroids
+    first = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    sizes = np.diff(np.r_[first, len(groups)])
+    cumulative = np.cumsum(weights)
+    before = np.repeat(cumulative[first] - weights[first], sizes)
+    totals = np.repeat(np.add.reduceat(weights, first), sizes)
+
+    q = (cumulative - before - weights/2)/totals
+    k = compression/(2*np.pi)*np.arcsin(2*q - 1)
+    cell = np.floor(k - np.repeat(k[first], sizes)).astype(np.int64)
+
+    starts = np.r_[0, np.flatnonzero((np.diff(groups) != 0) | (np.diff(cell) != 0)) + 1]
+    merged = np.add.reduceat(weights, starts)
+
+    return np.add.reduceat(means*weights, starts)/merged, merged, groups[starts]
+
+
+class TDigest:
+
+    """
+    Mergeable quantile sketch (merging t-digest).
+
+    Values are buffered and merged into at most about compression/2
+    centroids, small at the tails and large around the median, so extreme
+    quantiles such as p99 keep a low rank error in bounded memory.
+
+    Parameters
+    ----------
+    compression : int (optional)
+        Accuracy of the sketch, the number of centroids grows with it
+    buffer_size : int (optional)
+        Values buffered before a merge, 10*compression if None
+
+    """
+
+    def __init__(self, compression=100, buffer_size=None):
+        self.compression = compression
+        self.buffer_size = buffer_size or 10*compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def __len__(self):
+        self._compress()
+        return len(self.means)
+
+    def update(self, values, weights=None):
+
+        """
+        Add values to the sketch
+
+        Parameters
+        ----------
+        values : array-like of float
+            Values to be added, NaN values are ignored
+        weights : array-like of float (optional)
+            Weight of each value, 1 if None
+
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+        valid = ~np.isnan(values)
+        values, weights = values[valid], weights[valid]
+
+        if not len(values):
+            return
+
+        self._buffer.append((values, weights))
+        self._buffered += len(values)
+        self.count += weights.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        if self._buffered >= self.buffer_size:
+            self._compress()
+
+    def _compress(self):
+
+        """
+        Merge the buffer into the centroids with the k1 scale function
+        """
+
+        if not self._buffer:
+            return
+
+        means = np.concatenate([self.means] + [values for values, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [weights for _, weights in self._buffer])
+        self._buffer, self._buffered = [], 0
+
+        self.means, self.weights, _ = compress_groups(means, weights, np.zeros(len(means), dtype=np.int64),
+                                                      self.compression)
+
+    def merge(self, other):
+
+        """
+        Add the centroids of another sketch to this one
+
+        Parameters
+        ----------
+        other : TDigest
+            Sketch to be merged
+
+        Returns
+        ----------
+        self : TDigest
+
+        """
+
+        other._compress()
+
+        if other.count:
+            self._buffer.append((other.means, other.weights))
+            self._buffered += len(other.means)
+            self.count += other.count
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress()
+
+        return self
+
+    def quantile(self, q):
+
+        """
+        Estimate quantiles
+
+        Parameters
+        ----------
+        q : float or array-like of float
+            Quantiles between 0 and 1
+
+        Returns
+        ----------
+        values : float or numpy.ndarray
+            Estimated values, NaN for an empty sketch
+
+        """
+
+        self._compress()
+
+        if not self.count:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+
+        centers = np.cumsum(self.weights) - self.weights/2
+        x = np.r_[0, centers, self.count]
+        y = np.r_[self.min, self.means, self.max]
+
+        return np.interp(np.asarray(q)*self.count, x, y)
+
+    def cdf(self, value):
+
+        """
+        Estimate the share of values lower or equal to value
+        """
+
+        self._compress()
+
+        if not self.count:
+            return np.nan
+
+        centers = np.cumsum(self.weights) - self.weights/2
+        x = np.r_[self.min, self.means, self.max]
+        y = np.r_[0, centers, self.count]
+
+        return np.interp(value, x, y)/self.count
+
+
+class _GroupedDigests:
+
+    """
+    TDigest of every group of one delay column, in flat arrays. A chunk is
+    merged into the centroids of all its groups with one compress_groups,
+    so no values stay buffered between chunks and memory is bounded by the
+    centroids, about compression/2 per group
+    """
+
+    def __init__(self, compression):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.groups = np.empty(0, dtype=np.int64)
+        self.count = np.empty(0)
+        self.min = np.empty(0)
+        self.max = np.empty(0)
+
+    def _grow(self, size):
+        extra = size - len(self.count)
+        if extra > 0:
+            self.count = np.r_[self.count, np.zeros(extra)]
+            self.min = np.r_[self.min, np.full(extra, np.inf)]
+            self.max = np.r_[self.max, np.full(extra, -np.inf)]
+
+    def add(self, groups, means, weights, low, high, size):
+
+        """
+        Merge centroids or values of some groups, with the lowest and highest
+        value of each of them, into the sketches of groups 0 to size-1
+        """
+
+        self._grow(size)
+
+        present = np.zeros(size, dtype=bool)
+        present[groups] = True
+        merged = present[self.groups]
+
+        self.count += np.bincount(groups, weights, minlength=size)
+        np.minimum.at(self.min, groups, low)
+        np.maximum.at(self.max, groups, high)
+
+        means, weights, groups = compress_groups(np.r_[self.means[merged], means],
+                                                 np.r_[self.weights[merged], weights],
+                                                 np.r_[self.groups[merged], groups], self.compression)
+
+        self.means = np.r_[self.means[~merged], means]
+        self.weights = np.r_[self.weights[~merged], weights]
+        self.groups = np.r_[self.groups[~merged], groups]
+
+    def digests(self):
+
+        """
+        Get one TDigest per group with values
+        """
+
+        order = np.argsort(self.groups, kind='stable')
+        groups = self.groups[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1, len(groups)]
+
+        digests = {}
+        for start, end in zip(starts[:-1], starts[1:]):
+            group = groups[start]
+            digest = TDigest(self.compression)
+            digest.means = self.means[order[start:end]]
+            digest.weights = self.weights[order[start:end]]
+            digest.count = self.count[group]
+            digest.min, digest.max = self.min[group], self.max[group]
+            digests[group] = digest
+
+        return digests
+
+
+class DelaySketches:
+
+    """
+    Quantile sketches of the delay columns per group, for example per
+    (carrier, airport, month), and exact sums of the delay causes.
+
+    Built in one pass over chunks of the csv files or of raw_data table
+    with update(), merged across passes or processes with merge(), and
+    persisted with save() and load(). The sketches of a column are kept in
+    flat arrays and updated for all the groups of a chunk at once.
+
+    Parameters
+    ----------
+    group_by : list of str (optional)
+        Columns of the groups
+    columns : list of str (optional)
+        Delay columns with a sketch
+    compression : int (optional)
+        Accuracy of each TDigest
+
+    """
+
+    def __init__(self, group_by=GROUP_BY, columns=DELAY_COLUMNS, compression=100):
+        self.group_by = list(group_by)
+        self.columns = list(columns)
+        self.compression = compression
+        self.causes = pd.DataFrame()
+        self._keys = []
+        self._key_ids = {}
+        self._sketches = {}
+        self._digests = None
+
+    def _ids(self, keys):
+
+        """
+        Get the ids of group keys, new keys get the next ids
+        """
+
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            key_id = self._key_ids.get(key)
+            if key_id is None:
+                key_id = self._key_ids[key] = len(self._keys)
+                self._keys.append(key)
+            ids[i] = key_id
+        return ids
+
+    def _grouped(self, column):
+        if column not in self._sketches:
+            self._sketches[column] = _GroupedDigests(self.compression)
+        self._digests = None
+        return self._sketches[column]
+
+    @property
+    def digests(self):
+
+        """
+        TDigest of every (group key, column), built from the flat arrays
+        """
+
+        if self._digests is None:
+            self._digests = {(self._keys[group], column): digest
+                             for column, grouped in self._sketches.items()
+                             for group, digest in grouped.digests().items()}
+        return self._digests
+
+    def update(self, chunk):
+
+        """
+        Add a chunk of flights to the sketches
+
+        Parameters
+        ----------
+        chunk : pandas.DataFrame
+            Flights with the group_by and delay columns
+
+        """
+
+        # Flights with a missing group value are not sketched, as in a groupby
+        keyed = chunk[self.group_by].notna().all(axis=1).values
+        codes, keys = pd.MultiIndex.from_frame(chunk.loc[keyed, self.group_by]).factorize()
+        ids = np.full(len(chunk), -1, dtype=np.int64)
+        ids[keyed] = self._ids(list(keys))[codes]
+
+        for column in self.columns:
+
+            if column not in chunk.columns:
+                continue
+
+            values = chunk[column].values.astype(np.float64)
+            valid = keyed & ~np.isnan(values)
+            if not valid.any():
+                continue
+
+            values = values[valid]
+            self._grouped(column).add(ids[valid], values, np.ones(len(values)), values, values, len(self._keys))
+
+        causes = [column for column in CAUSE_COLUMNS if column in chunk.columns]
+        if causes:
+            reported = chunk.dropna(subset=causes, how='all')
+            if len(reported):
+                sums = reported.groupby(self.group_by, observed=True)[causes].sum()
+                sums['flights'] = reported.groupby(self.group_by, observed=True).size()
+                self.causes = sums if self.causes.empty else self.causes.add(sums, fill_value=0)
+
+    def merge(self, other):
+
+        """
+        Merge sketches built over other chunks with the same group_by
+
+        Parameters
+        ----------
+        other : DelaySketches
+            Sketches to be merged
+
+        Returns
+        ----------
+        self : DelaySketches
+
+        """
+
+        ids = self._ids(other._keys)
+
+        for column, grouped in other._sketches.items():
+            if not len(grouped.groups):
+                continue
+            groups = ids[grouped.groups]
+            self._grouped(column).add(groups, grouped.means, grouped.weights,
+                                      grouped.min[grouped.groups], grouped.max[grouped.groups], len(self._keys))
+
+        if not other.causes.empty:
+            self.causes = other.causes.copy() if self.causes.empty else self.causes.add(other.causes, fill_value=0)
+
+        return self
+
+    def digest(self, column, **filters):
+
+        """
+        Get the sketch of a column for the groups matching the filters, for
+        example digest('ArrDelay', UniqueCarrier='AA') merges every airport
+        and month of American Airlines
+
+        Parameters
+        ----------
+        column : str
+            Delay column
+        filters : dict (optional)
+            Values of group_by columns
+
+        Returns
+        ----------
+        digest : TDigest
+
+        """
+
+        positions = [(self.group_by.index(name), value) for name, value in filters.items()]
+        merged = TDigest(self.compression)
+        grouped = self._sketches.get(column)
+
+        if grouped is None:
+            return merged
+
+        selected = np.array([all(key[position] == value for position, value in positions)
+                             for key in self._keys[:len(grouped.count)]], dtype=bool)
+        selected &= grouped.count > 0
+
+        if selected.any():
+            centroids = selected[grouped.groups]
+            merged._buffer.append((grouped.means[centroids], grouped.weights[centroids]))
+            merged.count = grouped.count[selected].sum()
+            merged.min, merged.max = grouped.min[selected].min(), grouped.max[selected].max()
+
+        return merged
+
+    def quantiles(self, column, q=QUANTILES, **filters):
+
+        """
+        Get the quantiles of a column for the groups matching the filters
+
+        Parameters
+        ----------
+        column : str
+            Delay column
+        q : tuple of float (optional)
+            Quantiles between 0 and 1
+        filters : dict (optional)
+            Values of group_by columns
+
+        Returns
+        ----------
+        quantiles : pandas.Series
+            Values indexed by p50, p90, ...
+
+        """
+
+        return pd.Series(self.digest(column, **filters).quantile(q),
+                         index=['p{:g}'.format(100*value) for value in q])
+
+    def percentiles(self, column, q=QUANTILES):
+
+        """
+        Get the quantiles of a column for every group
+
+        Parameters
+        ----------
+        column : str
+            Delay column
+        q : tuple of float (optional)
+            Quantiles between 0 and 1
+
+        Returns
+        ----------
+        df : pandas.DataFrame
+            One row per group, with its flights count and one column per quantile
+
+        """
+
+        keys, rows = [], []
+
+        for (key, key_column), digest in self.digests.items():
+            if key_column == column:
+                keys.append(key)
+                rows.append(np.r_[digest.count, digest.quantile(q)])
+
+        columns = ['count'] + ['p{:g}'.format(100*value) for value in q]
+        index = pd.MultiIndex.from_tuples(keys, names=self.group_by) if keys else None
+
+        return pd.DataFrame(rows, index=index, columns=columns).sort_index()
+
+    def save(self, filepath):
+
+        """
+        Write the sketches to a compressed numpy file
+
+        Parameters
+        ----------
+        filepath : str
+            Complete filepath of the .npz file
+
+        """
+
+        items = list(self.digests.items())
+        for _, digest in items:
+            digest._compress()
+
+        arrays = {'group_by': np.array(self.group_by),
+                  'columns': np.array(self.columns),
+                  'compression': np.array(self.compression),
+                  'column': np.array([column for (_, column), _ in items]),
+                  'sizes': np.array([len(digest.means) for _, digest in items], dtype=np.int64),
+                  'count': np.array([digest.count for _, digest in items]),
+                  'min': np.array([digest.min for _, digest in items]),
+                  'max': np.array([digest.max for _, digest in items]),
+                  'means': np.concatenate([digest.means for _, digest in items] or [np.empty(0)]),
+                  'weights': np.concatenate([digest.weights for _, digest in items] or [np.empty(0)])}
+
+        for position, name in enumerate(self.group_by):
+            arrays['key_' + name] = np.array([str(key[position]) for (key, _), _ in items])
+
+        causes = self.causes.reset_index()
+        for name in causes.columns:
+            values = np.asarray(causes[name])
+            arrays['causes_' + name] = values.astype(str) if values.dtype.kind in 'OU' else values
+
+        np.savez_compressed(filepath, **arrays)
+
+    @classmethod
+    def load(cls, filepath):
+
+        """
+        Read sketches written by save
+
+        Parameters
+        ----------
+        filepath : str
+            Complete filepath of the .npz file
+
+        Returns
+        ----------
+        sketches : DelaySketches
+
+        """
+
+        with np.load(filepath) as arrays:
+            arrays = dict(arrays)
+
+        sketches = cls(arrays['group_by'].tolist(), arrays['columns'].tolist(), int(arrays['compression']))
+        levels = [_restore(arrays['key_' + name]) for name in sketches.group_by]
+        columns = arrays['column']
+        ids = sketches._ids([tuple(level[i] for level in levels) for i in range(len(columns))])
+        groups = np.repeat(ids, arrays['sizes'])
+
+        for column in pd.unique(columns):
+            rows = columns == column
+            centroids = np.repeat(rows, arrays['sizes'])
+            grouped = sketches._grouped(str(column))
+            grouped._grow(len(sketches._keys))
+            grouped.means = arrays['means'][centroids]
+            grouped.weights = arrays['weights'][centroids]
+            grouped.groups = groups[centroids]
+            grouped.count[ids[rows]] = arrays['count'][rows]
+            grouped.min[ids[rows]] = arrays['min'][rows]
+            grouped.max[ids[rows]] = arrays['max'][rows]
+
+        causes = {name[len('causes_'):]: values for name, values in arrays.items() if name.startswith('causes_')}
+        if causes:
+            causes = pd.DataFrame(causes)
+            for name in sketches.group_by:
+                causes[name] = _restore(causes[name].values)
+            sketches.causes = causes.set_index(sketches.group_by)
+
+        return sketches
+
+
+def _restore(values):
+
+    """
+    Convert saved key strings back to int where every value is an integer
+    """
+
+    values = np.asarray(values).astype(str)
+    if len(values) and np.char.isdigit(values).all():
+        return values.astype(np.int64).tolist()
+    return values.tolist()
+
+
+def sketch_csv(start_year=1987, last_year=2008, group_by=GROUP_BY, columns=DELAY_COLUMNS,
+               compression=100, chunksize=1000000, encoding='latin-1'):
+
+    """
+    Build DelaySketches in one pass over the yearly csv files of source folder
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First csv file year
+    last_year : int (optional)
+        Last csv file year
+    group_by : list of str (optional)
+        Columns of the groups
+    columns : list of str (optional)
+        Delay columns with a sketch
+    compression : int (optional)
+        Accuracy of each TDigest
+    chunksize : int (optional)
+        Chunksize of read_csv function
+    encoding : str (optional)
+        Encoding of csv files
+
+    Returns
+    ----------
+    sketches : DelaySketches
+
+    """
+
+    sketches = DelaySketches(group_by, columns, compression)
+
+    with instrument.span('sketch_csv', start_year=start_year, last_year=last_year):
+        for year in range(start_year, last_year+1):
+            with instrument.span('csv_file', year=year):
+                for chunk in pd.read_csv('source/{}.csv'.format(year), chunksize=chunksize,
+                                         usecols=list(group_by) + list(columns), encoding=encoding):
+                    with instrument.span('chunk') as span:
+                        sketches.update(chunk)
+                        span.add(rows=len(chunk))
+
+    return sketches
+
+
+def sketch_table(conn, table='raw_data', where='', group_by=GROUP_BY, columns=DELAY_COLUMNS,
+                 compression=100, chunksize=1000000):
+
+    """
+    Build DelaySketches in one pass over a table of the database
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection object that represents the database
+    table : str (optional)
+        Table with the group_by and delay columns
+    where : str (optional)
+        WHERE clause of the scan, for example "WHERE Year = 2008"
+    group_by : list of str (optional)
+        Columns of the groups
+    columns : list of str (optional)
+        Delay columns with a sketch
+    compression : int (optional)
+        Accuracy of each TDigest
+    chunksize : int (optional)
+        Chunksize of read_sql_query function
+
+    Returns
+    ----------
+    sketches : DelaySketches
+
+    """
+
+    sketches = DelaySketches(group_by, columns, compression)
+    query = 'SELECT {} FROM {} {}'.format(', '.join(list(group_by) + list(columns)), table, where)
+
+    with instrument.span('sketch_table', table=table):
+        for chunk in pd.read_sql_query(query, conn, chunksize=chunksize):
+            with instrument.span('chunk') as span:
+                sketches.update(chunk)
+                span.add(rows=len(chunk))
+
+    return sketches
+
+
+def check_error(sketches, df, column, q=QUANTILES, min_count=100):
+
+    """
+    Compare sketch quantiles with exact quantiles of the same flights, for
+    example sketches built by sketch_csv(2008, 2008) against the 2008 csv file
+
+    Parameters
+    ----------
+    sketches : DelaySketches
+        Sketches built over the flights of df
+    df : pandas.DataFrame
+        Flights with the group_by columns and column
+    column : str
+        Delay column
+    q : tuple of float (optional)
+        Quantiles between 0 and 1
+    min_count : int (optional)
+        Smallest group compared
+
+    Returns
+    ----------
+    error : pandas.DataFrame
+        Per quantile: groups compared, mean and max rank error (share of
+        flights between the exact and the estimated value) and mean absolute
+        error in minutes
+
+    """
+
+    records = []
+    groups = df.dropna(subset=[column]).groupby(sketches.group_by, observed=True)[column]
+
+    for key, values in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        if len(values) < min_count or (key, column) not in sketches.digests:
+            continue
+
+        values = np.sort(values.values.astype(np.float64))
+        estimate = sketches.digests[(key, column)].quantile(q)
+        exact = np.quantile(values, q)
+
+        # Rank error: where the estimate falls among the exact values
+        low = np.searchsorted(values, estimate, side='left')/len(values)
+        high = np.searchsorted(values, estimate, side='right')/len(values)
+        rank_error = np.where(np.asarray(q) < low, low - np.asarray(q),
+                              np.where(np.asarray(q) > high, np.asarray(q) - high, 0))
+
+        for i, value in enumerate(q):
+            records.append({'q': value, 'rank_error': rank_error[i],
+                            'abs_error': abs(estimate[i] - exact[i])})
+
+    if not records:
+        return pd.DataFrame(columns=['groups', 'mean_rank_error', 'max_rank_error', 'mean_abs_error'])
+
+    records = pd.DataFrame(records)
+
+    return records.groupby('q').agg(groups=('rank_error', 'size'),
+                                    mean_rank_error=('rank_error', 'mean'),
+                                    max_rank_error=('rank_error', 'max'),
+                                    mean_abs_error=('abs_error', 'mean'))
+
+
+####################################################################################
+####################################################################################
+############## Packages to count heavy hitters and distinct values in one pass #####
+####################################################################################
+####################################################################################
+
+# Odd 64 bit multipliers of the multiply-shift hash of each sketch row
+_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                         0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53,
+                         0x94D049BB133111EB, 0xBF58476D1CE4E5B9], dtype=np.uint64)
+
+
+def hash_keys(keys):
+
+    """
+    Hash keys to uint64, with the same result in every process
+
+    Parameters
+    ----------
+    keys : array-like
+        Keys, for example airport codes or 'ORD-ATL' routes
+
+    Returns
+    ----------
+    hashes : numpy.ndarray of uint64
+
+    """
+
+    return pd.util.hash_array(np.asarray(keys, dtype=object))
+
+
+class CountMinSketch:
+
+    """
+    Count-min sketch with heavy hitter tracking.
+
+    Counts of any key are over-estimated by at most e/width of the total
+    count with probability 1 - exp(-depth). The keys with the highest
+    estimates are kept as candidates, so top(k) answers top-K questions
+    without a second pass.
+
+    Parameters
+    ----------
+    width : int (optional)
+        Counters per row, rounded up to a power of 2
+    depth : int (optional)
+        Number of rows, at most 8
+    capacity : int (optional)
+        Heavy hitter candidates kept
+
+    """
+
+    def __init__(self, width=2**16, depth=4, capacity=1000):
+        self.bits = int(np.ceil(np.log2(width)))
+        self.width = 2**self.bits
+        self.depth = depth
+        self.capacity = capacity
+        self.table = np.zeros((depth, self.width), dtype=np.int64)
+        self.total = 0
+        self.candidates = {}
+
+    def _columns(self, hashes):
+        shift = np.uint64(64 - self.bits)
+        with np.errstate(over='ignore'):
+            return [((hashes*_MULTIPLIERS[row]) >> shift).astype(np.int64) for row in range(self.depth)]
+
+    def update(self, keys, counts=None):
+
+        """
+        Count keys
+
+        Parameters
+        ----------
+        keys : array-like
+            Keys, repeated keys are counted once per occurrence
+        counts : array-like of int (optional)
+            Count of each key, 1 if None
+
+        """
+
+        keys = pd.Series(np.asarray(keys, dtype=object))
+        if counts is None:
+            grouped = keys.value_counts(sort=False, dropna=True)
+        else:
+            grouped = pd.Series(np.asarray(counts), index=keys.values).groupby(level=0).sum()
+
+        if not len(grouped):
+            return
+
+        unique = grouped.index.values
+        counts = grouped.values.astype(np.int64)
+
+        for row, columns in enumerate(self._columns(hash_keys(unique))):
+            np.add.at(self.table[row], columns, counts)
+        self.total += counts.sum()
+
+        self._track(unique, self.estimate(unique))
+
+    def _track(self, keys, estimates):
+
+        """
+        Keep the keys with the highest estimates as heavy hitter candidates
+        """
+
+        self.candidates.update(zip(keys.tolist(), estimates.tolist()))
+
+        if len(self.candidates) > 2*self.capacity:
+            keep = sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)
+            self.candidates = dict(keep[:self.capacity])
+
+    def estimate(self, keys):
+
+        """
+        Estimate the count of keys
+
+        Parameters
+        ----------
+        keys : array-like
+            Keys
+
+        Returns
+        ----------
+        counts : numpy.ndarray of int64
+
+        """
+
+        columns = self._columns(hash_keys(keys))
+        return np.min([self.table[row][columns[row]] for row in range(self.depth)], axis=0)
+
+    def merge(self, other):
+
+        """
+        Add the counts of a sketch with the same width and depth
+
+        Parameters
+        ----------
+        other : CountMinSketch
+            Sketch to be merged
+
+        Returns
+        ----------
+        self : CountMinSketch
+
+        """
+
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('sketches with different width or depth cannot be merged')
+
+        self.table += other.table
+        self.total += other.total
+
+        keys = np.array(list(set(self.candidates) | set(other.candidates)), dtype=object)
+        self.candidates = {}
+        if len(keys):
+            self._track(keys, self.estimate(keys))
+
+        return self
+
+    def top(self, k=20):
+
+        """
+        Get the heavy hitters
+
+        Parameters
+        ----------
+        k : int (optional)
+            Number of keys
+
+        Returns
+        ----------
+        top : pandas.Series
+            Estimated counts of the k most frequent keys, in descending order
+
+        """
+
+        keys = np.array(list(self.candidates), dtype=object)
+        if not len(keys):
+            return pd.Series([], dtype=np.int64)
+
+        return pd.Series(self.estimate(keys), index=keys).sort_values(ascending=False)[:k]
+
+
+class HyperLogLog:
+
+    """
+    HyperLogLog distinct counter, with a relative standard error of
+    about 1.04/sqrt(2**precision) in 2**precision bytes
+
+    Parameters
+    ----------
+    precision : int (optional)
+        Number of index bits, between 4 and 18
+
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype=np.uint8)
+
+    def update(self, keys):
+
+        """
+        Add keys, NaN keys are ignored
+
+        Parameters
+        ----------
+        keys : array-like
+            Keys
+
+        """
+
+        keys = pd.Series(np.asarray(keys, dtype=object)).dropna().unique()
+        if not len(keys):
+            return
+
+        hashes = hash_keys(keys)
+        p = np.uint64(self.precision)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+
+        # Rank: position of the first 1 bit of the remaining bits, with a
+        # sentinel bit so the rank is at most 64 - precision + 1
+        rest = (hashes << p) | (np.uint64(1) << (p - np.uint64(1)))
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        bit_length = np.where(high > 0,
+                              np.floor(np.log2(np.maximum(high, 1))) + 33,
+                              np.floor(np.log2(np.maximum(low, 1))) + 1)
+        rank = (65 - bit_length).astype(np.uint8)
+
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+
+        """
+        Merge a counter with the same precision
+
+        Parameters
+        ----------
+        other : HyperLogLog
+            Counter to be merged
+
+        Returns
+        ----------
+        self : HyperLogLog
+
+        """
+
+        if self.precision != other.precision:
+            raise ValueError('counters with different precision cannot be merged')
+
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+
+        """
+        Estimate the number of distinct keys
+
+        Returns
+        ----------
+        count : float
+
+        """
+
+        m = len(self.registers)
+        alpha = 0.7213/(1 + 1.079/m)
+        estimate = alpha*m*m/np.sum(2.0**-self.registers.astype(np.float64))
+
+        # Linear counting for small cardinalities
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5*m and zeros:
+            estimate = m*np.log(m/zeros)
+
+        return estimate
+
+
+def _source_file(year, directory):
+
+    """
+    Get the csv file of a year, or its bz2 download when it was not unzipped
+    """
+
+    filepath = os.path.join(directory, '{}.csv'.format(year))
+    return filepath if os.path.exists(filepath) else filepath + '.bz2'
+
+
+def count_year(year, directory='source', chunksize=1000000, width=2**16, depth=4,
+               capacity=1000, precision=12, encoding='latin-1'):
+
+    """
+    Sketch one yearly file in one pass, from the csv or straight from the bz2 download:
+    - routes: CountMinSketch of Origin-Dest pairs
+    - origins: CountMinSketch of Origin airports
+    - tailnums: HyperLogLog of the tail numbers of each carrier
+    - routes_distinct: HyperLogLog of the Origin-Dest pairs
+
+    Parameters
+    ----------
+    year : int
+        Year of the file
+    directory : str (optional)
+        Folder of the yearly files
+    chunksize : int (optional)
+        Chunksize of read_csv function
+    width, depth, capacity : int (optional)
+        Size of the CountMinSketch
+    precision : int (optional)
+        Precision of the HyperLogLog counters
+    encoding : str (optional)
+        Encoding of csv files
+
+    Returns
+    ----------
+    counts : dict
+        Sketches of the year
+
+    """
+
+    counts = {'year': year,
+              'rows': 0,
+              'routes': CountMinSketch(width, depth, capacity),
+              'origins': CountMinSketch(width, depth, capacity),
+              'routes_distinct': HyperLogLog(precision),
+              'tailnums': {}}
+
+    reader = pd.read_csv(_source_file(year, directory), chunksize=chunksize, encoding=encoding,
+                         usecols=['UniqueCarrier', 'TailNum', 'Origin', 'Dest'],
+                         dtype={'UniqueCarrier': str, 'TailNum': str, 'Origin': str, 'Dest': str})
+
+    with instrument.span('count_year', year=year):
+        for chunk in reader:
+            with instrument.span('chunk') as span:
+                routes = (chunk.Origin + '-' + chunk.Dest).values
+                counts['routes'].update(routes)
+                counts['origins'].update(chunk.Origin.values)
+                counts['routes_distinct'].update(routes)
+
+                for carrier, tailnums in chunk.groupby('UniqueCarrier').TailNum:
+                    counts['tailnums'].setdefault(carrier, HyperLogLog(precision)).update(tailnums.values)
+
+                counts['rows'] += len(chunk)
+                span.add(rows=len(chunk))
+
+    return counts
+
+
+def _count_year_args(args):
+    year, kwargs = args
+    return count_year(year, **kwargs)
+
+
+def count_years(start_year=1987, last_year=2008, processes=None, **kwargs):
+
+    """
+    Sketch the yearly files in parallel processes and merge the sketches
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First year
+    last_year : int (optional)
+        Last year
+    processes : int (optional)
+        Number of worker processes, os.cpu_count() if None, no pool if 1
+    kwargs : dict (optional)
+        Arguments of count_year
+
+    Returns
+    ----------
+    years : list of dict
+        Sketches of each year, see count_year
+    total : dict
+        Sketches of all the years merged
+
+    """
+
+    args = [(year, kwargs) for year in range(start_year, last_year+1)]
+
+    with instrument.span('count_years', start_year=start_year, last_year=last_year):
+        if processes == 1:
+            years = [_count_year_args(arg) for arg in args]
+        else:
+            with Pool(processes) as pool:
+                years = pool.map(_count_year_args, args)
+
+        total = {'year': None, 'rows': 0, 'tailnums': {}}
+        for counts in years:
+            for name in ['routes', 'origins', 'routes_distinct']:
+                if name in total:
+                    total[name].merge(counts[name])
+                else:
+                    total[name] = _copy(counts[name])
+            for carrier, hll in counts['tailnums'].items():
+                if carrier in total['tailnums']:
+                    total['tailnums'][carrier].merge(hll)
+                else:
+                    total['tailnums'][carrier] = _copy(hll)
+            total['rows'] += counts['rows']
+
+    return years, total
+
+
+def _copy(sketch):
+    return copy.deepcopy(sketch)
+
+
+def top_routes(years, k=20):
+
+    """
+    Get the top k Origin-Dest pairs of each year
+
+    Parameters
+    ----------
+    years : list of dict
+        Sketches of each year returned by count_years
+    k : int (optional)
+        Number of routes per year
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        Year, Origin, Dest and estimated flights, ordered by year and rank
+
+    """
+
+    frames = []
+
+    for counts in years:
+        top = counts['routes'].top(k)
+        routes = top.index.to_series().str.split('-', expand=True)
+        frames.append(pd.DataFrame({'Year': counts['year'],
+                                    'Origin': routes[0].values if len(top) else [],
+                                    'Dest': routes[1].values if len(top) else [],
+                                    'flights': top.values}))
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def distinct_tailnums(years):
+
+    """
+    Get the estimated number of distinct tail numbers flown by each carrier per year
+
+    Parameters
+    ----------
+    years : list of dict
+        Sketches of each year returned by count_years
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        One row per carrier, one column per year
+
+    """
+
+    records = [{'UniqueCarrier': carrier, 'Year': counts['year'], 'tailnums': hll.count()}
+               for counts in years for carrier, hll in counts['tailnums'].items()]
+
+    if not records:
+        return pd.DataFrame()
+
+    return pd.DataFrame(records).pivot(index='UniqueCarrier', columns='Year', values='tailnums').round()
@@ -0,0 +1,379 @@
+# Import packages
+import pandas as pd
+import numpy as np
+import os
+
+####################################################################################
+####################################################################################
+##################### Packages to generate synthetic flights data ##################
+####################################################################################
+####################################################################################
+
+# Columns of the yearly csv files, in the order of raw_data table
+COLUMNS = ['Year', 'Month', 'DayofMonth', 'DayOfWeek', 'DepTime', 'CRSDepTime',
+           'ArrTime', 'CRSArrTime', 'UniqueCarrier', 'FlightNum', 'TailNum',
+           'ActualElapsedTime', 'CRSElapsedTime', 'AirTime', 'ArrDelay', 'DepDelay',
+           'Origin', 'Dest', 'Distance', 'TaxiIn', 'TaxiOut', 'Cancelled',
+           'CancellationCode', 'Diverted', 'CarrierDelay', 'WeatherDelay', 'NASDelay',
+           'SecurityDelay', 'LateAircraftDelay']
+
+# Hub airports first, the traffic share of each airport follows a Zipf law
+HUBS = ['ORD', 'ATL', 'DFW', 'LAX', 'PHX', 'DEN', 'DTW', 'IAH', 'MSP', 'SFO',
+        'STL', 'EWR', 'LAS', 'CLT', 'LGA', 'BOS', 'PHL', 'PIT', 'SLC', 'SEA']
+
+# Carrier codes and their share of the flights
+CARRIERS = {'AA': ('American Airlines Inc.', 0.16),
+            'DL': ('Delta Air Lines Inc.', 0.16),
+            'UA': ('United Air Lines Inc.', 0.14),
+            'US': ('US Airways Inc.', 0.12),
+            'WN': ('Southwest Airlines Co.', 0.12),
+            'NW': ('Northwest Airlines Inc.', 0.10),
+            'CO': ('Continental Air Lines Inc.', 0.08),
+            'TW': ('Trans World Airways LLC', 0.05),
+            'HP': ('America West Airlines Inc.', 0.04),
+            'AS': ('Alaska Airlines Inc.', 0.03)}
+
+# Number of airports of the synthetic network, as in airports.csv of the report
+N_AIRPORTS = 347
+
+# The real files have no TailNum before 1995 and no delay causes before 2003
+FIRST_TAILNUM_YEAR = 1995
+FIRST_DELAY_CAUSE_YEAR = 2003
+
+CANCELLED_RATE = 0.02
+DIVERTED_RATE = 0.002
+ARR_DELAY_NA_RATE = 0.005
+
+# Rows generated and written at a time
+BLOCK_SIZE = 1000000
+
+
+def airport_codes(n_airports=N_AIRPORTS):
+
+    """
+    Create the iata codes of the synthetic network: the hubs followed by
+    three letter codes that are not hubs
+
+    Parameters
+    ----------
+    n_airports : int (optional)
+        Number of airports
+
+    Returns
+    ----------
+    codes : list of str
+        Airport codes, ordered from the busiest to the quietest
+
+    """
+
+    codes = list(HUBS[:n_airports])
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    i = 0
+
+    while len(codes) < n_airports:
+        code = letters[(i // 676) % 26] + letters[(i // 26) % 26] + letters[i % 26]
+        if code not in HUBS:
+            codes.append(code)
+        i += 1
+
+    return codes
+
+
+def _network(seed):
+
+    """
+    Create the airports, their traffic weights and coordinates
+    """
+
+    rng = np.random.default_rng(seed)
+    codes = airport_codes()
+    weights = 1/np.arange(1, len(codes)+1)**1.1
+    weights = weights/weights.sum()
+    lat = rng.uniform(25, 49, len(codes))
+    long = rng.uniform(-124, -67, len(codes))
+    return np.array(codes), weights, lat, long
+
+
+def _tail_numbers(seed, per_carrier=300):
+
+    """
+    Create the fleet of each carrier
+    """
+
+    tails = {}
+    for i, carrier in enumerate(CARRIERS):
+        tails[carrier] = np.array(['N{}{:03d}{}'.format(i, n, carrier[0]) for n in range(per_carrier)])
+    return tails
+
+
+def _hhmm(minutes):
+    minutes = np.mod(minutes, 24*60)
+    return (minutes // 60)*100 + minutes % 60
+
+
+def generate_block(year, rows, rng, network, tails):
+
+    """
+    Generate one block of flights of a year with the raw csv schema
+
+    Parameters
+    ----------
+    year : int
+        Year of the flights
+    rows : int
+        Number of flights
+    rng : numpy.random.Generator
+        Random generator of the year
+    network : tuple
+        Airport codes, weights, lat and long returned by _network
+    tails : dict
+        Tail numbers of each carrier
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        Flights with the columns of COLUMNS
+
+    """
+
+    codes, weights, lat, long = network
+
+    month = rng.integers(1, 13, rows)
+    day = rng.integers(1, 29, rows)
+    dates = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}))
+
+    carrier_codes = np.array(list(CARRIERS))
+    carrier_weights = np.array([share for _, share in CARRIERS.values()])
+    carrier = rng.choice(carrier_codes, rows, p=carrier_weights/carrier_weights.sum())
+
+    origin = rng.choice(len(codes), rows, p=weights)
+    dest = rng.choice(len(codes), rows, p=weights)
+
+    # Flights to their own origin are drawn again, origin and destination
+    # from the same weights, so a route is as frequent as its return route
+    same = np.flatnonzero(origin == dest)
+    while len(same):
+        origin[same] = rng.choice(len(codes), len(same), p=weights)
+        dest[same] = rng.choice(len(codes), len(same), p=weights)
+        same = same[origin[same] == dest[same]]
+
+    # Great circle distance in miles
+    lat1, lat2 = np.radians(lat[origin]), np.radians(lat[dest])
+    dlong = np.radians(long[dest] - long[origin])
+    central = np.arccos(np.clip(np.sin(lat1)*np.sin(lat2) + np.cos(lat1)*np.cos(lat2)*np.cos(dlong), -1, 1))
+    distance = np.maximum((3959*central).round(), 30)
+
+    crs_elapsed = (distance/8 + 30).round()
+    crs_dep = rng.integers(6*60, 23*60, rows)
+    dep_delay = np.round(rng.gamma(0.6, 25, rows) - 8)
+    taxi_out = rng.integers(5, 30, rows).astype(np.float64)
+    taxi_in = rng.integers(2, 15, rows).astype(np.float64)
+    air_time = (crs_elapsed - 20 + rng.normal(0, 5, rows)).round()
+    elapsed = air_time + taxi_out + taxi_in
+    arr_delay = dep_delay + elapsed - crs_elapsed
+
+    cancelled = (rng.random(rows) < CANCELLED_RATE).astype(np.int64)
+    diverted = ((rng.random(rows) < DIVERTED_RATE) & (cancelled == 0)).astype(np.int64)
+    not_flown = (cancelled == 1) | (diverted == 1)
+
+    df = pd.DataFrame({
+        'Year': year,
+        'Month': month,
+        'DayofMonth': day,
+        'DayOfWeek': dates.dt.dayofweek.values + 1,
+        'DepTime': _hhmm(crs_dep + dep_delay).astype(np.float64),
+        'CRSDepTime': _hhmm(crs_dep),
+        'ArrTime': _hhmm(crs_dep + dep_delay + elapsed).astype(np.float64),
+        'CRSArrTime': _hhmm(crs_dep + crs_elapsed).astype(np.int64),
+        'UniqueCarrier': carrier,
+        'FlightNum': rng.integers(1, 3000, rows),
+        'TailNum': None,
+        'ActualElapsedTime': elapsed,
+        'CRSElapsedTime': crs_elapsed,
+        'AirTime': air_time,
+        'ArrDelay': arr_delay,
+        'DepDelay': dep_delay,
+        'Origin': codes[origin],
+        'Dest': codes[dest],
+        'Distance': distance.astype(np.int64),
+        'TaxiIn': taxi_in,
+        'TaxiOut': taxi_out,
+        'Cancelled': cancelled,
+        'CancellationCode': None,
+        'Diverted': diverted,
+        'CarrierDelay': np.nan,
+        'WeatherDelay': np.nan,
+        'NASDelay': np.nan,
+        'SecurityDelay': np.nan,
+        'LateAircraftDelay': np.nan,
+    }, columns=COLUMNS)
+
+    # Flights that did not arrive have no actual times
+    for column in ['ArrTime', 'ActualElapsedTime', 'AirTime', 'ArrDelay', 'TaxiIn']:
+        df.loc[not_flown, column] = np.nan
+    for column in ['DepTime', 'DepDelay', 'TaxiOut']:
+        df.loc[cancelled == 1, column] = np.nan
+
+    df.loc[rng.random(rows) < ARR_DELAY_NA_RATE, 'ArrDelay'] = np.nan
+
+    if year >= FIRST_TAILNUM_YEAR:
+        fleet = rng.integers(0, len(next(iter(tails.values()))), rows)
+        tail = np.empty(rows, dtype=object)
+        for code in CARRIERS:
+            mask = carrier == code
+            tail[mask] = tails[code][fleet[mask]]
+        df['TailNum'] = tail
+
+    if year >= FIRST_DELAY_CAUSE_YEAR:
+        df['CancellationCode'] = np.where(cancelled == 1, rng.choice(['A', 'B', 'C', 'D'], rows), None)
+
+        # Delay causes are only reported for flights arriving 15 minutes late
+        late = (df.ArrDelay.values >= 15)
+        shares = rng.dirichlet(np.ones(5), rows)
+        for i, column in enumerate(['CarrierDelay', 'WeatherDelay', 'NASDelay',
+                                    'SecurityDelay', 'LateAircraftDelay']):
+            df[column] = np.where(late, np.floor(shares[:, i]*df.ArrDelay.values), np.nan)
+            df.loc[~late & ~not_flown, column] = 0
+
+    return df
+
+
+def generate_year(year, rows, directory='source', compress=False, seed=0):
+
+    """
+    Write a synthetic yearly csv file with the schema of the stat-computing.org files
+
+    Parameters
+    ----------
+    year : int
+        Year of the flights
+    rows : int
+        Number of flights of the year
+    directory : str (optional)
+        Folder where the file is written
+    compress : bool (optional)
+        if True, write <year>.csv.bz2 instead of <year>.csv
+    seed : int (optional)
+        Seed of the generator, the same seed and year always give the same file
+
+    Returns
+    ----------
+    filepath : str
+        Complete filepath of the written file
+
+    """
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    filepath = os.path.join(directory, '{}.csv'.format(year) + ('.bz2' if compress else ''))
+
+    rng = np.random.default_rng([seed, year])
+    network = _network(seed)
+    tails = _tail_numbers(seed)
+
+    if compress:
+        import bz2
+        file = bz2.open(filepath, 'wt', newline='')
+    else:
+        file = open(filepath, 'w', newline='')
+
+    with file:
+        for block in range(0, max(rows, 1), BLOCK_SIZE):
+            df = generate_block(year, min(BLOCK_SIZE, rows - block), rng, network, tails)
+            df.to_csv(file, index=False, header=(block == 0), na_rep='NA', float_format='%.0f')
+            del df
+
+    return filepath
+
+
+def generate_supplemental_data(directory='source', seed=0):
+
+    """
+    Write airports.csv, carriers.csv and plane-data.csv matching the synthetic network
+
+    Parameters
+    ----------
+    directory : str (optional)
+        Folder where the files are written
+    seed : int (optional)
+        Seed of the generator, the same as generate_year
+
+    Returns
+    ----------
+    filepath : list of str
+        Complete filepath of the written files
+
+    """
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    codes, _, lat, long = _network(seed)
+    rng = np.random.default_rng([seed, 0])
+
+    airports = pd.DataFrame({'iata': codes,
+                             'airport': ['{} Airport'.format(code) for code in codes],
+                             'city': ['{} City'.format(code) for code in codes],
+                             'state': rng.choice(['CA', 'TX', 'IL', 'GA', 'NY', 'AZ', 'FL'], len(codes)),
+                             'country': 'USA',
+                             'lat': lat,
+                             'long': long})
+
+    carriers = pd.DataFrame({'Code': list(CARRIERS),
+                             'Description': [name for name, _ in CARRIERS.values()]})
+
+    tails = np.concatenate(list(_tail_numbers(seed).values()))
+    year = rng.integers(1960, 2008, len(tails)).astype(object)
+    year[rng.random(len(tails)) < 0.05] = 'None'
+    plane_data = pd.DataFrame({'tailnum': tails,
+                               'type': 'Corporation',
+                               'manufacturer': rng.choice(['BOEING', 'AIRBUS', 'MCDONNELL DOUGLAS'], len(tails)),
+                               'issue_date': '01/01/2000',
+                               'model': rng.choice(['737-7H4', 'A320-232', 'MD-88'], len(tails)),
+                               'status': 'Valid',
+                               'aircraft_type': 'Fixed Wing Multi-Engine',
+                               'engine_type': 'Turbo-Fan',
+                               'year': year})
+
+    filepath = []
+    for name, df in [('airports', airports), ('carriers', carriers), ('plane-data', plane_data)]:
+        filepath.append(os.path.join(directory, name + '.csv'))
+        df.to_csv(filepath[-1], index=False)
+
+    return filepath
+
+
+def generate_flights_data(start_year=1987, last_year=2008, rows=100000, directory='source',
+                          compress=False, seed=0):
+
+    """
+    Write synthetic yearly csv files and the supplemental files
+
+    Parameters
+    ----------
+    start_year : int (optional)
+        First year to be generated
+    last_year : int (optional)
+        Last year to be generated
+    rows : int (optional)
+        Number of flights of each year
+    directory : str (optional)
+        Folder where the files are written
+    compress : bool (optional)
+        if True, write bz2 files as the stat-computing.org downloads
+    seed : int (optional)
+        Seed of the generator
+
+    Returns
+    ----------
+    filepath : list of str
+        Complete filepath of the yearly files
+
+    """
+
+    filepath = [generate_year(year, rows, directory, compress, seed)
+                for year in range(start_year, last_year+1)]
+    generate_supplemental_data(directory, seed)
+
+    return filepath